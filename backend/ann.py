@@ -0,0 +1,182 @@
+import os
+from typing import Any, Dict, Optional
+import numpy as np
+import faiss
+
+INDEX_KINDS = ("flat", "ivf", "ivfpq", "hnsw")
+# How the index stores each vector: f32 (exact), f16 / int8 scalar quantization (1/2 and 1/4 of the
+# f32 bytes), or pq codes (pq_m bytes per vector at 8 bits). ivfpq always stores pq codes.
+CODECS = ("f32", "f16", "int8", "pq")
+
+
+def index_config() -> Dict[str, Any]:
+    return {
+        "kind": os.getenv("RAG_INDEX", "flat").lower(),
+        "codec": os.getenv("RAG_VECTORS", "f32").lower(),
+        "nlist": int(os.getenv("RAG_IVF_NLIST", "0")),
+        "pq_m": int(os.getenv("RAG_PQ_M", "64")),
+        "pq_bits": int(os.getenv("RAG_PQ_BITS", "8")),
+        "hnsw_m": int(os.getenv("RAG_HNSW_M", "32")),
+        "ef_construction": int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "80")),
+        "nprobe": int(os.getenv("RAG_NPROBE", "16")),
+        "ef_search": int(os.getenv("RAG_EF_SEARCH", "64")),
+    }
+
+
+def effective_kind(n: int, d: int, cfg: Dict[str, Any]) -> str:
+    # Small corpora gain nothing from approximate search and cannot train the quantizers.
+    kind = cfg["kind"] if cfg["kind"] in INDEX_KINDS else "flat"
+    if kind in ("ivf", "ivfpq") and n < 39 * 16:
+        return "flat"
+    if kind == "ivfpq" and (d % cfg["pq_m"] != 0 or n < 39 * 2 ** cfg["pq_bits"]):
+        return "ivf"
+    if kind == "hnsw" and n < 1000:
+        return "flat"
+    return kind
+
+
+def effective_codec(n: int, d: int, cfg: Dict[str, Any]) -> str:
+    kind = effective_kind(n, d, cfg)
+    if kind == "ivfpq":
+        return "pq"
+    codec = cfg.get("codec", "f32")
+    codec = codec if codec in CODECS else "f32"
+    # PQ needs enough points to train its codebooks; HNSW over PQ codes is not worth its recall.
+    if codec == "pq" and (kind == "hnsw" or d % cfg["pq_m"] != 0 or n < 39 * 2 ** cfg["pq_bits"]):
+        return "int8"
+    return codec
+
+
+_SQ_TYPES = {"f16": "QT_fp16", "int8": "QT_8bit"}
+
+
+def _nlist(n: int, cfg: Dict[str, Any]) -> int:
+    nlist = cfg["nlist"] or int(4 * np.sqrt(n))
+    # faiss wants roughly 39 training points per centroid.
+    return max(1, min(nlist, n // 39))
+
+
+def index_tag(n: int, d: int, cfg: Dict[str, Any] = None) -> str:
+    cfg = cfg or index_config()
+    kind = effective_kind(n, d, cfg)
+    codec = effective_codec(n, d, cfg)
+    pq = f"pq{cfg['pq_m']}x{cfg['pq_bits']}"
+    sq = "" if codec in ("f32", "pq") else f"_{codec}"
+    if kind in ("ivf", "ivfpq"):
+        return f"ivf{_nlist(n, cfg)}" + (pq if codec == "pq" else sq)
+    if kind == "hnsw":
+        return f"hnsw{cfg['hnsw_m']}{sq}"
+    return pq if codec == "pq" else f"flat{sq}"
+
+
+# Rows copied to float32 per index.add call, so a memory-mapped matrix (ingest.py) is never loaded whole.
+ADD_CHUNK = 65536
+
+
+def _training_sample(mat: np.ndarray, n: int, cfg: Dict[str, Any]) -> np.ndarray:
+    # Evenly spaced rows: enough for the coarse centroids and codebooks without reading every row.
+    size = min(n, max(100000, 64 * _nlist(n, cfg)))
+    if size == n:
+        return np.ascontiguousarray(mat, dtype=np.float32)
+    return np.ascontiguousarray(mat[np.linspace(0, n - 1, size).astype(np.int64)], dtype=np.float32)
+
+
+def build_index(mat: np.ndarray, cfg: Dict[str, Any] = None) -> faiss.Index:
+    cfg = cfg or index_config()
+    n, d = mat.shape
+    kind = effective_kind(n, d, cfg)
+    codec = effective_codec(n, d, cfg)
+    metric = faiss.METRIC_INNER_PRODUCT
+    sq = getattr(faiss.ScalarQuantizer, _SQ_TYPES[codec]) if codec in _SQ_TYPES else None
+    if kind in ("ivf", "ivfpq"):
+        quantizer = faiss.IndexFlatIP(d)
+        if codec == "pq":
+            index = faiss.IndexIVFPQ(quantizer, d, _nlist(n, cfg), cfg["pq_m"], cfg["pq_bits"], metric)
+        elif sq is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, _nlist(n, cfg), sq, metric)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, d, _nlist(n, cfg), metric)
+        index.nprobe = cfg["nprobe"]
+    elif kind == "hnsw":
+        if sq is not None:
+            index = faiss.IndexHNSWSQ(d, sq, cfg["hnsw_m"], metric)
+        else:
+            index = faiss.IndexHNSWFlat(d, cfg["hnsw_m"], metric)
+        index.hnsw.efConstruction = cfg["ef_construction"]
+        index.hnsw.efSearch = cfg["ef_search"]
+    elif codec == "pq":
+        index = faiss.IndexPQ(d, cfg["pq_m"], cfg["pq_bits"], metric)
+    elif sq is not None:
+        index = faiss.IndexScalarQuantizer(d, sq, metric)
+    else:
+        index = faiss.IndexFlatIP(d)
+    if not index.is_trained:
+        index.train(_training_sample(mat, n, cfg))
+    for start in range(0, n, ADD_CHUNK):
+        index.add(np.ascontiguousarray(mat[start:start + ADD_CHUNK], dtype=np.float32))
+    return index
+
+
+def exact_vectors(index: faiss.Index) -> Optional[np.ndarray]:
+    # The stored vectors when the index keeps them uncompressed, else None: decoded int8/pq codes
+    # are approximations and must not be reused as embeddings.
+    storage = index.storage if isinstance(index, faiss.IndexHNSW) else index
+    if not isinstance(faiss.downcast_index(storage), faiss.IndexFlat) or index.ntotal == 0:
+        return None
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def configure(index: faiss.Index, cfg: Dict[str, Any] = None) -> faiss.Index:
+    cfg = cfg or index_config()
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = cfg["nprobe"]
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = cfg["ef_search"]
+    return index
+
+
+def read_index(path: str, mmap: bool = True) -> faiss.Index:
+    if mmap:
+        # Read-only maps instead of copies in each worker's heap, so the page cache holds one copy
+        # for all of them: IVF inverted lists with IO_FLAG_MMAP, flat/sq/pq codes (and HNSW storage)
+        # with IO_FLAG_MMAP_IFC. The two flags cannot be combined, so the file's fourcc picks one.
+        try:
+            with open(path, "rb") as f:
+                ivf = f.read(2) == b"Iw"
+            flag = faiss.IO_FLAG_MMAP if ivf else getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except Exception:
+            pass
+    return faiss.read_index(path)
+
+
+def code_size(index: faiss.Index) -> int:
+    # Bytes stored per vector, excluding the IVF ids and the HNSW graph links.
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return int(ivf.code_size)
+    storage = index.storage if isinstance(index, faiss.IndexHNSW) else index
+    try:
+        return int(storage.sa_code_size())
+    except RuntimeError:
+        return 4 * index.d
+
+
+def search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Optional[Any]:
+    if nprobe is None and ef_search is None:
+        return None
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe is not None:
+        # Probing more lists than the index has only costs time.
+        return faiss.SearchParametersIVF(nprobe=max(1, min(int(nprobe), ivf.nlist)))
+    if isinstance(index, faiss.IndexHNSW) and ef_search is not None:
+        return faiss.SearchParametersHNSW(efSearch=max(1, int(ef_search)))
+    return None
+
+
+def search(index: faiss.Index, qv: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    params = search_params(index, nprobe, ef_search)
+    if params is None:
+        return index.search(qv, k)
+    return index.search(qv, k, params=params)
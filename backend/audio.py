@@ -0,0 +1,59 @@
+import os
+import tempfile
+import subprocess
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def decode_audio_bytes(data: bytes, sr: int = SAMPLE_RATE, timeout: float = None) -> np.ndarray:
+    # Upload bytes go in on stdin and 16 kHz mono s16le PCM comes back on stdout, no files touched.
+    # ffmpeg turns off keyboard interaction by itself when the input is a pipe.
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr),
+        "pipe:1",
+    ]
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, check=False)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed: {proc.stderr.decode('utf-8', 'ignore').strip()[-300:]}")
+    if not proc.stdout:
+        raise RuntimeError("ffmpeg decode produced no audio")
+    return np.frombuffer(proc.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def decode_audio_tempfile(data: bytes, temp_dir: str = None) -> np.ndarray:
+    import whisper
+    fd, temp_path = tempfile.mkstemp(prefix="voice_", suffix=".webm", dir=temp_dir)
+    temp_wav = temp_path[:-len(".webm")] + ".wav"
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # Convert to 16kHz mono WAV for maximum compatibility
+        try:
+            subprocess.run(
+                ["ffmpeg", "-y", "-i", temp_path, "-ar", str(SAMPLE_RATE), "-ac", "1", temp_wav],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            source_path = temp_wav
+        except Exception:
+            # Fallback to original WEBM if conversion fails
+            source_path = temp_path
+        return whisper.load_audio(source_path)
+    finally:
+        for p in (temp_path, temp_wav):
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
+
+
+def load_audio_bytes(data: bytes, temp_dir: str = None) -> np.ndarray:
+    try:
+        return decode_audio_bytes(data)
+    except (OSError, RuntimeError, subprocess.TimeoutExpired):
+        # Some containers (e.g. mp4 with a trailing moov atom) need a seekable input.
+        return decode_audio_tempfile(data, temp_dir)
@@ -0,0 +1,84 @@
+# Recall@k vs. per-query latency of the ANN index kinds against the exact Flat baseline, on a
+# synthetic clustered corpus of unit vectors (embedding-like: queries sit near documents).
+#
+#   python bench/ann_recall.py --n 100000 --dim 256
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ann
+
+
+def corpus(n: int, d: int, clusters: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, d)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, d)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+
+
+def queries(x: np.ndarray, nq: int, seed: int = 8) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = x[rng.integers(0, len(x), nq)] + 0.3 * rng.standard_normal((nq, x.shape[1])).astype(np.float32)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q.astype(np.float32)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def timed_search(index, q: np.ndarray, k: int, **params):
+    # One query at a time, as the API issues them.
+    t0 = time.perf_counter()
+    out = np.vstack([ann.search(index, q[i:i + 1], k, **params)[1] for i in range(len(q))])
+    return out, (time.perf_counter() - t0) / len(q) * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--clusters", type=int, default=500)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    ap.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    ap.add_argument("--pq-m", type=int, default=32)
+    args = ap.parse_args()
+
+    x = corpus(args.n, args.dim, args.clusters)
+    q = queries(x, args.queries)
+    rows = []
+    for kind in ann.INDEX_KINDS:
+        cfg = dict(ann.index_config(), kind=kind, pq_m=args.pq_m)
+        t0 = time.perf_counter()
+        index = ann.build_index(x, cfg)
+        build_s = time.perf_counter() - t0
+        tag = ann.index_tag(args.n, args.dim, cfg)
+        if kind == "flat":
+            truth, us = timed_search(index, q, args.k)
+            rows.append({"index": tag, "build_s": round(build_s, 2), "param": None, "recall": 1.0, "us_per_query": round(us, 1)})
+            continue
+        sweep = [{"ef_search": e} for e in args.ef_search] if kind == "hnsw" else [{"nprobe": p} for p in args.nprobe]
+        for params in sweep:
+            found, us = timed_search(index, q, args.k, **params)
+            rows.append({
+                "index": tag,
+                "build_s": round(build_s, 2),
+                "param": params,
+                "recall": round(recall(found, truth), 4),
+                "us_per_query": round(us, 1),
+            })
+    for r in rows:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Load test: concurrent analyze_case_async calls while one request hits a slow embeddings call.
+#
+#   python bench/event_loop_latency.py --requests 200 --slow 2.0
+#
+# "blocking" replays the old behaviour (synchronous embed + FAISS search on the event loop),
+# "async" uses RAGIndex.aretrieve. With blocking retrieval every request queued behind the
+# slow call inherits its latency; with async retrieval only the slow request pays for it.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import hashlib
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("EMBED_CACHE", "0")
+os.environ.setdefault("QUERY_CACHE_SIZE", "0")
+
+import numpy as np
+import faiss
+import pipeline
+from triage import TriageEngine
+from rag import retrieve_context
+
+DIM = 64
+
+
+def _vec(text: str) -> list:
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32).tolist()
+
+
+def _embedding_response(texts) -> SimpleNamespace:
+    return SimpleNamespace(data=[SimpleNamespace(embedding=_vec(t)) for t in texts])
+
+
+def _chat_response(messages) -> SimpleNamespace:
+    if "Extract only symptoms" in messages[0]["content"]:
+        text = messages[1]["content"].split("\n")[0].replace("Input:", "")
+        content = json.dumps({"symptoms": [p.strip() for p in text.split(",") if p.strip()]})
+    else:
+        content = json.dumps({"possible_risk_pattern": "bench", "risk_level": "Medium", "recommended_actions": ["Rest"], "referral_needed": False})
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeUpstream:
+    def __init__(self, fast: float, slow: float) -> None:
+        self.fast = fast
+        self.slow = slow
+
+    def delay(self, texts) -> float:
+        return self.slow if any("slow" in t for t in texts) else self.fast
+
+    def sync_client(self) -> SimpleNamespace:
+        def create(model, input, dimensions=None):
+            time.sleep(self.delay(input))
+            return _embedding_response(input)
+        client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+        # RAGIndex._embed passes the stage budget through with_options(timeout=...).
+        client.with_options = lambda **kwargs: client
+        return client
+
+    def async_client(self) -> SimpleNamespace:
+        async def embed(model, input, dimensions=None):
+            await asyncio.sleep(self.delay(input))
+            return _embedding_response(input)
+
+        async def chat(model, messages, temperature=0, response_format=None):
+            await asyncio.sleep(self.fast)
+            return _chat_response(messages)
+        return SimpleNamespace(
+            embeddings=SimpleNamespace(create=embed),
+            chat=SimpleNamespace(completions=SimpleNamespace(create=chat)),
+        )
+
+
+def make_engine(upstream: FakeUpstream) -> TriageEngine:
+    engine = TriageEngine(os.path.join(os.path.dirname(__file__), "..", "guidelines.json"))
+    index = engine.index
+    mat = np.array([_vec(" ".join(index._norm_texts([e["guideline"]]))) for e in index.entries], dtype=np.float32)
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+    index.index = faiss.IndexFlatIP(DIM)
+    index.index.add(mat)
+    index.emb_dim = DIM
+    index.dense = True
+    index._openai = upstream.sync_client()
+    index._async_openai = upstream.async_client()
+    engine.async_client = upstream.async_client()
+    return engine
+
+
+def pct(values, p) -> float:
+    return float(np.percentile(values, p)) * 1000 if values else 0.0
+
+
+async def run(engine: TriageEngine, n: int, slow_at: int) -> list:
+    latencies = []
+
+    async def one(i: int) -> None:
+        text = "slow fever, cough" if i == slow_at else f"fever, cough, case {i}"
+        t0 = time.perf_counter()
+        await engine.analyze_case_async(text)
+        if i != slow_at:
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return latencies
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--fast", type=float, default=0.02, help="normal upstream latency (s)")
+    ap.add_argument("--slow", type=float, default=2.0, help="latency of the one slow embeddings call (s)")
+    args = ap.parse_args()
+    upstream = FakeUpstream(args.fast, args.slow)
+    engine = make_engine(upstream)
+    # The speculative query is built from the lexicon and never contains "slow", so with
+    # speculation on the slow embeddings call would not be made on the request path at all.
+    engine._pipeline.speculate = False
+    report = {}
+    # The retrieve stage lives in pipeline.py (AsyncCalls.retrieve), so that is the name to swap.
+    original = pipeline.aretrieve_context
+
+    async def blocking(index, query, top_k=3, **kwargs):
+        return retrieve_context(index, query, top_k=top_k, **kwargs)
+
+    for mode in ("blocking", "async"):
+        pipeline.aretrieve_context = blocking if mode == "blocking" else original
+        # Each mode starts cold; otherwise the second one is served from the first one's caches.
+        engine.result_cache.clear()
+        engine.index.query_cache.clear()
+        lat = asyncio.run(run(engine, args.requests, slow_at=args.requests // 10))
+        report[mode] = {"p50_ms": round(pct(lat, 50), 1), "p99_ms": round(pct(lat, 99), 1), "max_ms": round(pct(lat, 100), 1)}
+    pipeline.aretrieve_context = original
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# Local stand-in for the OpenAI endpoints the backend calls, for offline benchmarks:
+# /chat/completions, /embeddings and /audio/transcriptions (with or without the /v1 prefix).
+# Latency, jitter, error rate and a slow tail are configurable per endpoint; responses are
+# deterministic. POST /admin/profile changes the profiles while running, e.g. to stage an outage
+# and a recovery: {"chat": {"error_rate": 1.0}} or {"*": {"latency_ms": 30000}}.
+#
+#   python bench/fake_openai.py --port 8765 --latency-ms 300 --jitter-ms 100 --error-rate 0.01
+#   python bench/fake_openai.py --slow-rate 0.05 --slow-ms 4000   # 5% of responses take 4 s
+#   OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=bench uvicorn main:app
+import re
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ENDPOINTS = ("chat", "embeddings", "transcriptions")
+DEFAULT_DIM = 1536
+
+# Symptom words the fake "LLM" recognises in case text; enough to give the retriever and the
+# reranker realistic queries.
+_SYMPTOM_WORDS = [
+    "chest pain", "shortness of breath", "fever", "cough", "headache", "vomiting", "diarrhea",
+    "rash", "yellow eyes", "bleeding", "dizziness", "sweating", "abdominal pain", "swelling",
+    "stiff neck", "confusion", "fatigue", "sore throat", "back pain", "burning urination",
+]
+
+
+class Profile:
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float, slow_rate: float = 0.0, slow_ms: float = 0.0) -> None:
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow = slow_ms / 1000.0
+
+    def delay(self, rng: random.Random) -> float:
+        if self.slow_rate and rng.random() < self.slow_rate:
+            return self.slow
+        return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+
+    def update(self, changes: Dict[str, float]) -> None:
+        for k, v in changes.items():
+            if k in ("latency_ms", "jitter_ms", "slow_ms"):
+                setattr(self, {"latency_ms": "latency", "jitter_ms": "jitter", "slow_ms": "slow"}[k], float(v) / 1000.0)
+            elif k in ("error_rate", "slow_rate"):
+                setattr(self, k, float(v))
+
+
+def _vector(text: str, dim: int) -> np.ndarray:
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def _symptoms(text: str) -> List[str]:
+    t = text.lower()
+    return [w for w in _SYMPTOM_WORDS if w in t]
+
+
+def _user_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+
+
+def _case_text(user: str) -> str:
+    # Only the case itself, not the guideline context that follows it in classification prompts.
+    m = re.search(r"^(?:Input|Symptoms):\s*(.*)$", user, re.M)
+    return m.group(1) if m else user
+
+
+def chat_content(messages: List[Dict[str, Any]]) -> str:
+    system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system").lower()
+    user = _user_text(messages)
+    symptoms = _symptoms(_case_text(user))
+    if "extract only symptoms" in system:
+        return json.dumps({"symptoms": symptoms})
+    high = any(s in symptoms for s in ("chest pain", "shortness of breath", "bleeding", "stiff neck", "confusion"))
+    out = {
+        "possible_risk_pattern": symptoms[0] if symptoms else "unclear",
+        "risk_level": "High" if high else ("Medium" if symptoms else "Low"),
+        "recommended_actions": ["Monitor symptoms", "Refer to nearest health centre"] if high else ["Rest and fluids"],
+        "referral_needed": high,
+    }
+    # Prompts whose JSON template asks for both stages get the symptoms alongside the classification.
+    if '"symptoms"' in user:
+        out["symptoms"] = symptoms
+    return json.dumps(out)
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "fake-openai/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        pass
+
+    def _endpoint(self) -> Optional[str]:
+        path = re.sub(r"^/v1", "", self.path.split("?")[0])
+        return {"/chat/completions": "chat", "/embeddings": "embeddings", "/audio/transcriptions": "transcriptions"}.get(path)
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") in ("", "/health"):
+            self._send(200, {"status": "ok", "counts": self.server.counts})
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.path.rstrip("/") == "/admin/profile":
+            changes = json.loads(raw or b"{}")
+            with self.server.lock:
+                for name, profile in self.server.profiles.items():
+                    profile.update({**changes.get("*", {}), **changes.get(name, {})})
+            self._send(200, {"ok": True})
+            return
+        name = self._endpoint()
+        if name is None:
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        srv = self.server
+        with srv.lock:
+            srv.counts[name] = srv.counts.get(name, 0) + 1
+            delay = srv.profiles[name].delay(srv.rng)
+            fail = srv.rng.random() < srv.profiles[name].error_rate
+        time.sleep(delay)
+        if fail:
+            with srv.lock:
+                srv.counts["errors"] = srv.counts.get("errors", 0) + 1
+            self._send(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+        if name == "transcriptions":
+            # Multipart body; the audio itself is irrelevant here.
+            self._send(200, {"text": "mujhe teen din se bukhar aur khansi hai"})
+            return
+        req = json.loads(raw or b"{}")
+        if name == "embeddings":
+            inputs = req.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            dim = int(req.get("dimensions") or DEFAULT_DIM)
+            data = []
+            for i, text in enumerate(inputs):
+                v = _vector(str(text), dim)
+                emb = base64.b64encode(v.tobytes()).decode("ascii") if req.get("encoding_format") == "base64" else v.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": emb})
+            self._send(200, {"object": "list", "data": data, "model": req.get("model", ""), "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+            return
+        content = chat_content(req.get("messages", []))
+        self._send(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs under concurrency, which shows up as 1 s retransmit tails.
+    request_queue_size = 1024
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Hedged and timed-out requests are abandoned by the client mid-response; that is expected.
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def __init__(self, port: int, profiles: Dict[str, Profile], seed: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), Handler)
+        self.profiles = profiles
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+def add_profile_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--latency-ms", type=float, default=200.0, help="base latency for every endpoint")
+    ap.add_argument("--jitter-ms", type=float, default=50.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--slow-rate", type=float, default=0.0, help="fraction of responses delayed by --slow-ms instead")
+    ap.add_argument("--slow-ms", type=float, default=0.0)
+    for name in ENDPOINTS:
+        ap.add_argument(f"--{name}-latency-ms", type=float, default=None)
+        ap.add_argument(f"--{name}-error-rate", type=float, default=None)
+
+
+def profiles_from_args(args: argparse.Namespace) -> Dict[str, Profile]:
+    out = {}
+    for name in ENDPOINTS:
+        lat = getattr(args, f"{name}_latency_ms")
+        err = getattr(args, f"{name}_error_rate")
+        out[name] = Profile(args.latency_ms if lat is None else lat, args.jitter_ms, args.error_rate if err is None else err, args.slow_rate, args.slow_ms)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--seed", type=int, default=0)
+    add_profile_args(ap)
+    args = ap.parse_args()
+    srv = FakeOpenAI(args.port, profiles_from_args(args), args.seed)
+    print(json.dumps({"base_url": srv.base_url}), flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# Offline retrieval at scale: memory and query latency of the BM25 inverted index versus the
+# dense len(docs) x len(vocab) bag-of-words matrix it replaces.
+#
+#   python bench/lexical_scaling.py --docs 1000 10000 50000
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from lexical import BM25Index
+
+
+def corpus(n: int, vocab_size: int, rng: random.Random) -> list:
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    # Zipf-ish draw so a few terms are common and most are rare, like real guideline text.
+    weights = [1.0 / (i + 1) for i in range(vocab_size)]
+    return [rng.choices(vocab, weights=weights, k=rng.randint(30, 80)) for _ in range(n)]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, nargs="+", default=[1000, 10000, 50000])
+    ap.add_argument("--vocab", type=int, default=30000)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+    rng = random.Random(3)
+    rows = []
+    for n in args.docs:
+        docs = corpus(n, args.vocab, rng)
+        t0 = time.perf_counter()
+        idx = BM25Index(docs)
+        build_s = time.perf_counter() - t0
+        queries = [rng.sample(docs[rng.randrange(n)], 4) for _ in range(args.queries)]
+        t0 = time.perf_counter()
+        for q in queries:
+            idx.search(q, 5)
+        query_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        rows.append({
+            "docs": n,
+            "vocab": len(idx.vocab),
+            "bm25_mb": round(idx.nbytes() / 2 ** 20, 2),
+            "dense_bow_mb": round(n * len(idx.vocab) * np.dtype(np.float32).itemsize / 2 ** 20, 1),
+            "build_s": round(build_s, 2),
+            "query_ms": round(query_ms, 3),
+        })
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
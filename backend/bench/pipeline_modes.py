@@ -0,0 +1,105 @@
+# Two-call vs. fused pipeline (and, with --fastpath, two-call with the local lexicon fast path):
+# latency, chat completions per case and agreement with the two-call results (risk level, referral,
+# symptom-set Jaccard) on the same cases. Runs against bench/fake_openai.py by default; --live
+# uses OPENAI_API_KEY / OPENAI_API_BASE from the environment instead, which is the only way to
+# measure real agreement since the fake answers both LLM modes the same way.
+#
+#   python bench/pipeline_modes.py --requests 100 --concurrency 8 --latency-ms 300 --fastpath 0.9
+#   OPENAI_API_KEY=... python bench/pipeline_modes.py --live --requests 50
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, HERE)
+
+from fake_openai import add_profile_args
+from suite import case_texts, drive, summarize, start_fake
+
+
+def chat_calls() -> int:
+    from metrics import STAGE_SECONDS
+    return sum(STAGE_SECONDS.count(stage=s, path="llm") for s in ("extract_symptoms", "classify", "triage"))
+
+
+def jaccard(a: List[str], b: List[str]) -> float:
+    a, b = {s.lower() for s in a}, {s.lower() for s in b}
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def agreement(base: List[Dict[str, Any]], other: List[Dict[str, Any]]) -> Dict[str, Any]:
+    pairs = [(a, b) for a, b in zip(base, other) if a and b]
+    n = max(1, len(pairs))
+    return {
+        "cases": len(pairs),
+        "risk_level": round(sum(a["risk_level"] == b["risk_level"] for a, b in pairs) / n, 3),
+        "referral_needed": round(sum(a["referral_needed"] == b["referral_needed"] for a, b in pairs) / n, 3),
+        "symptom_jaccard": round(sum(jaccard(a["symptoms"], b["symptoms"]) for a, b in pairs) / n, 3),
+    }
+
+
+def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from triage import TriageEngine
+    engine = TriageEngine(os.path.join(BACKEND, "guidelines.json"))
+    texts = case_texts(args.requests)
+    configs = [("two_call", "two_call", 0.0), ("fused", "fused", 0.0)]
+    if args.fastpath:
+        configs.append(("two_call+fastpath", "two_call", args.fastpath))
+    rows, baseline = [], None
+    for name, mode, fastpath in configs:
+        engine.pipeline_mode = mode
+        engine.fastpath_confidence = fastpath
+        results: List[Dict[str, Any]] = [None] * len(texts)
+
+        async def call(i: int) -> None:
+            results[i] = await engine.analyze_case_async(texts[i])
+
+        calls = chat_calls()
+        lat, err, wall = asyncio.run(drive(len(texts), args.concurrency, call))
+        row = {"mode": name, "concurrency": args.concurrency, **summarize(lat, err, wall),
+               "chat_calls_per_case": round((chat_calls() - calls) / len(texts), 2)}
+        if fastpath:
+            row["local_share"] = round(sum(engine._fast_path(t) is not None for t in texts) / len(texts), 3)
+        if baseline is None:
+            baseline = results
+        else:
+            row["agreement"] = agreement(baseline, results)
+        rows.append(row)
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--live", action="store_true", help="call the configured OpenAI endpoint instead of the fake")
+    ap.add_argument("--fastpath", type=float, default=0.0, help="also run two-call with LOCAL_FASTPATH_CONFIDENCE at this value")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    fake = None
+    cache_dir = tempfile.mkdtemp(prefix="sanjeevani-bench-")
+    # Caches off so every case pays for its LLM calls in both modes.
+    os.environ.update({"EMBED_CACHE_DIR": cache_dir, "QUERY_CACHE_SIZE": "0", "RESULT_CACHE_SIZE": "0"})
+    if not args.live:
+        fake, base_url = start_fake(args)
+        os.environ.update({"OPENAI_API_BASE": base_url, "OPENAI_API_KEY": "bench"})
+    try:
+        rows = run(args)
+    finally:
+        if fake is not None:
+            fake.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    for r in rows:
+        print(json.dumps({k: v for k, v in r.items() if k != "requests"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Per-request cost and retained memory of the rate limiter as the number of distinct clients grows:
+# the old list-of-timestamps limiter from main.py vs. TokenBucketLimiter (in-process) and
+# SQLiteTokenBucketLimiter (shared between workers).
+#
+#   python bench/ratelimit_scaling.py --clients 1000 10000 100000
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ratelimit import TokenBucketLimiter, SQLiteTokenBucketLimiter
+
+
+class ListLimiter:
+    # The limiter main.py used before: a timestamp list per IP, rebuilt on every request, never evicted.
+    def __init__(self, limit: int = 30, window: float = 60.0) -> None:
+        self.limit = limit
+        self.window = window
+        self.state = {}
+
+    def allow(self, ip: str) -> bool:
+        now = time.time()
+        bucket = self.state.get(ip, [])
+        bucket = [t for t in bucket if now - t < self.window]
+        if len(bucket) >= self.limit:
+            self.state[ip] = bucket
+            return False
+        bucket.append(now)
+        self.state[ip] = bucket
+        return True
+
+
+def run(limiter, keys) -> float:
+    t0 = time.perf_counter()
+    for k in keys:
+        limiter.allow(k)
+    return (time.perf_counter() - t0) / len(keys) * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--requests", type=int, default=200000)
+    ap.add_argument("--max-keys", type=int, default=10000)
+    ap.add_argument("--sqlite-requests", type=int, default=20000)
+    args = ap.parse_args()
+    rng = random.Random(5)
+    rows = []
+    for n in args.clients:
+        ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+        keys = [rng.choice(ips) for _ in range(args.requests)]
+        # Hot clients sit at the limit, so the list limiter rescans a full window of timestamps each time.
+        hot = ips[:10] * (args.requests // 10)
+        for name, make in (
+            ("list", lambda: ListLimiter(limit=30, window=60.0)),
+            ("bucket", lambda: TokenBucketLimiter(30 / 60.0, 30, max_keys=args.max_keys)),
+        ):
+            limiter = make()
+            us = run(limiter, keys)
+            us_hot = run(limiter, hot)
+            # Memory is measured on a separate pass; tracemalloc distorts the timings.
+            tracemalloc.start()
+            limiter = make()
+            run(limiter, keys)
+            mem = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            rows.append({"limiter": name, "clients": n, "us_per_request": round(us, 2), "us_per_request_hot": round(us_hot, 2), "retained_kb": mem // 1024})
+        with tempfile.TemporaryDirectory() as d:
+            limiter = SQLiteTokenBucketLimiter(os.path.join(d, "rl.sqlite"), 30 / 60.0, 30)
+            us = run(limiter, keys[:args.sqlite_requests])
+            rows.append({"limiter": "sqlite", "clients": n, "us_per_request": round(us, 2), "rows": len(limiter)})
+    for r in rows:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Microbenchmark: compiled red-flag matcher vs. the old nested substring loop as the flag list grows.
+#
+#   python bench/redflag_scaling.py --sizes 14 100 1000 5000 --text-words 200
+#
+# Automaton scan time should stay roughly flat in the number of flags (it is linear in text length),
+# while the nested loop grows linearly with the flag count.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from matcher import PhraseMatcher
+from redflag import RED_FLAGS
+
+
+def synthetic_flags(n: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    flags = set(RED_FLAGS)
+    while len(flags) < n:
+        words = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(rng.randint(1, 3))]
+        flags.add(" ".join(words))
+    return sorted(flags)
+
+
+def naive(flags: list, symptoms: list) -> bool:
+    s = {x.lower().strip() for x in symptoms}
+    hits = []
+    for flag in flags:
+        if any(flag in y for y in s):
+            hits.append(flag)
+    return hits
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / repeat)
+    return best * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[14, 100, 1000, 2500, 5000])
+    ap.add_argument("--text-words", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+    rng = random.Random(7)
+    vocab = ["fever", "cough", "pain", "since", "two", "days", "child", "vomiting", "weak", "and", "with", "severe", "chest"]
+    text = " ".join(rng.choice(vocab) for _ in range(args.text_words)) + " unconscious"
+    symptoms = [p.strip() for p in text.split("and") if p.strip()]
+    rows = []
+    for n in args.sizes:
+        flags = synthetic_flags(n, rng)
+        t0 = time.perf_counter()
+        m = PhraseMatcher({f: f for f in flags})
+        build_ms = (time.perf_counter() - t0) * 1000
+        rows.append({
+            "flags": len(flags),
+            "states": len(m.automaton),
+            "build_ms": round(build_ms, 2),
+            "automaton_scan_us": round(timeit(lambda: m.scan(text), args.repeat), 1),
+            "nested_loop_us": round(timeit(lambda: naive(flags, symptoms), max(1, args.repeat // 10)), 1),
+        })
+    print(json.dumps({"text_chars": len(text), "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Rerank cost: the original per-candidate closure vs. GuidelineTermIndex as top_k and the number of
+# symptoms grow. Also checks that both produce the same ordering and fallback_mode.
+#
+#   python bench/rerank_scaling.py --corpus-copies 50
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rag import load_guidelines
+from rerank import GuidelineTermIndex, rerank_naive
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / repeat)
+    return best * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus-copies", type=int, default=50, help="replicate guidelines.json to grow the corpus")
+    ap.add_argument("--top-k", type=int, nargs="+", default=[5, 20, 100, 500])
+    ap.add_argument("--symptoms", type=int, nargs="+", default=[1, 5, 20])
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+    base = load_guidelines(os.path.join(os.path.dirname(__file__), "..", "guidelines.json"))
+    entries = [dict(e, id=f"{e['id']}-{i}") for i in range(args.corpus_copies) for e in base]
+    rng = random.Random(11)
+    vocab = sorted({t for e in base for t in e.get("tags", [])} | {"shortness of breath", "vomiting", "rash", "weakness"})
+    idx = GuidelineTermIndex(entries)
+    rows = []
+    for k in args.top_k:
+        for n_sym in args.symptoms:
+            contexts = rng.sample(entries, min(k, len(entries)))
+            cleaned = rng.sample(vocab, min(n_sym, len(vocab)))
+            assert idx.rerank(cleaned, contexts) == rerank_naive(cleaned, contexts)
+            rows.append({
+                "top_k": len(contexts),
+                "symptoms": len(cleaned),
+                "naive_us": round(timeit(lambda: rerank_naive(cleaned, contexts), args.repeat), 1),
+                "indexed_us": round(timeit(lambda: idx.rerank(cleaned, contexts), args.repeat), 1),
+            })
+    print(json.dumps({"corpus": len(entries), "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# Offline benchmark suite: starts bench/fake_openai.py as the upstream, then drives the engine
+# in-process and /analyze_case and /transcribe over HTTP against a uvicorn subprocess, at each
+# requested concurrency. Reports throughput and p50/p95/p99 per target and per pipeline stage
+# (from the sanjeevani_stage_seconds histogram) and writes everything to a JSON file named after
+# the current commit, so runs can be compared across commits.
+#
+#   python bench/suite.py --requests 200 --concurrency 1 8 32 --latency-ms 200
+#   python bench/suite.py --baseline bench/results/<earlier>.json
+import io
+import os
+import re
+import sys
+import json
+import time
+import wave
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, HERE)
+
+import httpx
+from fake_openai import add_profile_args
+
+TARGETS = ("engine", "analyze_case", "transcribe")
+_WORDS = ["fever", "cough", "chest pain", "headache", "vomiting", "rash", "yellow eyes", "sweating",
+          "shortness of breath", "dizziness", "abdominal pain", "swelling", "sore throat", "bleeding"]
+_JOIN = [", ", " and ", " with ", "; "]
+
+
+def case_texts(n: int, seed: int = 3) -> List[str]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        words = rng.sample(_WORDS, rng.randint(1, 4))
+        text = words[0]
+        for w in words[1:]:
+            text += rng.choice(_JOIN) + w
+        out.append(f"Patient has {text} since {i % 7 + 1} days")
+    return out
+
+
+def silent_wav(seconds: float = 1.0, sr: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(b"\0\0" * int(seconds * sr))
+    return buf.getvalue()
+
+
+def percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[idx]
+
+
+def summarize(latencies: List[float], errors: int, wall: float) -> Dict[str, Any]:
+    lat = sorted(latencies)
+    done = len(lat)
+    return {
+        "requests": done + errors,
+        "errors": errors,
+        "throughput_rps": round(done / wall, 2) if wall > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * sum(lat) / done, 2) if done else 0.0,
+            "p50": round(1000 * percentile(lat, 0.50), 2),
+            "p95": round(1000 * percentile(lat, 0.95), 2),
+            "p99": round(1000 * percentile(lat, 0.99), 2),
+        },
+    }
+
+
+# --- stage histograms --------------------------------------------------------------------------
+
+Series = Dict[str, Tuple[List[Tuple[float, float]], float]]  # series label -> ([(le, cumulative)], count)
+
+_SAMPLE = re.compile(r'^sanjeevani_stage_seconds_bucket\{(.*)\} (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_stage_histogram(text: str) -> Series:
+    series: Dict[str, List[Tuple[float, float]]] = {}
+    for line in text.splitlines():
+        m = _SAMPLE.match(line)
+        if not m:
+            continue
+        labels = dict(_LABEL.findall(m.group(1)))
+        le = labels.pop("le")
+        name = "/".join([labels.pop("stage")] + [f"{k}={v}" for k, v in sorted(labels.items())])
+        series.setdefault(name, []).append((float("inf") if le == "+Inf" else float(le), float(m.group(2))))
+    return {k: (sorted(v), sorted(v)[-1][1]) for k, v in series.items()}
+
+
+def local_stage_histogram() -> Series:
+    import metrics
+    return parse_stage_histogram(metrics.render())
+
+
+def histogram_quantile(buckets: List[Tuple[float, float]], q: float) -> float:
+    # Prometheus-style linear interpolation inside the bucket holding the q-th observation.
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return 0.0
+    rank = q * total
+    prev_le, prev_c = 0.0, 0.0
+    for le, c in buckets:
+        if c >= rank:
+            if le == float("inf"):
+                return prev_le
+            return prev_le + (le - prev_le) * ((rank - prev_c) / (c - prev_c) if c > prev_c else 0.0)
+        prev_le, prev_c = le, c
+    return prev_le
+
+
+def stage_delta(before: Series, after: Series) -> Dict[str, Any]:
+    out = {}
+    for name, (buckets, count) in sorted(after.items()):
+        prev = dict(before.get(name, ([], 0))[0])
+        delta = [(le, c - prev.get(le, 0.0)) for le, c in buckets]
+        n = count - before.get(name, ([], 0))[1]
+        if n <= 0:
+            continue
+        out[name] = {
+            "count": int(n),
+            "p50_ms": round(1000 * histogram_quantile(delta, 0.50), 3),
+            "p95_ms": round(1000 * histogram_quantile(delta, 0.95), 3),
+            "p99_ms": round(1000 * histogram_quantile(delta, 0.99), 3),
+        }
+    return out
+
+
+# --- drivers -----------------------------------------------------------------------------------
+
+async def drive(n: int, concurrency: int, call) -> Tuple[List[float], int, float]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await call(i)
+                latencies.append(time.perf_counter() - t0)
+            except Exception:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return latencies, errors, time.perf_counter() - t0
+
+
+def run_engine(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from triage import TriageEngine
+    engine = TriageEngine(os.path.join(BACKEND, "guidelines.json"))
+    texts = case_texts(args.requests)
+    rows = []
+    for c in args.concurrency:
+        before = local_stage_histogram()
+        lat, err, wall = asyncio.run(drive(len(texts), c, lambda i: engine.analyze_case_async(texts[i])))
+        rows.append({"target": "engine", "concurrency": c, **summarize(lat, err, wall), "stages": stage_delta(before, local_stage_histogram())})
+    return rows
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(env: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"API exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if httpx.get(url + "/ready", timeout=2).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("API did not become ready")
+
+
+async def _http_target(url: str, target: str, n: int, concurrency: int) -> Tuple[List[float], int, float]:
+    texts = case_texts(n, seed=concurrency)
+    audio = silent_wav()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        async def call(i: int) -> None:
+            if target == "analyze_case":
+                r = await client.post("/analyze_case", json={"text": texts[i]})
+            else:
+                r = await client.post("/transcribe", data={"language": "hi"}, files={"audio": ("a.wav", audio, "audio/wav")})
+            r.raise_for_status()
+            if target == "transcribe" and r.json().get("error"):
+                raise RuntimeError(r.json()["error"])
+        return await drive(n, concurrency, call)
+
+
+def run_http(args: argparse.Namespace, env: Dict[str, str], targets: List[str]) -> List[Dict[str, Any]]:
+    proc, url = start_api(env)
+    rows = []
+    try:
+        for target in targets:
+            for c in args.concurrency:
+                before = parse_stage_histogram(httpx.get(url + "/metrics").text)
+                lat, err, wall = asyncio.run(_http_target(url, target, args.requests, c))
+                after = parse_stage_histogram(httpx.get(url + "/metrics").text)
+                rows.append({"target": target, "concurrency": c, **summarize(lat, err, wall), "stages": stage_delta(before, after)})
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return rows
+
+
+def start_fake(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    cmd = [sys.executable, os.path.join(HERE, "fake_openai.py"), "--port", "0",
+           "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+           "--slow-rate", str(args.slow_rate), "--slow-ms", str(args.slow_ms)]
+    for name in ("chat", "embeddings", "transcriptions"):
+        for opt in ("latency_ms", "error_rate"):
+            v = getattr(args, f"{name}_{opt}")
+            if v is not None:
+                cmd += [f"--{name}-{opt.replace('_', '-')}", str(v)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    return proc, json.loads(proc.stdout.readline())["base_url"]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(rows: List[Dict[str, Any]], baseline_path: str) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        base = {(r["target"], r["concurrency"]): r for r in json.load(f)["results"]}
+    for r in rows:
+        b = base.get((r["target"], r["concurrency"]))
+        if not b:
+            continue
+        ratio = lambda new, old: round(new / old, 3) if old else None
+        print(json.dumps({
+            "target": r["target"],
+            "concurrency": r["concurrency"],
+            "throughput_ratio": ratio(r["throughput_rps"], b["throughput_rps"]),
+            "p50_ratio": ratio(r["latency_ms"]["p50"], b["latency_ms"]["p50"]),
+            "p95_ratio": ratio(r["latency_ms"]["p95"], b["latency_ms"]["p95"]),
+            "p99_ratio": ratio(r["latency_ms"]["p99"], b["latency_ms"]["p99"]),
+        }))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    ap.add_argument("--requests", type=int, default=200, help="requests per target and concurrency level")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--warm-caches", action="store_true", help="keep the query/result caches on (off by default so every request runs the full pipeline)")
+    ap.add_argument("--out", default=os.path.join(HERE, "results"))
+    ap.add_argument("--baseline", help="earlier results JSON to compare against")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    fake, base_url = start_fake(args)
+    cache_dir = tempfile.mkdtemp(prefix="sanjeevani-bench-")
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_BASE": base_url,
+        "OPENAI_API_KEY": "bench",
+        "EMBED_CACHE_DIR": cache_dir,
+        "USE_LOCAL_WHISPER": "0",
+        "RATE_LIMIT": "1000000000",
+    })
+    if not args.warm_caches:
+        env.update({"QUERY_CACHE_SIZE": "0", "RESULT_CACHE_SIZE": "0"})
+    os.environ.update(env)
+    rows: List[Dict[str, Any]] = []
+    try:
+        if "engine" in args.targets:
+            rows += run_engine(args)
+        http_targets = [t for t in args.targets if t != "engine"]
+        if http_targets:
+            rows += run_http(args, env, http_targets)
+    finally:
+        fake.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "results": rows,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['meta']['commit'] or 'nogit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    for r in rows:
+        print(json.dumps({k: r[k] for k in ("target", "concurrency", "requests", "errors", "throughput_rps", "latency_ms")}))
+    print(json.dumps({"saved": path}))
+    if args.baseline:
+        compare(rows, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
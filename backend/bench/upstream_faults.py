@@ -0,0 +1,95 @@
+# Deadlines, hedging and the circuit breaker against bench/fake_openai.py, in phases:
+#   tail      5% of upstream responses take --slow-ms; hedging off, then on
+#   outage    chat answers take 60 s: requests must still finish within REQUEST_DEADLINE_S, and
+#             once the breaker opens they stop waiting on the upstream at all
+#   recovery  upstream healthy again: after CIRCUIT_RESET_S the probe closes the breaker
+#
+#   python bench/upstream_faults.py --requests 200 --concurrency 8 --deadline-s 3
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, HERE)
+
+import httpx
+from fake_openai import add_profile_args
+from suite import case_texts, drive, summarize, start_fake
+
+
+def set_profile(base_url: str, changes: Dict[str, Any]) -> None:
+    httpx.post(base_url.rsplit("/v1", 1)[0] + "/admin/profile", json=changes, timeout=5).raise_for_status()
+
+
+def phase(engine, name: str, texts: List[str], concurrency: int) -> Dict[str, Any]:
+    import metrics
+    import resilience
+    fallbacks = metrics.FALLBACKS.value(stage="classify")
+    rejected = metrics.CIRCUIT_REJECTED.value(upstream="chat")
+    lat, err, wall = asyncio.run(drive(len(texts), concurrency, lambda i: engine.analyze_case_async(texts[i])))
+    chat = resilience.CHAT.status()
+    return {
+        "phase": name,
+        **summarize(lat, err, wall),
+        "max_ms": round(1000 * max(lat), 2) if lat else 0.0,
+        "classify_fallbacks": int(metrics.FALLBACKS.value(stage="classify") - fallbacks),
+        "circuit_rejected": int(metrics.CIRCUIT_REJECTED.value(upstream="chat") - rejected),
+        "chat": chat,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--deadline-s", type=float, default=3.0)
+    ap.add_argument("--circuit-reset-s", type=float, default=2.0)
+    add_profile_args(ap)
+    ap.set_defaults(latency_ms=100.0, jitter_ms=20.0, slow_rate=0.05, slow_ms=2000.0)
+    args = ap.parse_args()
+
+    fake, base_url = start_fake(args)
+    cache_dir = tempfile.mkdtemp(prefix="sanjeevani-bench-")
+    os.environ.update({
+        "OPENAI_API_BASE": base_url,
+        "OPENAI_API_KEY": "bench",
+        "EMBED_CACHE_DIR": cache_dir,
+        "QUERY_CACHE_SIZE": "0",
+        "RESULT_CACHE_SIZE": "0",
+        "REQUEST_DEADLINE_S": str(args.deadline_s),
+        "CIRCUIT_RESET_S": str(args.circuit_reset_s),
+        # A short window so the earlier phases' successes do not dilute the outage's failure ratio.
+        "CIRCUIT_WINDOW_S": "2",
+    })
+    rows = []
+    try:
+        import resilience
+        from triage import TriageEngine
+        engine = TriageEngine(os.path.join(BACKEND, "guidelines.json"))
+        texts = case_texts(args.requests)
+        rows.append(phase(engine, "tail/no-hedge", texts, args.concurrency))
+        resilience.CHAT.hedge = resilience.EMBEDDINGS.hedge = True
+        rows.append(phase(engine, "tail/hedge", texts, args.concurrency))
+        resilience.CHAT.hedge = resilience.EMBEDDINGS.hedge = False
+        set_profile(base_url, {"*": {"slow_rate": 0.0}, "chat": {"latency_ms": 60000}})
+        rows.append(phase(engine, "outage", texts[:args.requests // 2], args.concurrency))
+        set_profile(base_url, {"chat": {"latency_ms": args.latency_ms}})
+        time.sleep(args.circuit_reset_s)
+        rows.append(phase(engine, "recovery", texts[:args.requests // 2], args.concurrency))
+    finally:
+        fake.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    for r in rows:
+        print(json.dumps({k: v for k, v in r.items() if k != "requests"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Memory per passage and recall@k of the RAG_VECTORS codecs (f32, f16, int8, pq) against the exact
+# f32 index, on the synthetic corpus from ann_recall.py. Each saved index is loaded in a fresh
+# process, copied onto the heap and then read-only mapped as the workers load it, and the
+# anonymous (per-worker) and file-backed (shared page cache) memory is reported after a search.
+# "f32+matrix" is the layout before compact storage: the index plus RAGIndex's own float32 copy.
+# Linux only for the memory columns (/proc/self/status).
+#
+#   python bench/vector_storage.py --n 100000 --dim 1024 --kinds flat ivf
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import faiss
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import ann
+from ann_recall import corpus, queries, recall, timed_search
+
+
+def _rss_kb(field: str) -> int:
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def probe(path: str, mmap: bool) -> None:
+    # Child process: load one index and report what it costs this worker.
+    anon, shared = _rss_kb("RssAnon"), _rss_kb("RssFile")
+    index = ann.read_index(path, mmap=mmap)
+    ann.search(index, np.zeros((1, index.d), dtype=np.float32), 1)
+    print(json.dumps({"anon_mb": round((_rss_kb("RssAnon") - anon) / 1024, 1), "shared_mb": round((_rss_kb("RssFile") - shared) / 1024, 1)}))
+
+
+def measure(path: str, mmap: bool) -> dict:
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--probe", path] + (["--mmap"] if mmap else []), text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50000)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--clusters", type=int, default=500)
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--kinds", nargs="+", default=["flat"], choices=ann.INDEX_KINDS)
+    ap.add_argument("--codecs", nargs="+", default=list(ann.CODECS), choices=ann.CODECS)
+    ap.add_argument("--pq-m", type=int, default=128)
+    ap.add_argument("--probe", help=argparse.SUPPRESS)
+    ap.add_argument("--mmap", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.probe:
+        probe(args.probe, args.mmap)
+        return
+
+    x = corpus(args.n, args.dim, args.clusters)
+    q = queries(x, args.queries)
+    exact = ann.build_index(x, dict(ann.index_config(), kind="flat", codec="f32"))
+    truth, _ = timed_search(exact, q, args.k)
+    del exact
+    linux = os.path.exists("/proc/self/status")
+    tmp = tempfile.mkdtemp(prefix="sanjeevani-vectors-")
+    rows = [{"index": "f32+matrix", "bytes_per_passage": 2 * 4 * args.dim, f"recall@{args.k}": 1.0}]
+    try:
+        for kind in args.kinds:
+            for codec in args.codecs:
+                cfg = dict(ann.index_config(), kind=kind, codec=codec, pq_m=args.pq_m)
+                tag = ann.index_tag(args.n, args.dim, cfg)
+                if any(r["index"] == tag for r in rows):
+                    continue  # a codec that fell back to one already measured
+                t0 = time.perf_counter()
+                index = ann.build_index(x, cfg)
+                build_s = time.perf_counter() - t0
+                found, us = timed_search(index, q, args.k)
+                path = os.path.join(tmp, f"{tag}.faiss")
+                faiss.write_index(index, path)
+                row = {
+                    "index": tag,
+                    "build_s": round(build_s, 2),
+                    "code_bytes": ann.code_size(index),
+                    "bytes_per_passage": round(os.path.getsize(path) / args.n, 1),
+                    f"recall@{args.k}": round(recall(found, truth), 4),
+                    "us_per_query": round(us, 1),
+                }
+                del index
+                if linux:
+                    row["heap"] = measure(path, mmap=False)
+                    row["mmap"] = measure(path, mmap=True)
+                rows.append(row)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    for r in rows:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import re
+import glob
+import json
+import time
+import hashlib
+from typing import List, Dict, Optional
+import numpy as np
+import faiss
+from ann import read_index
+
+
+def text_key(text: str, model: str, dimensions: Optional[int]) -> str:
+    raw = f"{model}\x00{dimensions or 'native'}\x00{text}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def corpus_key(keys: List[str]) -> str:
+    h = hashlib.sha256()
+    for k in keys:
+        h.update(k.encode("ascii"))
+    return h.hexdigest()[:16]
+
+
+class _FileLock:
+    # O_EXCL lock file so several uvicorn workers starting together do not interleave appends;
+    # works the same on Windows and POSIX.
+    def __init__(self, path: str, timeout: float = 10.0, stale: float = 60.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+        self.fd = None
+
+    def __enter__(self) -> "_FileLock":
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                self.fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale:
+                        os.unlink(self.path)
+                        continue
+                except OSError:
+                    pass
+                if time.time() > deadline:
+                    raise TimeoutError(f"could not acquire {self.path}")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+# Append-only store of normalized embedding vectors. Rows live in a raw float32 file that is
+# memory-mapped on read; a JSON sidecar maps text keys (normalized text + model + dimensions) to rows.
+class EmbeddingStore:
+    def __init__(self, root: str, model: str, dimensions: Optional[int]) -> None:
+        self.root = root
+        self.model = model
+        self.dimensions = dimensions
+        slug = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in model)
+        self.prefix = os.path.join(root, f"{slug}_{dimensions or 'native'}")
+        self.vec_path = self.prefix + ".f32"
+        self.meta_path = self.prefix + ".json"
+        self.lock_path = self.prefix + ".lock"
+        self.rows: Dict[str, int] = {}
+        self.width: Optional[int] = None
+        # File name of the ANN index for the corpus last built against this store.
+        self.index_file: Optional[str] = None
+        os.makedirs(root, exist_ok=True)
+        self._load_meta()
+
+    def _load_meta(self) -> None:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        if meta.get("model") != self.model or meta.get("dimensions") != self.dimensions:
+            return
+        self.width = meta.get("width")
+        self.rows = meta.get("rows", {})
+        self.index_file = meta.get("index")
+
+    def key(self, text: str) -> str:
+        return text_key(text, self.model, self.dimensions)
+
+    def missing(self, keys: List[str]) -> List[str]:
+        return [k for k in dict.fromkeys(keys) if k not in self.rows]
+
+    def _memmap(self) -> np.ndarray:
+        n = len(self.rows)
+        return np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, self.width))
+
+    def get(self, keys: List[str]) -> np.ndarray:
+        idx = [self.rows[k] for k in keys]
+        mm = self._memmap()
+        # Contiguous rows (the common case for a corpus embedded in one go) stay a zero-copy view.
+        if idx and idx == list(range(idx[0], idx[0] + len(idx))):
+            return mm[idx[0]:idx[0] + len(idx)]
+        return np.asarray(mm[idx])
+
+    def put(self, keys: List[str], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with _FileLock(self.lock_path):
+            # Another worker may have appended since we loaded; re-read before writing.
+            self._load_meta()
+            if self.width is None:
+                self.width = int(vectors.shape[1])
+            if vectors.shape[1] != self.width:
+                raise ValueError(f"embedding width {vectors.shape[1]} != stored width {self.width}")
+            new = [(k, i) for i, k in enumerate(keys) if k not in self.rows]
+            new = list({k: i for k, i in new}.items())
+            if not new:
+                return
+            start = len(self.rows)
+            mode = "r+b" if os.path.exists(self.vec_path) else "wb"
+            with open(self.vec_path, mode) as f:
+                # Rows past the committed count are leftovers from an interrupted write.
+                f.seek(start * self.width * 4)
+                f.write(vectors[[i for _, i in new]].tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            rows = dict(self.rows)
+            for j, (k, _) in enumerate(new):
+                rows[k] = start + j
+            self._write_meta(rows, self.index_file)
+
+    def _write_meta(self, rows: Dict[str, int], index_file: Optional[str]) -> None:
+        # Caller holds the lock.
+        meta = {"model": self.model, "dimensions": self.dimensions, "width": self.width, "rows": rows, "index": index_file}
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+        self.rows = rows
+        self.index_file = index_file
+
+    def index_path(self, keys: List[str], tag: str = "flat") -> str:
+        return f"{self.prefix}.{corpus_key(keys)}.{tag}.faiss"
+
+    def load_index(self, keys: List[str], tag: str = "flat") -> Optional[faiss.Index]:
+        path = self.index_path(keys, tag)
+        if not os.path.exists(path):
+            return None
+        try:
+            return read_index(path)
+        except Exception:
+            return None
+
+    def save_index(self, keys: List[str], index: faiss.Index, tag: str = "flat") -> None:
+        # One index file per store: once the new one is written and recorded in the sidecar, the
+        # files of earlier corpora are removed, so the directory does not grow with every reload.
+        # Workers still serving an older index keep their mapping (on POSIX an unlinked file stays
+        # readable); a worker that needs it again rebuilds it from the stored vectors.
+        path = self.index_path(keys, tag)
+        tmp = path + ".tmp"
+        faiss.write_index(index, tmp)
+        os.replace(tmp, path)
+        with _FileLock(self.lock_path):
+            self._load_meta()
+            self._write_meta(self.rows, os.path.basename(path))
+            self._prune_indexes(path)
+
+    def _prune_indexes(self, keep: str) -> None:
+        name = re.compile(re.escape(os.path.basename(self.prefix)) + r"\.[0-9a-f]{16}\.[^.]+\.faiss")
+        for path in glob.glob(glob.escape(self.prefix) + ".*.faiss"):
+            if path != keep and name.fullmatch(os.path.basename(path)):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+def open_store(model: str, dimensions: Optional[int]) -> Optional[EmbeddingStore]:
+    if os.getenv("EMBED_CACHE", "1") != "1":
+        return None
+    root = os.getenv("EMBED_CACHE_DIR") or os.path.join(os.path.dirname(__file__), ".embed_cache")
+    try:
+        return EmbeddingStore(root, model, dimensions)
+    except OSError:
+        return None
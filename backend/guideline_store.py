@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import Any, Dict, List, Optional
+from metrics import GUIDELINE_RELOADS
+
+# Hot reload of guidelines.json under a running TriageEngine. The file is polled like the knowledge
+# graph; a change (or an admin upload, which rewrites the file) rebuilds the index off the event
+# loop, re-embedding only the guideline texts the previous index did not have, and the engine swaps
+# the new index in with a single assignment. Requests already running keep the index they started on.
+# An index directory built by ingest.py is watched the same way and reopened once its manifest is
+# complete.
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ("id", "title", "guideline")
+
+
+def entry_hash(entry: Dict[str, Any]) -> str:
+    blob = json.dumps(entry, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()
+
+
+def validate_entries(entries: Any) -> List[Dict[str, Any]]:
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("guidelines must be a non-empty JSON array")
+    seen = set()
+    for i, e in enumerate(entries):
+        if not isinstance(e, dict):
+            raise ValueError(f"entry {i} is not an object")
+        missing = [f for f in REQUIRED_FIELDS if f not in e]
+        if missing:
+            raise ValueError(f"entry {i} is missing {', '.join(missing)}")
+        if not isinstance(e["guideline"], str) or not e["guideline"].strip():
+            raise ValueError(f"entry {i} has an empty guideline")
+        key = json.dumps(e["id"])
+        if key in seen:
+            raise ValueError(f"duplicate id {e['id']!r}")
+        seen.add(key)
+    return entries
+
+
+def diff_entries(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    # By id and content hash; the ids are reported as they appear in the entries.
+    before = {json.dumps(e.get("id")): entry_hash(e) for e in old}
+    after = {json.dumps(e.get("id")): entry_hash(e) for e in new}
+    ids = {json.dumps(e.get("id")): e.get("id") for e in list(old) + list(new)}
+    return {
+        "added": [ids[k] for k in after if k not in before],
+        "changed": [ids[k] for k in after if k in before and before[k] != after[k]],
+        "removed": [ids[k] for k in before if k not in after],
+    }
+
+
+def file_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def write_guidelines(path: str, entries: List[Dict[str, Any]]) -> None:
+    # Write-then-rename, so the watcher (here or in another worker) never reads a half-written file.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".guidelines-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class GuidelineWatcher:
+    # One per worker process: each polls the shared file, so an upload to any worker reaches all of
+    # them within GUIDELINES_RELOAD_INTERVAL seconds (0 disables the polling).
+    def __init__(self, engine, interval: float = None) -> None:
+        self.engine = engine
+        if interval is None:
+            interval = float(os.getenv("GUIDELINES_RELOAD_INTERVAL", "5"))
+        self.interval = interval
+        self.last: Optional[Dict[str, Any]] = None
+        self._failed_mtime: Optional[int] = None
+
+    async def run(self) -> None:
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = file_mtime(self.engine.guidelines_path)
+            if mtime is None or mtime in (self.engine.guidelines_mtime, self._failed_mtime):
+                continue
+            try:
+                await self.reload()
+            except Exception:
+                self._failed_mtime = mtime
+
+    async def reload(self) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            report = await asyncio.to_thread(self.engine.reload_guidelines)
+        except Exception as e:
+            # Keep serving the current index; the next change to the file retries.
+            GUIDELINE_RELOADS.inc(outcome="failed")
+            logger.warning("guideline reload failed: %s", e)
+            self.last = {"outcome": "failed", "error": str(e), "version": self.engine.index.version}
+            raise
+        report["build_ms"] = round(1000 * (time.perf_counter() - t0), 2)
+        GUIDELINE_RELOADS.inc(outcome=report["outcome"])
+        if report["outcome"] == "applied":
+            logger.info("guidelines %s -> %s: %s", report["previous_version"], report["version"], {k: len(report[k]) for k in ("added", "changed", "removed")})
+        self.last = report
+        return report
+
+    async def upload(self, entries: Any) -> Dict[str, Any]:
+        if os.path.isdir(self.engine.guidelines_path):
+            raise ValueError("serving an index built by ingest.py; re-run ingest.py to change it")
+        entries = validate_entries(entries)
+        await asyncio.to_thread(write_guidelines, self.engine.guidelines_path, entries)
+        return await self.reload()
+
+    def status(self) -> Dict[str, Any]:
+        return {"version": self.engine.index.version, "entries": len(self.engine.index.entries), "watch_interval_s": self.interval, "last_reload": self.last}
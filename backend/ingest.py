@@ -0,0 +1,313 @@
+# Streaming bulk ingestion of a guideline corpus into an index directory that RAGIndex.open (and
+# GUIDELINES_PATH) serves. The source is read one entry at a time, long guidelines are split into
+# passages, and passages are embedded in batches bounded by count and characters, several batches
+# in flight, each retried with backoff. Batches are committed in source order (vectors, passages,
+# then the manifest), so rerunning the same command after a crash resumes after the last committed
+# batch instead of starting over. The ANN index (RAG_INDEX / RAG_VECTORS) is built last, from the
+# memory-mapped vectors.
+#
+#   python ingest.py protocols.jsonl --out data/protocols
+#   python ingest.py guidelines.json --out data/guidelines --max-chars 1200 --concurrency 4
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from openai import BadRequestError
+import faiss
+import ann
+from rag import RAGIndex, MANIFEST, PASSAGES, VECTORS, read_manifest
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _iter_json_array(f, chunk: int = 1 << 20) -> Iterator[Any]:
+    # Decodes one element at a time from a buffer that only ever holds the unread tail.
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk)
+    pos = len(buf) - len(buf.lstrip())
+    if buf[pos:pos + 1] != "[":
+        raise ValueError("expected a JSON array")
+    pos += 1
+    while True:
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
+            if pos < len(buf):
+                break
+            more = f.read(chunk)
+            if not more:
+                raise ValueError("unterminated JSON array")
+            buf, pos = more, 0
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            more = f.read(chunk)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield item
+        pos = end
+        if pos >= chunk:
+            buf, pos = buf[pos:], 0
+
+
+def iter_entries(path: str) -> Iterator[Dict[str, Any]]:
+    # A JSON array (like guidelines.json) or JSON Lines, told apart by the first character.
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(4096)
+        f.seek(0)
+        if head.lstrip().startswith("["):
+            yield from _iter_json_array(f)
+            return
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{n}: {e}") from None
+
+
+def split_passages(text: str, max_chars: int) -> List[str]:
+    # Whole sentences packed up to max_chars; a sentence longer than that is cut between words.
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return [text] if text else []
+    out: List[str] = []
+    current = ""
+    for sentence in _SENTENCE.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                out.append(current)
+                current = ""
+            out.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            out.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        out.append(current)
+    return out
+
+
+def iter_passages(entries: Iterator[Dict[str, Any]], max_chars: int) -> Iterator[Dict[str, Any]]:
+    # Passages keep their guideline's metadata; split ones get "<id>#<n>" ids and a source_id.
+    for i, e in enumerate(entries):
+        if not isinstance(e, dict) or not str(e.get("guideline") or "").strip():
+            raise ValueError(f"entry {i} has no guideline text")
+        parts = split_passages(str(e["guideline"]), max_chars)
+        if len(parts) == 1:
+            yield dict(e, guideline=parts[0])
+            continue
+        source_id = e.get("id", i)
+        for n, part in enumerate(parts):
+            yield dict(e, id=f"{source_id}#{n}", source_id=source_id, passage=n, guideline=part)
+
+
+def iter_batches(passages: Iterator[Dict[str, Any]], max_items: int, max_chars: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    size = 0
+    for p in passages:
+        n = len(p["guideline"])
+        if batch and (len(batch) >= max_items or size + n > max_chars):
+            yield batch
+            batch, size = [], 0
+        batch.append(p)
+        size += n
+    if batch:
+        yield batch
+
+
+class Embedder:
+    # RAGIndex's embeddings client and text normalization, with retries for bulk use.
+    def __init__(self, retries: int = 5, timeout: float = 60.0, backoff: float = 1.0) -> None:
+        self.index = RAGIndex([])
+        self.model, self.dimensions = self.index._embed_model()
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        for attempt in range(self.retries + 1):
+            try:
+                return self.index._embed(texts, timeout=self.timeout)
+            except BadRequestError:
+                # Usually a request over the token limit: halve it rather than retry it unchanged.
+                if len(texts) == 1:
+                    raise
+                mid = len(texts) // 2
+                return np.vstack([self(texts[:mid]), self(texts[mid:])])
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(30.0, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+class IndexWriter:
+    def __init__(self, out: str, model: str, dimensions: Optional[int], source: str, max_chars: int, restart: bool = False) -> None:
+        self.out = out
+        os.makedirs(out, exist_ok=True)
+        st = os.stat(source)
+        fresh = {
+            "model": model,
+            "dimensions": dimensions,
+            "width": None,
+            "source": os.path.abspath(source),
+            "source_size": st.st_size,
+            "source_mtime_ns": st.st_mtime_ns,
+            "max_chars": max_chars,
+            "count": 0,
+            "passages_bytes": 0,
+            "complete": False,
+        }
+        try:
+            manifest = read_manifest(out)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest is not None and not restart:
+            same = ("model", "dimensions", "source", "source_size", "source_mtime_ns", "max_chars")
+            changed = [k for k in same if manifest.get(k) != fresh[k]]
+            if changed:
+                raise SystemExit(f"{out} holds a different ingestion ({', '.join(changed)} changed); pass --restart to replace it")
+        if manifest is None or restart:
+            # Unlinked rather than truncated: a server may still have the old files mapped.
+            for name in (VECTORS, PASSAGES):
+                try:
+                    os.unlink(self._path(name))
+                except FileNotFoundError:
+                    pass
+            manifest = fresh
+        self.manifest = manifest
+        self.manifest["complete"] = False
+        # Rows and lines past the committed count are leftovers from an interrupted batch.
+        self._truncate(VECTORS, self.count * 4 * (self.manifest["width"] or 0))
+        self._truncate(PASSAGES, self.manifest["passages_bytes"])
+        self._save()
+
+    @property
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.out, name)
+
+    def _truncate(self, name: str, size: int) -> None:
+        with open(self._path(name), "ab") as f:
+            f.truncate(size)
+
+    def _save(self) -> None:
+        tmp = self._path(MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, self._path(MANIFEST))
+
+    def commit(self, passages: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.manifest["width"] is None:
+            self.manifest["width"] = int(vectors.shape[1])
+        lines = "".join(json.dumps(p, ensure_ascii=False) + "\n" for p in passages).encode("utf-8")
+        for name, data in ((VECTORS, vectors.tobytes()), (PASSAGES, lines)):
+            with open(self._path(name), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.manifest["count"] += len(passages)
+        self.manifest["passages_bytes"] += len(lines)
+        self._save()
+
+    def finish(self, cfg: Dict[str, Any]) -> Dict[str, Any]:
+        n, width = self.count, self.manifest["width"]
+        if not n:
+            raise SystemExit("no passages to index")
+        # The same version RAGIndex computes for its entries, streamed instead of held in memory.
+        h = hashlib.sha1()
+        with open(self._path(PASSAGES), "r", encoding="utf-8") as f:
+            h.update(b"[")
+            for i, line in enumerate(f):
+                entry = json.loads(line)
+                h.update((", " if i else "").encode("utf-8") + json.dumps(entry, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            h.update(b"]")
+        mat = np.memmap(self._path(VECTORS), dtype=np.float32, mode="r", shape=(n, width))
+        name = f"index.{ann.index_tag(n, width, cfg)}.faiss"
+        tmp = self._path(name + ".tmp")
+        faiss.write_index(ann.build_index(mat, cfg), tmp)
+        os.replace(tmp, self._path(name))
+        self.manifest.update(index=name, version=h.hexdigest()[:16], complete=True)
+        self._save()
+        return self.manifest
+
+
+def ingest(source: str, out: str, max_chars: int = 2000, batch_size: int = 256, batch_chars: int = 200000,
+           concurrency: int = 4, retries: int = 5, timeout: float = 60.0, restart: bool = False, log=print) -> Dict[str, Any]:
+    embed = Embedder(retries=retries, timeout=timeout)
+    writer = IndexWriter(out, embed.model, embed.dimensions, source, max_chars, restart=restart)
+    skip = writer.count
+    if skip:
+        log(f"resuming after {skip} committed passages")
+    passages = iter_passages(iter_entries(source), max_chars)
+    # Passages are produced in the same order on every run, so the committed ones are skipped.
+    for _ in zip(range(skip), passages):
+        pass
+    t0 = time.perf_counter()
+    done = 0
+    pending: deque = deque()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="ingest") as pool:
+        def commit_ready(limit: int) -> None:
+            nonlocal done
+            # In order: a later batch that finished first waits for the ones before it.
+            while pending and (len(pending) > limit or pending[0][1].done()):
+                batch, fut = pending.popleft()
+                writer.commit(batch, fut.result())
+                done += len(batch)
+                rate = done / max(1e-9, time.perf_counter() - t0)
+                log(f"{writer.count} passages committed ({rate:.0f}/s)")
+
+        try:
+            for batch in iter_batches(passages, batch_size, batch_chars):
+                pending.append((batch, pool.submit(embed, [p["guideline"] for p in batch])))
+                commit_ready(2 * concurrency)
+            commit_ready(0)
+        except BaseException:
+            for _, fut in pending:
+                fut.cancel()
+            raise
+    log(f"building the {ann.index_config()['kind']} index over {writer.count} passages")
+    return writer.finish(ann.index_config())
+
+
+def main() -> None:
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Embed a guideline corpus (JSON array or JSONL) into an index directory for GUIDELINES_PATH.")
+    ap.add_argument("source", help="guidelines as a JSON array or JSON Lines")
+    ap.add_argument("--out", required=True, help="index directory; rerunning resumes an interrupted ingestion")
+    ap.add_argument("--max-chars", type=int, default=2000, help="longest passage; longer guidelines are split at sentences")
+    ap.add_argument("--batch-size", type=int, default=256, help="passages per embeddings request")
+    ap.add_argument("--batch-chars", type=int, default=200000, help="characters per embeddings request")
+    ap.add_argument("--concurrency", type=int, default=4, help="embeddings requests in flight")
+    ap.add_argument("--retries", type=int, default=5)
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds per embeddings request")
+    ap.add_argument("--restart", action="store_true", help="discard a previous ingestion in --out")
+    args = ap.parse_args()
+    manifest = ingest(args.source, args.out, args.max_chars, args.batch_size, args.batch_chars,
+                      args.concurrency, args.retries, args.timeout, args.restart, log=lambda m: print(m, file=sys.stderr))
+    print(json.dumps({k: manifest[k] for k in ("count", "width", "model", "index", "version")}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import threading
+from typing import List, Dict, Tuple
+
+# Common phrasings health workers use for the symptoms keyed in knowledge_graph.json.
+ALIASES = {
+    "breathlessness": "shortness of breath",
+    "difficulty breathing": "shortness of breath",
+    "trouble breathing": "shortness of breath",
+    "severe chest pain": "chest pain",
+    "seizure": "convulsions",
+    "seizures": "convulsions",
+    "fits": "convulsions",
+    "snake bite": "snakebite",
+    "dog bite": "animal bite",
+    "burn": "burn injury",
+    "burns": "burn injury",
+    "swollen legs": "leg swelling",
+    "swelling in legs": "leg swelling",
+    "loose motions": "watery diarrhea",
+    "watery diarrhoea": "watery diarrhea",
+    "persistent cough": "prolonged cough",
+    "chronic cough": "prolonged cough",
+    "high blood pressure in pregnancy": "high bp in pregnancy",
+    "severe headache during pregnancy": "severe headache in pregnancy",
+}
+
+
+def normalize_term(text: str) -> str:
+    t = text.lower()
+    t = "".join(ch if ch.isalnum() or ch.isspace() else " " for ch in t)
+    return " ".join(t.split())
+
+
+class KnowledgeGraph:
+    def __init__(self, path: str, check_interval: float = None) -> None:
+        self.path = path
+        if check_interval is None:
+            check_interval = float(os.getenv("KG_RELOAD_INTERVAL", "2.0"))
+        self.check_interval = check_interval
+        self.mtime = None
+        self.index: Dict[str, Tuple[str, ...]] = {}
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                graph = json.load(f)
+        except (OSError, ValueError):
+            # Keep serving the last good graph if the file is missing or half-written.
+            return False
+        index: Dict[str, Tuple[str, ...]] = {}
+        for k, risks in graph.items():
+            if isinstance(risks, list):
+                index[normalize_term(k)] = tuple(dict.fromkeys(str(r) for r in risks))
+        for alias, target in ALIASES.items():
+            a = normalize_term(alias)
+            if a not in index and target in index:
+                index[a] = index[target]
+        self.index = index
+        self.mtime = mtime
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime != self.mtime:
+                self.reload()
+
+    def lookup(self, symptom: str) -> Tuple[str, ...]:
+        return self.index.get(normalize_term(symptom), ())
+
+    def related_risks(self, symptoms: List[str]) -> List[str]:
+        self._maybe_reload()
+        index = self.index
+        out: Dict[str, None] = {}
+        for s in symptoms:
+            for r in index.get(normalize_term(s), ()):
+                out[r] = None
+        return list(out)
@@ -0,0 +1,102 @@
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+
+class BM25Index:
+    # Sparse lexical index. Documents are stored as a CSR term-frequency matrix and, transposed,
+    # as per-term postings carrying precomputed BM25 weights, so a query touches only the postings
+    # of its own terms. Memory is O(total tokens), not O(documents x vocabulary).
+    def __init__(self, docs: Sequence[List[str]], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.n_docs = len(docs)
+        indptr = [0]
+        indices: List[int] = []
+        data: List[float] = []
+        lengths: List[int] = []
+        for tokens in docs:
+            lengths.append(len(tokens))
+            counts: Dict[int, int] = {}
+            for w in tokens:
+                tid = self.vocab.get(w)
+                if tid is None:
+                    tid = len(self.vocab)
+                    self.vocab[w] = tid
+                counts[tid] = counts.get(tid, 0) + 1
+            for tid in sorted(counts):
+                indices.append(tid)
+                data.append(counts[tid])
+            indptr.append(len(indices))
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.doc_len = np.asarray(lengths, dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if self.n_docs else 0.0
+        self._build_postings()
+
+    def _build_postings(self) -> None:
+        n_terms = len(self.vocab)
+        doc_of = np.repeat(np.arange(self.n_docs, dtype=np.int32), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind="stable")
+        self.post_docs = doc_of[order]
+        tf = self.data[order]
+        self.post_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n_terms), out=self.post_ptr[1:])
+        df = np.diff(self.post_ptr).astype(np.float32)
+        self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[self.post_docs] / max(self.avgdl, 1e-9))
+        term_of = np.repeat(np.arange(n_terms, dtype=np.int32), np.diff(self.post_ptr))
+        self.post_weight = (self.idf[term_of] * tf * (self.k1 + 1.0) / (tf + norm)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def nbytes(self) -> int:
+        arrays = (self.indptr, self.indices, self.data, self.post_docs, self.post_ptr, self.post_weight, self.idf, self.doc_len)
+        return int(sum(a.nbytes for a in arrays))
+
+    def query_vector(self, tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # Sparse (term ids, query term counts); unknown terms are dropped.
+        counts: Dict[int, int] = {}
+        for w in tokens:
+            tid = self.vocab.get(w)
+            if tid is not None:
+                counts[tid] = counts.get(tid, 0) + 1
+        ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        qtf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return ids, qtf
+
+    def scores(self, tokens: List[str]) -> np.ndarray:
+        out = np.zeros(self.n_docs, dtype=np.float32)
+        ids, qtf = self.query_vector(tokens)
+        for tid, q in zip(ids, qtf):
+            lo, hi = self.post_ptr[tid], self.post_ptr[tid + 1]
+            # Postings hold each document at most once per term, so plain fancy-index add is safe.
+            out[self.post_docs[lo:hi]] += q * self.post_weight[lo:hi]
+        return out
+
+    def search(self, tokens: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        s = self.scores(tokens)
+        k = min(k, self.n_docs)
+        if k <= 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-s, k - 1)[:k] if k < self.n_docs else np.arange(self.n_docs)
+        top = top[np.lexsort((top, -s[top]))]
+        return s[top], top
+
+    def search_many(self, queries: Sequence[List[str]], k: int, positive_only: bool = False) -> List[List[int]]:
+        out = []
+        for tokens in queries:
+            scores, ids = self.search(tokens, k)
+            out.append([int(i) for i, sc in zip(ids, scores) if sc > 0 or not positive_only])
+        return out
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60, limit: int = None) -> List[int]:
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (k + rank + 1)
+    order = sorted(fused, key=lambda d: (-fused[d], d))
+    return order[:limit] if limit is not None else order
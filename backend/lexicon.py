@@ -0,0 +1,112 @@
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+from matcher import PhraseMatcher, build_terms
+from redflag import RED_FLAGS, RED_FLAG_SYNONYMS
+from rerank import RERANK_SYNONYMS
+from knowledge_graph import ALIASES
+
+# Symptoms the guideline tags do not name, with the lay and Hinglish phrasings health workers use.
+SYMPTOM_SYNONYMS = {
+    "fever": ["bukhar", "feverish", "high temperature"],
+    "cough": ["khansi", "coughing"],
+    "headache": ["head ache", "head pain", "sar dard"],
+    "vomiting": ["vomit", "vomits", "vomited", "throwing up", "ulti"],
+    "diarrhea": ["diarrhoea", "loose motion", "loose stools", "dast"],
+    "abdominal pain": ["stomach pain", "stomach ache", "pain in abdomen", "pet dard", "belly pain"],
+    "dizziness": ["dizzy", "giddiness", "chakkar"],
+    "rash": ["skin rash", "rashes"],
+    "sore throat": ["throat pain"],
+    "sweating": ["sweats", "sweaty"],
+    "fatigue": ["tiredness", "weakness", "tired", "weak"],
+    "back pain": ["backache"],
+    "body ache": ["body pain", "body aches"],
+    "burning urination": ["burning micturition", "pain while urinating"],
+    "swelling": ["swollen"],
+    "bleeding": ["blood loss"],
+    "yellow eyes": ["yellowing of eyes", "eyes are yellow"],
+    "runny nose": ["nasal discharge", "blocked nose"],
+    "nausea": ["nauseous", "feeling sick"],
+}
+
+# Guideline tags that describe the patient or the category rather than a symptom. Patient
+# modifiers (pregnancy, child) are deliberately left uncovered so such cases stay with the LLM.
+NON_SYMPTOM_TAGS = {
+    "red flag", "severe", "infection", "injury", "cardiac", "circulatory", "pulmonary", "liver",
+    "exposure", "chemical", "heat", "ankle", "bite", "child", "elderly", "neonatal", "pregnancy",
+    "electrolyte imbalance", "poison", "pesticide", "wound", "cold",
+}
+
+# Words that carry no clinical content; they neither count for nor against confidence.
+FILLER = {
+    "patient", "pt", "has", "have", "had", "having", "is", "are", "was", "were", "been", "be", "since",
+    "for", "from", "the", "a", "an", "and", "with", "of", "in", "on", "at", "to", "my", "his", "her",
+    "their", "he", "she", "i", "me", "they", "it", "this", "that", "also", "some", "reports", "reported",
+    "complains", "complaining", "c", "o", "presents", "presenting", "feels", "feeling", "got", "there",
+    "day", "days", "week", "weeks", "hour", "hours", "month", "months", "year", "years", "old", "ago",
+    "today", "yesterday", "last", "past", "mild", "slight", "few", "one", "two", "three", "four",
+    "five", "six", "seven", "male", "female", "man", "woman", "but", "however", "se", "hai", "aur",
+    "mujhe", "din", "teen",
+}
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+class Extraction(NamedTuple):
+    symptoms: List[str]
+    negated: List[str]
+    # Share of the clinically meaningful words in the text that the lexicon accounted for.
+    confidence: float
+
+
+def _symptom_groups(entries: Iterable[Dict[str, Any]], graph_keys: Iterable[str]) -> List[Tuple[str, Iterable[str]]]:
+    groups: List[Tuple[str, Iterable[str]]] = list(SYMPTOM_SYNONYMS.items())
+    groups.extend((f, RED_FLAG_SYNONYMS.get(f, [])) for f in sorted(RED_FLAGS))
+    groups.extend((k, []) for k in graph_keys)
+    for target, aliases in _invert(ALIASES).items():
+        groups.append((target, aliases))
+    groups.extend(RERANK_SYNONYMS.items())
+    for e in entries:
+        for t in e.get("tags", []):
+            t = str(t or "").lower().strip()
+            if t and t not in NON_SYMPTOM_TAGS:
+                groups.append((t, []))
+    return groups
+
+
+def _invert(aliases: Dict[str, str]) -> Dict[str, List[str]]:
+    out: Dict[str, List[str]] = {}
+    for alias, target in aliases.items():
+        out.setdefault(target, []).append(alias)
+    return out
+
+
+class SymptomLexicon:
+    # Deterministic extractor over one Aho-Corasick automaton: a single pass over the text finds
+    # every known symptom phrase, longest match wins, and "no fever" is reported as negated.
+    def __init__(self, entries: Iterable[Dict[str, Any]] = (), graph_keys: Iterable[str] = ()) -> None:
+        self.matcher = PhraseMatcher(build_terms(_symptom_groups(entries, graph_keys)))
+
+    def __len__(self) -> int:
+        return len(self.matcher.terms)
+
+    def extract(self, text: str) -> Extraction:
+        matches = self.matcher.scan(text)
+        symptoms = list(dict.fromkeys(m.label for m in matches if not m.negated))
+        negated = [l for l in dict.fromkeys(m.label for m in matches if m.negated) if l not in symptoms]
+        return Extraction(symptoms, negated, self._coverage(text.lower(), matches))
+
+    def _coverage(self, text: str, matches) -> float:
+        # Negated phrases and their cues stay uncovered: a negation the matcher may have scoped
+        # wrongly must not make a case look fully understood.
+        spans = [(m.start, m.end) for m in matches if not m.negated]
+        content = covered = 0
+        for w in _WORD.finditer(text):
+            word = w.group(0)
+            if word in FILLER or word.isdigit():
+                continue
+            content += 1
+            if any(s <= w.start() and w.end() <= e for s, e in spans):
+                covered += 1
+        if not content:
+            return 0.0
+        return round(covered / content, 3)
@@ -1,30 +1,58 @@
 import os
+from startup import Startup, ComponentUnavailable
 import subprocess
 import time
 from dotenv import load_dotenv
 import io
 load_dotenv()  # looks for .env in current dir or parent dirs
-from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from triage import TriageEngine
-from openai import OpenAI
-import whisper
+from ratelimit import create_limiter
+import metrics
+import resilience
+from guideline_store import GuidelineWatcher
+from transcription import TranscriptionService, QueueFull, StreamSession
 import shutil
 import asyncio
+import json
+import hmac
 # Create a dedicated audio temp folder (create it once)
 AUDIO_TEMP_DIR = os.path.join(os.path.dirname(__file__), "audio_temp")
 os.makedirs(AUDIO_TEMP_DIR, exist_ok=True)
-WHISPER_MODEL = whisper.load_model(os.getenv("LOCAL_WHISPER_MODEL", "tiny"))  # tiny/base for CPU speed
 HAS_FFMPEG = shutil.which("ffmpeg") is not None
 USE_LOCAL = os.getenv("USE_LOCAL_WHISPER", "1") == "1"
+# Whisper runs in its own worker processes so a long voice note never blocks the API event loop.
+TRANSCRIBER = TranscriptionService(
+    os.getenv("LOCAL_WHISPER_MODEL", "tiny"),  # tiny/base for CPU speed
+    workers=int(os.getenv("WHISPER_WORKERS", "1")),
+    max_queue=int(os.getenv("WHISPER_MAX_QUEUE", "16")),
+    temp_dir=AUDIO_TEMP_DIR,
+)
+TRANSCRIBE_TIMEOUT = float(os.getenv("TRANSCRIBE_TIMEOUT", "120"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 from dotenv import load_dotenv
 load_dotenv()
 
+# Upper bounds for the per-request ANN overrides; nprobe is further clamped to the index's nlist.
+MAX_NPROBE = int(os.getenv("RAG_MAX_NPROBE", "256"))
+MAX_EF_SEARCH = int(os.getenv("RAG_MAX_EF_SEARCH", "512"))
+
 class AnalyzeRequest(BaseModel):
     text: str
+    # ANN search overrides for this request (ignored by the flat index).
+    nprobe: Optional[int] = Field(None, ge=1, le=MAX_NPROBE)
+    ef_search: Optional[int] = Field(None, ge=1, le=MAX_EF_SEARCH)
+
+    def search_params(self):
+        return {k: v for k, v in (("nprobe", self.nprobe), ("ef_search", self.ef_search)) if v is not None}
+
+class AnalyzeBatchRequest(BaseModel):
+    texts: List[str]
+    stream: bool = False
 
 class RetrievedContext(BaseModel):
     title: str
@@ -48,9 +76,86 @@ class AnalyzeResponse(BaseModel):
     soap_note: SoapNote
     graph_insights: Optional[List[str]] = []
 
-engine = TriageEngine(os.path.join(os.path.dirname(__file__), "guidelines.json"))
+def _load_engine():
+    # Imported here so faiss/openai load off the import path, in the loader thread.
+    from triage import TriageEngine
+    # GUIDELINES_PATH: a guidelines JSON file, or an index directory written by ingest.py.
+    return TriageEngine(os.getenv("GUIDELINES_PATH") or os.path.join(os.path.dirname(__file__), "guidelines.json"))
+
+def _load_whisper():
+    TRANSCRIBER.start()
+    TRANSCRIBER.wait_ready()
+    return TRANSCRIBER
+
+def _check_ffmpeg():
+    if not HAS_FFMPEG:
+        raise RuntimeError("ffmpeg not found on PATH")
+    subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True, timeout=10)
+    return shutil.which("ffmpeg")
+
+# Heavy resources load in the lifespan, concurrently and off the event loop, so /health answers
+# as soon as the server is up. SKIP_COMPONENTS / LAZY_COMPONENTS (default: whisper) configure them.
+STARTUP = Startup()
+STARTUP.add("engine", _load_engine)
+# Transcription is optional: a host without ffmpeg or Whisper still serves triage, so these are
+# reported in /ready without gating it.
+STARTUP.add("ffmpeg", _check_ffmpeg, enabled=USE_LOCAL, required=False)
+STARTUP.add("whisper", _load_whisper, enabled=USE_LOCAL and HAS_FFMPEG, required=False)
+ENGINE_WAIT = float(os.getenv("STARTUP_WAIT_SECONDS", "30"))
+
+async def _engine():
+    try:
+        return await STARTUP["engine"].get(ENGINE_WAIT)
+    except ComponentUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def _local_whisper() -> bool:
+    whisper = STARTUP["whisper"]
+    if whisper.enabled and whisper.state != "failed":
+        whisper.start()
+        return True
+    return False
+
+# Hot reload of guidelines.json: polled every GUIDELINES_RELOAD_INTERVAL seconds once the engine is
+# loaded, or pushed with PUT /admin/guidelines (enabled by setting ADMIN_TOKEN).
+_GUIDELINES = {}
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def _guidelines(engine) -> GuidelineWatcher:
+    if "watcher" not in _GUIDELINES:
+        _GUIDELINES["watcher"] = GuidelineWatcher(engine)
+    return _GUIDELINES["watcher"]
+
+async def _watch_guidelines():
+    try:
+        engine = await STARTUP["engine"].get()
+    except ComponentUnavailable:
+        return
+    await _guidelines(engine).run()
 
-app = FastAPI(title="Sanjeevani AI Triage Assistant", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    STARTUP.start()
+    watcher = asyncio.ensure_future(_watch_guidelines())
+    yield
+    watcher.cancel()
+    TRANSCRIBER.shutdown()
+
+app = FastAPI(title="Sanjeevani AI Triage Assistant", version="0.1.0", lifespan=lifespan)
+
+@app.middleware("http")
+async def _observe_request(request: Request, call_next):
+    STARTUP.mark_request()
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route templates, not raw paths, keep the label set bounded (/transcribe/jobs/{job_id}).
+        route = request.scope.get("route")
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - t0, route=getattr(route, "path", "unmatched"), status=status)
 
 origins = ["*"]
 app.add_middleware(
@@ -61,43 +166,171 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-_rate_state = {}
-_RATE_LIMIT = 30
-_WINDOW = 60.0
-
-def _allow(ip: str) -> bool:
-    now = time.time()
-    bucket = _rate_state.get(ip, [])
-    bucket = [t for t in bucket if now - t < _WINDOW]
-    if len(bucket) >= _RATE_LIMIT:
-        _rate_state[ip] = bucket
-        return False
-    bucket.append(now)
-    _rate_state[ip] = bucket
-    return True
+# RATE_LIMIT requests per RATE_WINDOW seconds per client IP; RATE_LIMIT_STORE=sqlite shares the
+# buckets between worker processes.
+_limiter = create_limiter()
+
+def _allow(ip: str, cost: float = 1.0) -> bool:
+    return _limiter.allow(ip, cost)
+
+def _server_timing(timings: dict) -> str:
+    # Per-stage time plus the latency the overlapping stages saved, for browser devtools and proxies.
+    parts = [f"{name};dur={ms}" for name, ms in timings.get("stages_ms", {}).items()]
+    if "critical_path_saved_ms" in timings:
+        parts.append(f"saved;dur={timings['critical_path_saved_ms']};desc=\"speculation {timings.get('speculation', 'off')}\"")
+    return ", ".join(parts)
 
 @app.post("/analyze_case", response_model=AnalyzeResponse)
-async def analyze_case(req: AnalyzeRequest, request: Request):
+async def analyze_case(req: AnalyzeRequest, request: Request, response: Response):
     if not req.text or not req.text.strip():
         raise HTTPException(status_code=400, detail="text is required")
     ip = request.client.host if request.client else "unknown"
     if not _allow(ip):
         raise HTTPException(status_code=429, detail="rate limit exceeded")
-    result = await engine.analyze_case_async(req.text.strip())
+    engine = await _engine()
+    timings = {}
+    result = await engine.analyze_case_async(req.text.strip(), req.search_params(), timings)
+    if timings:
+        response.headers["Server-Timing"] = _server_timing(timings)
+        # Lets downstream caches key on (and drop entries for) the guideline corpus that answered.
+        response.headers["X-Corpus-Version"] = timings["corpus_version"]
     return result
 
+@app.post("/analyze_case/stream")
+async def analyze_case_stream(req: AnalyzeRequest, request: Request):
+    # Server-sent events, one per pipeline stage: symptoms, alert, contexts, classification,
+    # soap_note, timings (with the corpus version), then result carrying the same payload
+    # /analyze_case returns.
+    if not req.text or not req.text.strip():
+        raise HTTPException(status_code=400, detail="text is required")
+    ip = request.client.host if request.client else "unknown"
+    if not _allow(ip):
+        raise HTTPException(status_code=429, detail="rate limit exceeded")
+    engine = await _engine()
+
+    async def _events():
+        try:
+            async for stage, payload in engine.analyze_case_events(req.text.strip(), req.search_params()):
+                if stage == "result":
+                    payload = AnalyzeResponse(**payload).model_dump()
+                yield f"event: {stage}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+_MAX_BATCH = int(os.getenv("MAX_BATCH_CASES", "200"))
+
+@app.post("/analyze_cases", response_model=List[AnalyzeResponse])
+async def analyze_cases(req: AnalyzeBatchRequest, request: Request, response: Response):
+    texts = [t.strip() for t in req.texts]
+    if not texts or any(not t for t in texts):
+        raise HTTPException(status_code=400, detail="texts must be a non-empty list of non-empty strings")
+    if len(texts) > _MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"at most {_MAX_BATCH} cases per batch")
+    # Each case costs one token, as if it had been sent to /analyze on its own.
+    if len(texts) > _limiter.capacity:
+        raise HTTPException(status_code=413, detail=f"at most {int(_limiter.capacity)} cases per batch under the current rate limit")
+    ip = request.client.host if request.client else "unknown"
+    if not _allow(ip, cost=len(texts)):
+        raise HTTPException(status_code=429, detail="rate limit exceeded")
+    engine = await _engine()
+    if req.stream:
+        async def _lines():
+            i = 0
+            async for result in engine.iter_cases_async(texts):
+                yield json.dumps({"index": i, "result": AnalyzeResponse(**result).model_dump()}) + "\n"
+                i += 1
+        return StreamingResponse(_lines(), media_type="application/x-ndjson", headers={"X-Corpus-Version": engine.index.version})
+    response.headers["X-Corpus-Version"] = engine.index.version
+    return await engine.analyze_cases_async(texts)
+
+@app.get("/guidelines/version")
+async def guidelines_version():
+    engine = await _engine()
+    return _guidelines(engine).status()
+
+@app.put("/admin/guidelines")
+async def upload_guidelines(request: Request):
+    # Replaces guidelines.json (a JSON array of entries) and hot-reloads it; other workers pick the
+    # new file up from their own watchers.
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="guideline uploads are disabled; set ADMIN_TOKEN")
+    auth = request.headers.get("authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="invalid admin token")
+    try:
+        entries = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="body must be a JSON array of guideline entries")
+    engine = await _engine()
+    try:
+        return await _guidelines(engine).upload(entries)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"guideline reload failed ({e}); still serving {engine.index.version}")
+
 @app.get("/health")
 def health():
-    return {
+    # Liveness: answers while components are still loading; see /ready for readiness.
+    out = {
         "status": "ok",
         "version": "0.1.0",
         "use_local_whisper": USE_LOCAL,
         "ffmpeg": HAS_FFMPEG,
-        "whisper_model": os.getenv("LOCAL_WHISPER_MODEL", "tiny")
+        "whisper_model": os.getenv("LOCAL_WHISPER_MODEL", "tiny"),
+        "rate_limit": _limiter.stats(),
+        "transcription": TRANSCRIBER.stats(),
+        "upstreams": resilience.status()
     }
+    if STARTUP["engine"].ready():
+        engine = STARTUP["engine"].value
+        out["query_cache"] = engine.index.cache_stats()
+        out["result_cache"] = engine.result_cache.stats()
+        out["corpus_version"] = engine.index.version
+    return out
+
+@app.get("/ready")
+def ready():
+    status = STARTUP.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@metrics.REGISTRY.collector
+def _state_metrics():
+    caches = {}
+    corpus = []
+    if STARTUP["engine"].ready():
+        engine = STARTUP["engine"].value
+        caches = {"query": engine.index.cache_stats(), "result": engine.result_cache.stats()}
+        corpus = [({"version": engine.index.version}, len(engine.index.entries))]
+    tr = TRANSCRIBER.stats()
+    rl = _limiter.stats()
+    return [
+        ("sanjeevani_cache_hits_total", "counter", "Cache hits.", [({"cache": n}, c["hits"]) for n, c in caches.items()]),
+        ("sanjeevani_cache_misses_total", "counter", "Cache misses.", [({"cache": n}, c["misses"]) for n, c in caches.items()]),
+        ("sanjeevani_cache_entries", "gauge", "Entries currently cached.", [({"cache": n}, c["size"]) for n, c in caches.items()]),
+        ("sanjeevani_component_ready", "gauge", "1 when the startup component is loaded.", [({"component": n}, int(c.ready())) for n, c in STARTUP.components.items()]),
+        ("sanjeevani_transcription_queue_depth", "gauge", "Transcription jobs waiting for a worker.", [({}, tr["queue_depth"])]),
+        ("sanjeevani_transcription_running", "gauge", "Transcription jobs running.", [({}, tr["running"])]),
+        ("sanjeevani_transcription_jobs_total", "counter", "Finished transcription jobs by outcome.", [({"outcome": "done"}, tr["completed"]), ({"outcome": "error"}, tr["failed"])]),
+        ("sanjeevani_rate_limited_total", "counter", "Requests rejected by the rate limiter.", [({}, rl["rejected"])]),
+        ("sanjeevani_guideline_entries", "gauge", "Guideline entries in the serving index, labelled with the corpus version.", corpus),
+        ("sanjeevani_circuit_open", "gauge", "1 while the upstream's circuit breaker is not closed.", [({"upstream": n}, int(u.breaker.state != "closed")) for n, u in resilience.UPSTREAMS.items()]),
+    ]
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 
+_LANG_MAP = {"hi": "hi", "en": "en", "ta": "ta", "te": "te", "bn": "bn"}
+
 @app.post("/transcribe")
 async def transcribe(
     language: str = Form("hi"),
@@ -107,64 +340,53 @@ async def transcribe(
         return {"text": "", "error": "Invalid audio format"}
 
     audio_bytes = await audio.read()
-
-    # Use fixed path with timestamp to avoid conflicts
-    import time
-    filename = f"voice_{int(time.time() * 1000)}.webm"
-    temp_path = os.path.join(AUDIO_TEMP_DIR, filename)
-    temp_wav = temp_path.replace(".webm", ".wav")
+    lang_code = _LANG_MAP.get(language.lower(), "en")
 
     try:
-        # Write audio bytes directly
-        with open(temp_path, "wb") as f:
-            f.write(audio_bytes)
-
-        # Transcribe
-        lang_map = {"hi": "hi", "en": "en", "ta": "ta", "te": "te", "bn": "bn"}
-        lang_code = lang_map.get(language.lower(), "en")
-
         # Prefer local whisper; ensure ffmpeg availability
-        if USE_LOCAL:
-            if HAS_FFMPEG:
-                # Convert to 16kHz mono WAV for maximum compatibility
-                try:
-                    subprocess.run(
-                        ["ffmpeg", "-y", "-i", temp_path, "-ar", "16000", "-ac", "1", temp_wav],
-                        check=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-                    source_path = temp_wav
-                except Exception:
-                    # Fallback to original WEBM if conversion fails
-                    source_path = temp_path
-
-                audio_arr = whisper.load_audio(source_path)
-                result = WHISPER_MODEL.transcribe(
-                    audio_arr,
-                    language=lang_code,
-                    fp16=False
-                )
-                text = result.get("text", "").strip()
+        if USE_LOCAL and "whisper" not in STARTUP.skip:
+            if not HAS_FFMPEG:
                 return {
-                    "text": text,
+                    "text": "",
                     "language": language,
-                    "detected": result.get("language", "unknown")
+                    "error": "Local Whisper requires ffmpeg. Install ffmpeg and ensure it is in PATH."
                 }
-            else:
+            if not _local_whisper():
                 return {
                     "text": "",
                     "language": language,
-                    "error": "Local Whisper requires ffmpeg. Install ffmpeg and ensure it is in PATH."
+                    "error": f"Local Whisper failed to load: {STARTUP['whisper'].error}"
                 }
+            try:
+                job = TRANSCRIBER.submit(audio_bytes, lang_code)
+            except QueueFull as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            if not await TRANSCRIBER.wait(job, TRANSCRIBE_TIMEOUT):
+                return {
+                    "text": "",
+                    "language": language,
+                    "job_id": job.id,
+                    "status": job.status,
+                    "error": f"Transcription still in progress; poll /transcribe/jobs/{job.id}"
+                }
+            if job.status != "done":
+                raise RuntimeError(job.error or job.status)
+            return {
+                "text": job.result["text"],
+                "language": language,
+                "detected": job.result["detected"]
+            }
         else:
             # Explicitly use OpenAI Whisper API path
             if not OPENAI_API_KEY:
                 return {"text": "", "language": language, "error": "OPENAI_API_KEY not configured"}
-            client = OpenAI(api_key=OPENAI_API_KEY)
+            from openai import OpenAI  # only this path needs it; keeps it off the import path
+            base = os.getenv("OPENAI_API_BASE")
+            client = OpenAI(base_url=base, api_key=OPENAI_API_KEY) if base else OpenAI(api_key=OPENAI_API_KEY)
             file_like = io.BytesIO(audio_bytes)
             file_like.name = "audio.webm"
-            api_result = client.audio.transcriptions.create(
+            api_result = await asyncio.to_thread(
+                client.audio.transcriptions.create,
                 model="whisper-1",
                 file=file_like,
                 language=lang_code
@@ -172,6 +394,8 @@ async def transcribe(
             text = (getattr(api_result, "text", "") or "").strip()
             return {"text": text, "language": language, "detected": lang_code}
 
+    except HTTPException:
+        raise
     except Exception as e:
         msg = str(e)
         if "WinError 2" in msg and USE_LOCAL:
@@ -186,16 +410,90 @@ async def transcribe(
             "error": f"Transcription failed: {msg}"
         }
 
+@app.post("/transcribe/jobs")
+async def submit_transcription(
+    language: str = Form("hi"),
+    audio: UploadFile = File(...)
+):
+    if not audio.content_type.startswith("audio/"):
+        raise HTTPException(status_code=400, detail="Invalid audio format")
+    if not _local_whisper():
+        raise HTTPException(status_code=503, detail="Local Whisper with ffmpeg is required for background jobs")
+    audio_bytes = await audio.read()
+    try:
+        job = TRANSCRIBER.submit(audio_bytes, _LANG_MAP.get(language.lower(), "en"))
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+@app.get("/transcribe/jobs/{job_id}")
+async def transcription_job(job_id: str, wait: float = 0.0):
+    job = TRANSCRIBER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    if wait > 0 and job.finished is None:
+        await TRANSCRIBER.wait(job, min(wait, TRANSCRIBE_TIMEOUT))
+    return job.to_dict()
+
+# Each open stream holds an ffmpeg process and its PCM window; new ones beyond this are closed
+# with 1013 (try again later).
+STREAM_MAX_SESSIONS = int(os.getenv("STREAM_MAX_SESSIONS", "8"))
+_STREAM_SLOTS = asyncio.Semaphore(STREAM_MAX_SESSIONS)
+
+@app.websocket("/transcribe/stream")
+async def transcribe_stream(ws: WebSocket, language: str = "hi"):
+    # Client sends binary audio chunks as they are recorded, then the text message "end".
+    # Server replies with {"type": "partial"|"final"|"done"|"error", "text": ...} messages.
+    await ws.accept()
+    if _STREAM_SLOTS.locked():
+        await ws.close(code=1013, reason="too many streaming sessions")
+        return
+    if not _local_whisper():
+        await ws.send_json({"type": "error", "error": "Streaming transcription requires local Whisper and ffmpeg."})
+        await ws.close()
+        return
+    async with _STREAM_SLOTS:
+        await _run_stream(ws, language)
+
+async def _run_stream(ws: WebSocket, language: str) -> None:
+    session = StreamSession(
+        TRANSCRIBER,
+        _LANG_MAP.get(language.lower(), "en"),
+        ws.send_json,
+        step=float(os.getenv("STREAM_STEP_SECONDS", "1.0")),
+        commit_after=float(os.getenv("STREAM_COMMIT_SECONDS", "12")),
+    )
+    try:
+        await session.start()
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+            if msg.get("bytes"):
+                await session.feed(msg["bytes"])
+            elif msg.get("text") == "end":
+                await session.finish()
+                await ws.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    except QueueFull as e:
+        try:
+            await ws.send_json({"type": "error", "error": str(e)})
+            await ws.close(code=1013)
+        except Exception:
+            pass
+    except Exception as e:
+        try:
+            # A failed partial decode has already reported itself.
+            if e is not session.error:
+                await ws.send_json({"type": "error", "error": f"Transcription failed: {e}"})
+            await ws.close()
+        except Exception:
+            pass
     finally:
-        # Clean up after a short delay (helps Windows release lock)
-        await asyncio.sleep(1)  # 1 second delay
-        if os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-        if os.path.exists(temp_wav):
-            try:
-                os.unlink(temp_wav)
-            except:
-                pass
+        await session.close()
+
+@app.get("/transcribe/stats")
+def transcription_stats():
+    return TRANSCRIBER.stats()
@@ -0,0 +1,152 @@
+import re
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+NEGATION_CUES = {"no", "not", "denies", "denied", "deny", "without", "never", "absent", "negative", "nahi", "nahin"}
+# A cue negates only the phrase directly after it; these words may sit in between ("denies any
+# chest pain", "no signs of confusion"). Anything else ends the scope, so "no relief from chest
+# pain" and "no pulse and unconscious" still report their red flags.
+NEGATION_FILLERS = {"any", "a", "an", "the", "signs", "sign", "of", "history"}
+_CLAUSE_BREAK = re.compile(r"[.,;:!?\n]|\b(?:but|however|except|and|or|nor|with|plus|then)\b")
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+class Match(NamedTuple):
+    term: str
+    label: str
+    start: int
+    end: int
+    negated: bool
+
+
+class AhoCorasick:
+    # Character-level automaton over lowercased text: one pass over the input finds every
+    # pattern occurrence, regardless of how many patterns were compiled in.
+    def __init__(self, patterns: Dict[str, str]) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Tuple[Tuple[str, str], ...]] = [()]
+        for term, label in patterns.items():
+            term = term.lower().strip()
+            if term:
+                self._add(term, label)
+        self._link()
+
+    def _add(self, term: str, label: str) -> None:
+        node = 0
+        for ch in term:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = nxt
+        self.out[node] = self.out[node] + ((term, label),)
+
+    def _link(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int, str, str]]:
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for term, label in out[node]:
+                yield i + 1 - len(term), i + 1, term, label
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum()
+
+
+class PhraseMatcher:
+    def __init__(self, terms: Dict[str, str]) -> None:
+        self.terms = {t.lower().strip(): label for t, label in terms.items() if t and t.strip()}
+        self.automaton = AhoCorasick(self.terms)
+
+    def _negations(self, text: str) -> Tuple[List[int], List[bool]]:
+        # in_scope[i]: word i starts inside a cue's scope (the cue is the previous word, or only
+        # fillers separate them, with no clause break in between).
+        starts: List[int] = []
+        in_scope: List[bool] = []
+        open_scope = False
+        breaks = [m.start() for m in _CLAUSE_BREAK.finditer(text)]
+        b = 0
+        for m in _WORD.finditer(text):
+            while b < len(breaks) and breaks[b] < m.start():
+                open_scope = False
+                b += 1
+            starts.append(m.start())
+            in_scope.append(open_scope)
+            word = m.group(0)
+            if word in NEGATION_CUES:
+                open_scope = True
+            elif word not in NEGATION_FILLERS:
+                open_scope = False
+        return starts, in_scope
+
+    def scan(self, text: str, word_boundary: bool = True, negation: bool = True, overlaps: bool = False) -> List[Match]:
+        text = text.lower()
+        found: List[Match] = []
+        n = len(text)
+        raw = []
+        for start, end, term, label in self.automaton.iter(text):
+            if word_boundary:
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if end < n and _is_word_char(text[end]):
+                    continue
+            raw.append((start, end, term, label))
+        if not raw:
+            return found
+        if not overlaps:
+            # Keep the longest match and drop any match nested inside it ("pain" within "chest pain").
+            raw.sort(key=lambda r: (r[0], r[0] - r[1]))
+            kept = []
+            covered = -1
+            for r in raw:
+                if r[1] <= covered:
+                    continue
+                kept.append(r)
+                covered = r[1]
+            raw = kept
+        if negation:
+            starts, in_scope = self._negations(text)
+        for start, end, term, label in raw:
+            negated = False
+            if negation and starts:
+                # Only a match that begins on a word can be negated; one starting mid-word never is.
+                tok = bisect_right(starts, start) - 1
+                negated = tok >= 0 and starts[tok] == start and in_scope[tok]
+            found.append(Match(term, label, start, end, negated))
+        return found
+
+    def labels(self, text: str, word_boundary: bool = True) -> List[str]:
+        return list(dict.fromkeys(m.label for m in self.scan(text, word_boundary=word_boundary) if not m.negated))
+
+
+def build_terms(groups: Iterable[Tuple[str, Iterable[str]]]) -> Dict[str, str]:
+    terms: Dict[str, str] = {}
+    for label, synonyms in groups:
+        terms.setdefault(label.lower().strip(), label)
+        for s in synonyms:
+            terms.setdefault(s.lower().strip(), label)
+    return terms
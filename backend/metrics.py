@@ -0,0 +1,183 @@
+import time
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition without the client library. Each observation is a bisect and a few
+# additions under a per-metric lock (a few microseconds), cheap enough to leave on for every request.
+
+# Seconds; spans the local stages (tens of microseconds) up to LLM and Whisper calls.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(kw: Dict[str, Any]) -> Labels:
+    if len(kw) == 1:
+        (k, v), = kw.items()
+        return ((k, str(v)),)
+    return tuple(sorted((k, str(v)) for k, v in kw.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(_labels(labels), 0.0)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, v in items:
+            out.append(f"{self.name}{_fmt_labels(labels)} {_fmt_value(v)}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = s
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def time(self, **labels: Any) -> "_Timer":
+        return _Timer(self, labels)
+
+    def count(self, **labels: Any) -> int:
+        s = self._series.get(_labels(labels))
+        return s[2] if s else 0
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._series.items()]
+        for labels, (counts, total, n) in items:
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(labels, ('le', _fmt_value(bound)))} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(labels)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(labels)} {n}")
+        return out
+
+
+class _Timer:
+    # A plain class rather than @contextmanager: no generator per use on the hot path. The dict
+    # returned by __enter__ lets the body relabel the observation (e.g. path="fallback").
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist: Histogram, labels: Dict[str, Any]) -> None:
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self) -> Dict[str, Any]:
+        self.t0 = time.perf_counter()
+        return self.labels
+
+    def __exit__(self, *exc) -> None:
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Any] = []
+        # Callbacks sampled at scrape time, for state that already lives elsewhere (cache stats,
+        # queue depth). Each returns (name, type, help, [(labels dict, value), ...]).
+        self.collectors: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        m = Counter(name, help)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        m = Histogram(name, help, buckets)
+        self.metrics.append(m)
+        return m
+
+    def collector(self, fn: Callable) -> Callable:
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        for fn in self.collectors:
+            try:
+                families = fn()
+            except Exception:
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, v in samples:
+                    lines.append(f"{name}{_fmt_labels(_labels(labels))} {_fmt_value(v)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# stage: extract_symptoms, embed, search, rerank, classify, triage (fused extract+classify), graph,
+# ffmpeg, whisper. path: llm/fallback/local for the LLM stages; mode: lexical/dense/hybrid for search.
+STAGE_SECONDS = REGISTRY.histogram("sanjeevani_stage_seconds", "Time spent in each triage and transcription stage.")
+FALLBACKS = REGISTRY.counter("sanjeevani_fallback_total", "Times a stage fell back from the LLM to the local heuristic.")
+HTTP_SECONDS = REGISTRY.histogram("sanjeevani_http_request_seconds", "HTTP request latency by route and status.")
+SPECULATION = REGISTRY.counter("sanjeevani_speculative_retrieval_total", "Speculative raw-text retrievals by outcome (hit, miss, failed, cached).")
+SAVED_SECONDS = REGISTRY.histogram("sanjeevani_critical_path_saved_seconds", "Per-request latency saved by overlapping pipeline stages.")
+HEDGES = REGISTRY.counter("sanjeevani_hedged_requests_total", "Hedged upstream requests by which copy answered first.")
+CIRCUIT_REJECTED = REGISTRY.counter("sanjeevani_circuit_rejected_total", "Upstream calls skipped because the circuit was open.")
+GUIDELINE_RELOADS = REGISTRY.counter("sanjeevani_guideline_reloads_total", "Guideline hot reloads by outcome (applied, unchanged, failed).")
+DEADLINE_EXCEEDED = REGISTRY.counter("sanjeevani_deadline_exceeded_total", "Upstream calls that ran out of their stage budget.")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def stage(name: str, **labels: Any):
+    return STAGE_SECONDS.time(stage=name, **labels)
+
+
+def observe_stage(name: str, seconds: float, **labels: Any) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name, **labels)
+
+
+def render() -> str:
+    return REGISTRY.render()
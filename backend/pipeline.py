@@ -0,0 +1,316 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from rag import retrieve_context, aretrieve_context
+from redflag import has_red_flag
+from metrics import stage, SPECULATION, SAVED_SECONDS
+from resilience import Deadline
+
+# The per-request triage pipeline as a stage graph, shared by TriageEngine.analyze_case and
+# analyze_case_events:
+#
+#   extract ──────────────┬─> retrieve ─> decide ─> (graph, in fused mode)
+#   speculate (raw text) ─┘       └─────> graph (symptoms known)
+#   red_flags
+#
+# Stages start as soon as their inputs are ready, so retrieval on the raw text overlaps the LLM
+# extraction call and red-flag scanning overlaps both. The speculative contexts are kept when the
+# symptom query turns out close enough to the speculative one.
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def query_overlap(a: str, b: str) -> float:
+    ta, tb = set(_TOKEN.findall(a.lower())), set(_TOKEN.findall(b.lower()))
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+class StageGraph:
+    # Each stage is a task that awaits the stages it depends on, then runs. Records each stage's own
+    # time (excluding waits on its inputs and on other stages) for the sequential-cost estimate.
+    def __init__(self) -> None:
+        self.t0 = time.perf_counter()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.self_s: Dict[str, float] = {}
+        self._blocked: Dict[str, float] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], *deps: str) -> asyncio.Task:
+        async def _run() -> Any:
+            args = [await self.tasks[d] for d in deps]
+            start = time.perf_counter()
+            try:
+                return await fn(*args)
+            finally:
+                self.self_s[name] = time.perf_counter() - start - self._blocked.get(name, 0.0)
+
+        task = asyncio.ensure_future(_run())
+        self.tasks[name] = task
+        return task
+
+    async def get(self, name: str) -> Any:
+        return await self.tasks[name]
+
+    async def wait(self, waiter: str, name: str) -> Any:
+        # Awaits another stage from inside `waiter` without charging the wait to `waiter`.
+        start = time.perf_counter()
+        try:
+            return await self.tasks[name]
+        finally:
+            self._blocked[waiter] = self._blocked.get(waiter, 0.0) + time.perf_counter() - start
+
+    def discard(self, name: str) -> None:
+        task = self.tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def cancel(self) -> None:
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+
+
+class AsyncCalls:
+    def __init__(self, engine) -> None:
+        self.engine = engine
+
+    async def extract(self, text: str, timeout: float) -> List[str]:
+        return await self.engine._extract_symptoms_async(text, timeout)
+
+    async def retrieve(self, index, query: str, search: Dict[str, Any], timeout: float) -> List[Dict[str, Any]]:
+        return await aretrieve_context(index, query, top_k=5, embed_timeout=timeout, **(search or {}))
+
+    async def decide(self, mode: str, text: str, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool, timeout: float) -> Tuple[Dict[str, Any], bool]:
+        return await self.engine._decide_async(mode, text, symptoms, contexts, fallback_mode, timeout)
+
+
+_SYNC_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("SYNC_PIPELINE_THREADS", "8")), thread_name_prefix="triage-sync")
+
+
+class _LoopThread:
+    # The event loop the synchronous entry point drives its graph on: one long-lived loop on a
+    # daemon thread, so analyze_case works with or without an event loop running in the caller.
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def run(self, coro: Any) -> Any:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="triage-sync-loop", daemon=True).start()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            coro.close()
+            raise RuntimeError("analyze_case cannot be called from a pipeline stage; use analyze_case_async")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+
+_SYNC_LOOP = _LoopThread()
+
+
+def run_sync(coro: Any) -> Any:
+    return _SYNC_LOOP.run(coro)
+
+
+class SyncCalls:
+    # The blocking client calls, run on a shared pool so the synchronous entry point goes through
+    # the same graph (on the loop thread above) without touching the async client.
+    def __init__(self, engine) -> None:
+        self.engine = engine
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(_SYNC_POOL, fn, *args)
+
+    async def extract(self, text: str, timeout: float) -> List[str]:
+        return await self._run(self.engine._extract_symptoms, text, timeout)
+
+    async def retrieve(self, index, query: str, search: Dict[str, Any], timeout: float) -> List[Dict[str, Any]]:
+        return await self._run(lambda: retrieve_context(index, query, top_k=5, embed_timeout=timeout, **(search or {})))
+
+    async def decide(self, mode: str, text: str, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool, timeout: float) -> Tuple[Dict[str, Any], bool]:
+        return await self._run(self.engine._decide, mode, text, symptoms, contexts, fallback_mode, timeout)
+
+
+class _Run:
+    __slots__ = ("key", "leader", "speculation")
+
+    def __init__(self) -> None:
+        self.key = None
+        self.leader = False
+        self.speculation = "off"
+
+
+class TriagePipeline:
+    def __init__(self, engine, calls, coalesce: bool = True) -> None:
+        self.engine = engine
+        self.calls = calls
+        # Single-flight futures belong to one event loop; the sync entry point runs on its own.
+        self.coalesce = coalesce
+        self.speculate = os.getenv("SPECULATIVE_RETRIEVAL", "1").lower() not in ("0", "false", "no")
+        # Token Jaccard between the speculative and the symptom query needed to keep the contexts.
+        self.min_overlap = float(os.getenv("SPECULATION_MIN_OVERLAP", "0.8"))
+
+    async def run(self, text: str, search: Dict[str, Any] = None, timings: Dict[str, Any] = None) -> Dict[str, Any]:
+        final: Dict[str, Any] = {}
+        async for name, payload in self.events(text, search):
+            if name == "result":
+                final = payload
+            elif name == "timings" and timings is not None:
+                timings.update(payload)
+        return final
+
+    async def events(self, text: str, search: Dict[str, Any] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        e = self.engine
+        g = StageGraph()
+        run = _Run()
+        # Pinned for the whole request: a guideline reload swaps e.index, not the one in use here.
+        index = e.index
+        local = e._fast_path(text)
+        mode = "local" if local is not None else e.pipeline_mode
+        # One end-to-end budget (REQUEST_DEADLINE_S); each stage gets its share of what is left.
+        deadline = Deadline(stages=("extract", "retrieve", "decide") if mode == "two_call" else ("retrieve", "decide"))
+        spec_query = None
+        if mode == "two_call" and self.speculate:
+            spec_query = e._build_query(text, e.lexicon.extract(text).symptoms)[1]
+
+        async def extract() -> List[str]:
+            if local is not None:
+                return local
+            if mode == "fused":
+                with stage("extract_symptoms", path="local"):
+                    return e.extract_symptoms_fallback(text)
+            return await self.calls.extract(text, deadline.budget("extract"))
+
+        async def speculate() -> Optional[List[Dict[str, Any]]]:
+            try:
+                return await self.calls.retrieve(index, spec_query, search, deadline.budget("retrieve"))
+            except Exception:
+                # The regular retrieval runs instead and surfaces the error if it persists.
+                return None
+
+        async def red_flags() -> List[Dict[str, Any]]:
+            return e.red_flag_spans(text)
+
+        async def retrieve(symptoms: List[str]) -> Tuple[Any, List[Dict[str, Any]], bool]:
+            cleaned, query = e._build_query(text, symptoms)
+            logger.debug("query=%r cleaned_symptoms=%r", query, cleaned)
+            key = run.key = e._result_key(cleaned, search, mode, index, text)
+            if self.coalesce:
+                cached = await e._lookup_result(key)
+            else:
+                cached = e.result_cache.get(key) if key is not None else None
+            if cached is not None:
+                self._settle(g, run, "cached")
+                return cached, cached[1], False
+            run.leader = self.coalesce and key is not None and e._flights.claim(key)
+            raw = None
+            if "speculate" in g.tasks:
+                outcome = "miss"
+                if query_overlap(spec_query, query) >= self.min_overlap:
+                    raw = await g.wait("retrieve", "speculate")
+                    outcome = "hit" if raw is not None else "failed"
+                self._settle(g, run, outcome)
+            if raw is None:
+                raw = await self.calls.retrieve(index, query, search, deadline.budget("retrieve"))
+            contexts, fallback_mode = e._rerank(cleaned, raw, index)
+            logger.debug("retrieved=%r speculation=%s", [c.get("title","") for c in contexts], run.speculation)
+            return None, contexts, fallback_mode
+
+        async def decide(symptoms: List[str], retrieved) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+            cached, contexts, fallback_mode = retrieved
+            if cached is not None:
+                return cached
+            try:
+                result, ok = await self.calls.decide(mode, text, symptoms, contexts, fallback_mode, deadline.budget("decide"))
+                if ok and run.key is not None:
+                    e.result_cache.set(run.key, (result, contexts))
+                    if run.leader:
+                        e._flights.finish(run.key, (result, contexts))
+            finally:
+                if run.leader:
+                    e._flights.finish(run.key)
+            return result, contexts
+
+        async def graph(symptoms: List[str], decided=None) -> List[str]:
+            if decided is not None:
+                symptoms = decided[0].get("symptoms", symptoms)
+            with stage("graph"):
+                return e.graph.related_risks(symptoms)
+
+        # Creation order is start order: the extraction request goes out first.
+        g.add("extract", extract)
+        if spec_query is not None:
+            g.add("speculate", speculate)
+        g.add("red_flags", red_flags)
+        g.add("retrieve", retrieve, "extract")
+        g.add("decide", decide, "extract", "retrieve")
+        # In fused mode the symptoms the graph needs come back with the classification.
+        g.add("graph", graph, *(("extract", "decide") if mode == "fused" else ("extract",)))
+        try:
+            flags = await g.get("red_flags")
+            if flags:
+                yield "alert", {"urgent_alert": True, "has_red_flag": True, "red_flags": flags, "source": "text", "final": False}
+            symptoms = await g.get("extract")
+            if mode != "fused":
+                yield "symptoms", {"symptoms": symptoms}
+                yield "alert", self._symptom_alert(symptoms, flags)
+            _, contexts, _ = await g.get("retrieve")
+            yield "contexts", {"retrieved_contexts": [{"title": c.get("title",""), "risk": c.get("risk",""), "referral": c.get("referral",False)} for c in contexts]}
+            result, contexts = await g.get("decide")
+            if mode == "fused":
+                symptoms = result.get("symptoms", symptoms)
+                yield "symptoms", {"symptoms": symptoms}
+                yield "alert", self._symptom_alert(symptoms, flags)
+            insights = await g.get("graph")
+            final = e._assemble(text, symptoms, result, contexts, flags, graph_insights=insights)
+            yield "classification", {k: final[k] for k in ("possible_risk_pattern", "risk_level", "recommended_actions", "referral_needed", "urgent_alert", "graph_insights")}
+            yield "soap_note", final["soap_note"]
+            yield "timings", self._report(g, run, mode, index)
+            yield "result", final
+        finally:
+            g.cancel()
+            if run.leader:
+                e._flights.finish(run.key)
+
+    def _symptom_alert(self, symptoms: List[str], flags: List[Dict[str, Any]]) -> Dict[str, Any]:
+        red_flag = bool(flags) or has_red_flag(symptoms)
+        return {"urgent_alert": red_flag, "has_red_flag": red_flag, "red_flags": flags, "source": "symptoms", "final": False}
+
+    def _settle(self, g: StageGraph, run: _Run, outcome: str) -> None:
+        if "speculate" not in g.tasks:
+            return
+        if outcome != "hit":
+            g.discard("speculate")
+        run.speculation = outcome
+        SPECULATION.inc(outcome=outcome)
+
+    def _report(self, g: StageGraph, run: _Run, mode: str, index) -> Dict[str, Any]:
+        # sequential_ms: the same stages run back to back; a discarded speculation is not counted.
+        elapsed = g.elapsed()
+        sequential = sum(g.self_s.get(name, 0.0) for name in g.tasks)
+        saved = max(0.0, sequential - elapsed)
+        SAVED_SECONDS.observe(saved, mode=mode)
+        return {
+            "mode": mode,
+            "corpus_version": index.version,
+            "speculation": run.speculation,
+            "stages_ms": {name: round(1000 * g.self_s[name], 2) for name in g.tasks if name in g.self_s},
+            "elapsed_ms": round(1000 * elapsed, 2),
+            "sequential_ms": round(1000 * sequential, 2),
+            "critical_path_saved_ms": round(1000 * saved, 2),
+        }
@@ -36,3 +36,33 @@ def risk_classification_messages(symptoms: List[str], contexts: List[Dict[str, A
         "Return JSON: {\"possible_risk_pattern\":\"\",\"risk_level\":\"\",\"recommended_actions\":[],\"referral_needed\":false}"
     )
     return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+def fused_triage_messages(text: str, contexts: List[Dict[str, Any]], fallback_mode: bool = False, related_risks: List[str] = None) -> List[Dict[str, str]]:
+    # One round trip: symptom extraction and risk classification in the same completion. The
+    # context was retrieved on the raw text, so the model is told it may not all apply.
+    ctx_text = "\n\n".join([f"Title: {c.get('title','')}\nGuideline: {c.get('guideline','')}\nRisk:{c.get('risk','')}\nReferral:{c.get('referral',False)}\nSafe:{', '.join(c.get('safe_actions',[]))}" for c in contexts])
+    system = (
+        "You assist rural health triage. First extract only the symptoms mentioned in the input as short phrases; do not include medications. "
+        "Then classify risk for those symptoms. "
+        + (
+            "Rely strictly on the provided guideline context, which was retrieved from the raw input and may include entries that do not apply; ignore those. "
+            "If no context clearly matches the symptoms, set possible_risk_pattern to 'No clear matching pattern in guidelines' and risk_level to 'Medium'. "
+            if not fallback_mode else
+            "Use general safe triage knowledge; specific guideline matches were not found. "
+            "If uncertain, set possible_risk_pattern to 'No clear matching pattern in guidelines' and risk_level to 'Medium'. "
+        )
+        + "Tie the possible_risk_pattern directly to the extracted symptoms. "
+        "Do not assume conditions that are not mentioned. "
+        "Suggest only safe non-prescription actions. "
+        "State whether referral is needed. "
+        "Do not diagnose. Do not prescribe medicine. "
+        "Output only JSON with keys: symptoms, possible_risk_pattern, risk_level, recommended_actions, referral_needed."
+    )
+    related = related_risks or []
+    rel_line = f"\nRelated risks from medical knowledge graph: {', '.join(related)}" if related else ""
+    user = (
+        f"Input: {text}\n"
+        f"Context:\n{ctx_text}{rel_line}\n"
+        "Return JSON: {\"symptoms\":[],\"possible_risk_pattern\":\"\",\"risk_level\":\"\",\"recommended_actions\":[],\"referral_needed\":false}"
+    )
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
@@ -2,27 +2,133 @@ from http import client
 import os
 import json
 import math
+import hashlib
 from typing import List, Dict, Any, Tuple
 from xmlrpc import client 
 from xml.parsers.expat import model
 import numpy as np
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import faiss
+from embed_store import open_store
+from cache import TTLCache
+from lexical import BM25Index, reciprocal_rank_fusion
+from rerank import GuidelineTermIndex
+import ann
+from metrics import stage
+from resilience import EMBEDDINGS
+
+def corpus_version(entries: List[Dict[str, Any]]) -> str:
+    blob = json.dumps(entries, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+# Files of an on-disk index written by ingest.py: passages (entries) and their vectors in row order,
+# the manifest last, and the ANN index named by the manifest once the corpus is complete.
+MANIFEST = "manifest.json"
+PASSAGES = "passages.jsonl"
+VECTORS = "vectors.f32"
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
 class RAGIndex:
-    def __init__(self, entries: List[Dict[str, Any]]) -> None:
+    def __init__(self, entries: List[Dict[str, Any]], version: str = None) -> None:
         self.entries = entries
+        self.version = version or corpus_version(entries)
         self.emb_dim = None
         self.index = None
         self.matrix = None
-        self.vocab = None
+        self.lexical = None
+        self.terms = None
+        self.dense = False
+        self.built = False
+        # (model, dimensions) of the indexed vectors, and how many texts the last build sent to the API.
+        self.embed_model = None
+        self.embedded = 0
+        # RAG_HYBRID=1 fuses the dense ranking with BM25 (reciprocal rank fusion); off by default so
+        # enabling it is an explicit ranking change.
+        self.hybrid = os.getenv("RAG_HYBRID", "0") == "1"
+        self.fusion_depth = int(os.getenv("RAG_FUSION_DEPTH", "20"))
+        self.rrf_k = int(os.getenv("RAG_RRF_K", "60"))
+        self.ann_cfg = ann.index_config()
+        self._openai = None
+        self._async_openai = None
+        self._openai_lock = threading.Lock()
+        # One lock per lazily built resource, so building the BM25 index never waits on the term
+        # index or the client.
+        self._executor_lock = threading.Lock()
+        self._lexical_lock = threading.Lock()
+        self._terms_lock = threading.Lock()
+        self._executor = None
+        self.query_cache = TTLCache(
+            maxsize=int(os.getenv("QUERY_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("QUERY_CACHE_TTL", "86400")),
+        )
+
+    @classmethod
+    def open(cls, path: str, previous: "RAGIndex" = None) -> "RAGIndex":
+        # An index directory written by ingest.py. The passages are read into memory; the vectors
+        # and the ANN index stay read-only maps shared by every worker.
+        manifest = read_manifest(path)
+        if not manifest.get("complete"):
+            raise ValueError(f"{path} is not a complete index; run ingest.py again to finish it")
+        count, width = manifest["count"], manifest["width"]
+        with open(os.path.join(path, PASSAGES), "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for _, line in zip(range(count), f)]
+        index = cls(entries, version=manifest["version"])
+        model = (manifest["model"], manifest["dimensions"])
+        if model != index._embed_model():
+            raise ValueError(f"{path} was embedded with {model[0]}; EMBED_MODEL is {index._embed_model()[0]}")
+        if previous is not None:
+            index._share(previous)
+        index.built = True
+        index.term_index()
+        index.embed_model = model
+        index.emb_dim = width
+        index.matrix = np.memmap(os.path.join(path, VECTORS), dtype=np.float32, mode="r", shape=(count, width))
+        index.index = ann.configure(ann.read_index(os.path.join(path, manifest["index"])), index.ann_cfg)
+        index.dense = True
+        return index
 
     def _client(self) -> OpenAI:
-        key = os.getenv("OPENAI_API_KEY")
-        base = os.getenv("OPENAI_API_BASE")
-        if base:
-            return OpenAI(base_url=base, api_key=key)
-        return OpenAI(api_key=key)
+        # One long-lived client per index so the underlying httpx pool keeps connections alive.
+        if self._openai is None:
+            with self._openai_lock:
+                if self._openai is None:
+                    key = os.getenv("OPENAI_API_KEY")
+                    base = os.getenv("OPENAI_API_BASE")
+                    if base:
+                        self._openai = OpenAI(base_url=base, api_key=key)
+                    else:
+                        self._openai = OpenAI(api_key=key)
+        return self._openai
+
+    def _async_client(self) -> AsyncOpenAI:
+        if self._async_openai is None:
+            key = os.getenv("OPENAI_API_KEY")
+            base = os.getenv("OPENAI_API_BASE")
+            if base:
+                self._async_openai = AsyncOpenAI(base_url=base, api_key=key)
+            else:
+                self._async_openai = AsyncOpenAI(api_key=key)
+        return self._async_openai
+
+    def _search_executor(self) -> ThreadPoolExecutor:
+        # FAISS releases the GIL during search, so a small dedicated pool keeps it off the event loop
+        # without competing with the default executor.
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=int(os.getenv("RAG_SEARCH_THREADS", "2")),
+                        thread_name_prefix="rag-search",
+                    )
+        return self._executor
 
     def _norm_texts(self, texts: List[str]) -> List[str]:
         out = []
@@ -33,17 +139,38 @@ class RAGIndex:
             out.append(t)
         return out
 
-    def _embed(self, texts: List[str]) -> np.ndarray:
+    def _embed_model(self) -> Tuple[str, Any]:
+        model = os.getenv("EMBED_MODEL", "text-embedding-3-large")
+        # only large supports the dimensions parameter
+        dimensions = 1024 if model == "text-embedding-3-large" else None
+        return model, dimensions
+
+    def _embed(self, texts: List[str], timeout: float = None) -> np.ndarray:
         texts = self._norm_texts(texts)
         client = self._client()
-        model = os.getenv("EMBED_MODEL", "text-embedding-3-large")  # ← updated default
-        dimensions = 1024  # ← add this line (or 1536 / 512 for testing)
+        if timeout is not None:
+            client = client.with_options(timeout=timeout)
+        model, dimensions = self._embed_model()
 
         res = client.embeddings.create(
             model=model,
             input=texts,
-            dimensions=dimensions if model == "text-embedding-3-large" else None  # only large supports this
+            dimensions=dimensions
         )
+        return self._to_matrix(res)
+
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        texts = self._norm_texts(texts)
+        client = self._async_client()
+        model, dimensions = self._embed_model()
+        res = await client.embeddings.create(
+            model=model,
+            input=texts,
+            dimensions=dimensions
+        )
+        return self._to_matrix(res)
+
+    def _to_matrix(self, res: Any) -> np.ndarray:
         vecs = [np.array(d.embedding, dtype=np.float32) for d in res.data]
         arr = np.vstack(vecs)
         norms = np.linalg.norm(arr, axis=1, keepdims=True)
@@ -51,83 +178,231 @@ class RAGIndex:
         arr = arr / norms
         return arr
 
-    def build(self) -> None:
+    def build(self, previous: "RAGIndex" = None) -> None:
+        # With `previous` (a hot reload), guideline texts it already embedded reuse its vectors, its
+        # clients and its query-embedding cache; only new or edited texts go to the embeddings API.
         guidelines = [e["guideline"] for e in self.entries]
+        self.built = True
+        if previous is not None:
+            self._share(previous)
+        self.term_index()
         try:
-            mat = self._embed(guidelines)
+            if self._build_cached(guidelines, previous):
+                return
+            mat = self._embed_new(guidelines, previous)
         except Exception:
-            mat = self._fallback_build(guidelines)
+            if previous is not None and previous.dense:
+                # Never trade a dense index for BM25 on a transient failure; the caller keeps `previous`.
+                raise
+            # Offline: serve from the BM25 index alone until the next build.
+            self.dense = False
+            self._lexical()
+            return
         self.emb_dim = mat.shape[1]
-        self.matrix = mat
-        self.index = faiss.IndexFlatIP(self.emb_dim)
-        self.index.add(mat)
-
-    def _fallback_build(self, texts: List[str]) -> np.ndarray:
-        vocab: Dict[str, int] = {}
-        for t in self._norm_texts(texts):
-            for w in t.split():
-                if w not in vocab:
-                    vocab[w] = len(vocab)
-        self.vocab = vocab
-        dim = len(vocab)
-        mat = np.zeros((len(texts), dim), dtype=np.float32)
-        for i, t in enumerate(self._norm_texts(texts)):
-            for w in t.split():
-                mat[i, vocab[w]] += 1.0
-        norms = np.linalg.norm(mat, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0
-        mat = mat / norms
-        return mat
+        # The index holds the only in-memory copy of the vectors (RAG_VECTORS picks how compact).
+        self.index = ann.build_index(mat, self.ann_cfg)
+        self.dense = True
 
-    def _fallback_embed(self, texts: List[str]) -> np.ndarray:
-        texts = self._norm_texts(texts)
-        vocab: Dict[str, int] = {}
-        for t in texts:
-            for w in t.lower().split():
-                if w not in vocab:
-                    vocab[w] = len(vocab)
-        dim = len(vocab)
-        mat = np.zeros((len(texts), dim), dtype=np.float32)
-        for i, t in enumerate(texts):
-            for w in t.lower().split():
-                mat[i, vocab[w]] += 1.0
-        norms = np.linalg.norm(mat, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0
-        mat = mat / norms
-        return mat
+    def _share(self, previous: "RAGIndex") -> None:
+        # Query embeddings do not depend on the corpus, so the cache stays warm across reloads.
+        self._openai = previous._openai
+        self._async_openai = previous._async_openai
+        self._executor = previous._executor
+        self.query_cache = previous.query_cache
+
+    def _known_vectors(self, previous: "RAGIndex" = None) -> Dict[str, np.ndarray]:
+        if previous is None or not previous.dense or previous.embed_model != self._embed_model():
+            return {}
+        # Without the store's map, only an index that stores exact vectors can hand them back.
+        mat = previous.matrix if previous.matrix is not None else ann.exact_vectors(previous.index)
+        if mat is None:
+            return {}
+        texts = self._norm_texts([e["guideline"] for e in previous.entries])
+        return {t: mat[i] for i, t in enumerate(texts)}
+
+    def _embed_new(self, texts: List[str], previous: "RAGIndex" = None) -> np.ndarray:
+        known = self._known_vectors(previous)
+        norm = self._norm_texts(texts)
+        todo = list(dict.fromkeys(t for t in norm if t not in known))
+        if todo:
+            known.update(zip(todo, self._embed(todo)))
+        self.embedded += len(todo)
+        self.embed_model = self._embed_model()
+        return np.vstack([known[t] for t in norm]).astype(np.float32, copy=False)
 
-    def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        if self.index is None:
+    def _build_cached(self, texts: List[str], previous: "RAGIndex" = None) -> bool:
+        model, dimensions = self._embed_model()
+        store = open_store(model, dimensions)
+        if store is None:
+            return False
+        keys = [store.key(t) for t in self._norm_texts(texts)]
+        missing = set(store.missing(keys))
+        if missing:
+            todo = [t for t, k in zip(texts, keys) if k in missing]
+            todo_keys = [k for k in keys if k in missing]
+            # Only texts neither the store nor the previous index has seen go to the embeddings API.
+            vecs = self._embed_new(todo, previous)
+            try:
+                store.put(todo_keys, vecs)
+            except (OSError, TimeoutError, ValueError):
+                return False
+        mat = store.get(keys)
+        tag = ann.index_tag(len(keys), mat.shape[1], self.ann_cfg)
+        index = store.load_index(keys, tag)
+        if index is None or index.ntotal != len(keys) or index.d != mat.shape[1]:
+            index = ann.build_index(mat, self.ann_cfg)
+            try:
+                store.save_index(keys, index, tag)
+                # Serve from the read-only map of the saved file, like the workers that load it.
+                index = store.load_index(keys, tag) or index
+            except Exception:
+                pass
+        ann.configure(index, self.ann_cfg)
+        self.emb_dim = mat.shape[1]
+        # Kept only as a map of the store's file, never as a second copy on the heap.
+        self.matrix = mat if isinstance(mat, np.memmap) else None
+        self.index = index
+        self.embed_model = (model, dimensions)
+        self.dense = True
+        return True
+
+    def _lexical(self) -> BM25Index:
+        if self.lexical is None:
+            with self._lexical_lock:
+                if self.lexical is None:
+                    docs = [
+                        " ".join([e.get("title", ""), " ".join(t or "" for t in e.get("tags", [])), e.get("guideline", "")])
+                        for e in self.entries
+                    ]
+                    self.lexical = BM25Index([t.split() for t in self._norm_texts(docs)])
+        return self.lexical
+
+    def _cached_queries(self, queries: List[str]) -> Tuple[List[Any], Dict[Any, Any], List[Any]]:
+        model, dimensions = self._embed_model()
+        keys = [(model, dimensions, q) for q in self._norm_texts(queries)]
+        found = {k: self.query_cache.get(k) for k in dict.fromkeys(keys)}
+        missing = [k for k, v in found.items() if v is None]
+        return keys, found, missing
+
+    def _fill_queries(self, keys: List[Any], found: Dict[Any, Any], missing: List[Any], vecs: np.ndarray) -> np.ndarray:
+        for k, v in zip(missing, vecs):
+            v = v.reshape(1, -1)
+            self.query_cache.set(k, v)
+            found[k] = v
+        return np.vstack([found[k] for k in keys])
+
+    def _embed_queries(self, queries: List[str], timeout: float = None) -> np.ndarray:
+        keys, found, missing = self._cached_queries(queries)
+        # One embeddings request for every query the cache has not seen. Query embeddings go through
+        # the embeddings circuit breaker; a failure or timeout drops the request to BM25.
+        vecs = []
+        if missing:
+            texts = [k[2] for k in missing]
+            with stage("embed"):
+                vecs = EMBEDDINGS.call_sync(lambda t: self._embed(texts, timeout=t), timeout, stage="retrieve")
+        return self._fill_queries(keys, found, missing, vecs)
+
+    async def _aembed_queries(self, queries: List[str], timeout: float = None) -> np.ndarray:
+        keys, found, missing = self._cached_queries(queries)
+        vecs = []
+        if missing:
+            texts = [k[2] for k in missing]
+            with stage("embed"):
+                vecs = await EMBEDDINGS.call(lambda: self._aembed(texts), timeout, stage="retrieve")
+        return self._fill_queries(keys, found, missing, vecs)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.query_cache.stats()
+
+    def term_index(self) -> GuidelineTermIndex:
+        if self.terms is None:
+            with self._terms_lock:
+                if self.terms is None:
+                    self.terms = GuidelineTermIndex(self.entries)
+        return self.terms
+
+    def _rank(self, queries: List[str], qv: Any, k: int, nprobe: int = None, ef_search: int = None) -> List[List[int]]:
+        mode = "lexical" if qv is None else ("hybrid" if self.hybrid else "dense")
+        with stage("search", mode=mode):
+            return self._search(queries, qv, k, nprobe, ef_search)
+
+    def _search(self, queries: List[str], qv: Any, k: int, nprobe: int = None, ef_search: int = None) -> List[List[int]]:
+        n = len(self.entries)
+        k = min(k, n)
+        tokens = [q.split() for q in self._norm_texts(queries)]
+        if qv is None:
+            return self._lexical().search_many(tokens, k)
+        if not self.hybrid:
+            D, I = ann.search(self.index, qv, k, nprobe, ef_search)
+            return [[int(i) for i in row if i >= 0] for row in I]
+        # Hybrid: fuse dense and BM25 rankings over a deeper candidate pool.
+        depth = min(n, max(k, self.fusion_depth))
+        D, I = ann.search(self.index, qv, depth, nprobe, ef_search)
+        lexical = self._lexical().search_many(tokens, depth, positive_only=True)
+        return [
+            reciprocal_rank_fusion([[int(i) for i in row if i >= 0], lex], k=self.rrf_k, limit=k)
+            for row, lex in zip(I, lexical)
+        ]
+
+    def retrieve_many(self, queries: List[str], top_k: int = 3, nprobe: int = None, ef_search: int = None, embed_timeout: float = None) -> List[List[Dict[str, Any]]]:
+        if not queries:
+            return []
+        if not self.built:
             self.build()
-        try:
-            qv = self._embed([query])
-        except Exception:
-            if self.vocab is None:
-                # Build vocab from entries if missing
-                self._fallback_build([e["guideline"] for e in self.entries])
-            # Embed query using the stored vocab to align dimensions
-            dim = len(self.vocab)
-            qv = np.zeros((1, dim), dtype=np.float32)
-            for w in self._norm_texts([query])[0].split():
-                idx = self.vocab.get(w)
-                if idx is not None:
-                    qv[0, idx] += 1.0
-            norms = np.linalg.norm(qv, axis=1, keepdims=True)
-            norms[norms == 0] = 1.0
-            qv = qv / norms
-        D, I = self.index.search(qv, k=min(top_k, len(self.entries)))
-        out = []
-        for idx in I[0]:
-            e = self.entries[idx]
-            out.append(e)
-        return out
+        qv = None
+        if self.dense:
+            try:
+                qv = self._embed_queries(queries, embed_timeout)
+            except Exception:
+                qv = None
+        ranked = self._rank(queries, qv, top_k, nprobe, ef_search)
+        return [[self.entries[idx] for idx in row] for row in ranked]
+
+    def retrieve(self, query: str, top_k: int = 3, nprobe: int = None, ef_search: int = None, embed_timeout: float = None) -> List[Dict[str, Any]]:
+        return self.retrieve_many([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search, embed_timeout=embed_timeout)[0]
+
+    async def aretrieve_many(self, queries: List[str], top_k: int = 3, nprobe: int = None, ef_search: int = None, embed_timeout: float = None) -> List[List[Dict[str, Any]]]:
+        if not queries:
+            return []
+        loop = asyncio.get_running_loop()
+        pool = self._search_executor()
+        if not self.built:
+            await loop.run_in_executor(pool, self.build)
+        qv = None
+        if self.dense:
+            try:
+                qv = await self._aembed_queries(queries, embed_timeout)
+            except Exception:
+                qv = None
+        ranked = await loop.run_in_executor(pool, self._rank, queries, qv, top_k, nprobe, ef_search)
+        return [[self.entries[idx] for idx in row] for row in ranked]
+
+    async def aretrieve(self, query: str, top_k: int = 3, nprobe: int = None, ef_search: int = None, embed_timeout: float = None) -> List[Dict[str, Any]]:
+        return (await self.aretrieve_many([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search, embed_timeout=embed_timeout))[0]
 
 def load_guidelines(path: str) -> List[Dict[str, Any]]:
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def embed_documents(index: RAGIndex) -> None:
-    index.build()
+def embed_documents(index: RAGIndex, previous: RAGIndex = None) -> None:
+    index.build(previous)
+
+def load_index(path: str) -> RAGIndex:
+    # A guidelines JSON file is embedded on load; a directory written by ingest.py is opened as is.
+    if os.path.isdir(path):
+        return RAGIndex.open(path)
+    index = RAGIndex(load_guidelines(path))
+    embed_documents(index)
+    return index
+
+def retrieve_context(index: RAGIndex, query: str, top_k: int = 3, **search_params: Any) -> List[Dict[str, Any]]:
+    return index.retrieve(query, top_k=top_k, **search_params)
+
+def retrieve_contexts(index: RAGIndex, queries: List[str], top_k: int = 3, **search_params: Any) -> List[List[Dict[str, Any]]]:
+    return index.retrieve_many(queries, top_k=top_k, **search_params)
+
+async def aretrieve_context(index: RAGIndex, query: str, top_k: int = 3, **search_params: Any) -> List[Dict[str, Any]]:
+    return await index.aretrieve(query, top_k=top_k, **search_params)
 
-def retrieve_context(index: RAGIndex, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
-    return index.retrieve(query, top_k=top_k)
+async def aretrieve_contexts(index: RAGIndex, queries: List[str], top_k: int = 3, **search_params: Any) -> List[List[Dict[str, Any]]]:
+    return await index.aretrieve_many(queries, top_k=top_k, **search_params)
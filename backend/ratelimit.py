@@ -0,0 +1,147 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class TokenBucketLimiter:
+    # Fixed-size state per key: (tokens, last refill time). Buckets refill continuously at `rate`
+    # tokens/second up to `capacity`. A bucket idle for capacity/rate seconds is full again, so it is
+    # indistinguishable from a fresh one and can be dropped; the OrderedDict is kept in
+    # last-seen order, which makes that eviction (and the max_keys bound) an O(1) pop from the front.
+    def __init__(self, rate: float, capacity: float, max_keys: int = 100000) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_keys = max(1, int(max_keys))
+        self.idle = self.capacity / self.rate if self.rate > 0 else float("inf")
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.rejected = 0
+
+    def allow(self, key: Hashable, cost: float = 1.0) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = [self.capacity, now]
+                self._buckets[key] = b
+            else:
+                b[0] = min(self.capacity, b[0] + (now - b[1]) * self.rate)
+                b[1] = now
+                self._buckets.move_to_end(key)
+            self._evict(now)
+            if b[0] >= cost:
+                b[0] -= cost
+                return True
+            self.rejected += 1
+            return False
+
+    def _evict(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            key, b = next(iter(buckets.items()))
+            if len(buckets) <= self.max_keys and now - b[1] < self.idle:
+                break
+            buckets.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": "memory",
+            "keys": len(self._buckets),
+            "max_keys": self.max_keys,
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+        }
+
+
+class SQLiteTokenBucketLimiter:
+    # Same bucket semantics, stored in a SQLite file so every uvicorn worker on the host draws from
+    # the same buckets. Each check is one short IMMEDIATE transaction on a primary-key row; idle
+    # rows are purged every `purge_every` checks. Wall-clock time is used since it is shared
+    # between processes.
+    def __init__(self, path: str, rate: float, capacity: float, purge_every: int = 1000, timeout: float = 1.0) -> None:
+        self.path = path
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.idle = self.capacity / self.rate if self.rate > 0 else float("inf")
+        self.purge_every = max(1, int(purge_every))
+        self.timeout = timeout
+        self._local = threading.local()
+        self._checks = 0
+        self.rejected = 0
+        self.errors = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_ts ON buckets (ts)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def allow(self, key: Hashable, cost: float = 1.0) -> bool:
+        now = time.time()
+        key = str(key)
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, ts FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                ok = tokens >= cost
+                if ok:
+                    tokens -= cost
+                conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, ts) VALUES (?, ?, ?)", (key, tokens, now))
+                self._checks += 1
+                if self._checks % self.purge_every == 0:
+                    conn.execute("DELETE FROM buckets WHERE ts < ?", (now - self.idle,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            # Fail open: a locked or unavailable store must not take the API down with it.
+            self.errors += 1
+            return True
+        if not ok:
+            self.rejected += 1
+        return ok
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": "sqlite",
+            "path": self.path,
+            "keys": len(self),
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+def create_limiter():
+    limit = float(os.getenv("RATE_LIMIT", "30"))
+    window = float(os.getenv("RATE_WINDOW", "60"))
+    burst = float(os.getenv("RATE_BURST", str(limit)))
+    rate = limit / window if window > 0 else limit
+    if os.getenv("RATE_LIMIT_STORE", "memory").lower() == "sqlite":
+        path = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "sanjeevani_ratelimit.sqlite"))
+        return SQLiteTokenBucketLimiter(path, rate, burst)
+    return TokenBucketLimiter(rate, burst, max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
@@ -1,4 +1,5 @@
-from typing import List
+from typing import Any, Dict, Iterable, List
+from matcher import PhraseMatcher, Match, build_terms
 
 RED_FLAGS = {
     "unconscious",
@@ -17,10 +18,59 @@ RED_FLAGS = {
     "blood in stool"
 }
 
+RED_FLAG_SYNONYMS = {
+    "unconscious": ["unresponsive", "not responding", "passed out", "loss of consciousness", "lost consciousness"],
+    "severe bleeding": ["heavy bleeding", "bleeding heavily", "profuse bleeding", "excessive bleeding"],
+    "chest pain": ["pain in chest", "chest tightness", "chest pressure"],
+    "shortness of breath": ["breathlessness", "breathless", "short of breath", "cannot breathe", "can't breathe"],
+    "difficulty breathing": ["trouble breathing", "struggling to breathe", "labored breathing", "laboured breathing"],
+    "confusion": ["confused", "disoriented"],
+    "fainting": ["fainted", "faints", "collapsed"],
+    "very high fever": ["extremely high fever"],
+    "convulsions": ["convulsion", "seizure", "seizures", "fits", "fitting"],
+    "pregnancy bleeding": ["bleeding in pregnancy", "bleeding during pregnancy"],
+    "pregnancy severe headache": ["severe headache in pregnancy", "severe headache during pregnancy"],
+    "neck stiffness": ["stiff neck"],
+    "blood in vomit": ["vomiting blood", "vomited blood"],
+    "blood in stool": ["bloody stool", "bloody stools"],
+}
+
+
+def _guideline_terms(entries: Iterable[Dict[str, Any]]) -> Dict[str, str]:
+    # Guidelines opt in by carrying a "red flag" tag (their other tags become flags) or an
+    # explicit "red_flags" list; generic tags like "fever" or "pregnancy" stay out of the matcher.
+    terms: Dict[str, str] = {}
+    for e in entries:
+        tags = [str(t).lower().strip() for t in e.get("tags", []) if t]
+        extra = [str(t).lower().strip() for t in e.get("red_flags", []) if t]
+        if "red flag" in tags:
+            extra.extend(t for t in tags if t != "red flag")
+        for t in extra:
+            terms.setdefault(t, t)
+    return terms
+
+
+def build_red_flag_matcher(entries: Iterable[Dict[str, Any]] = (), extra: Dict[str, Iterable[str]] = None) -> PhraseMatcher:
+    groups = [(f, RED_FLAG_SYNONYMS.get(f, [])) for f in sorted(RED_FLAGS)]
+    groups.extend((extra or {}).items())
+    terms = _guideline_terms(entries)
+    terms.update(build_terms(groups))
+    return PhraseMatcher(terms)
+
+
+_DEFAULT_MATCHER = build_red_flag_matcher()
+
+
+def scan_red_flags(text: str, matcher: PhraseMatcher = None) -> List[Match]:
+    # Raw-text fast path: word-bounded, negation-aware ("no chest pain" is not a flag).
+    m = matcher or _DEFAULT_MATCHER
+    return [x for x in m.scan(text) if not x.negated]
+
+
 def has_red_flag(symptoms: List[str]) -> bool:
-    s = {x.lower().strip() for x in symptoms}
-    for flag in RED_FLAGS:
-        if any(flag in y for y in s):
+    # Extracted symptoms are already affirmative short phrases; keep the substring semantics.
+    for s in symptoms:
+        if _DEFAULT_MATCHER.scan(s.lower().strip(), word_boundary=False, negation=False):
             return True
     return False
 
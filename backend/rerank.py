@@ -0,0 +1,126 @@
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from cache import TTLCache
+
+RERANK_SYNONYMS = {
+    "shortness of breath": ["breathlessness", "difficulty breathing"],
+    "severe chest pain": ["chest pain"]
+}
+
+NO_MATCH = -100
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def expand_terms(cleaned: Iterable[str]) -> Set[str]:
+    match_terms = set(cleaned)
+    for k, vs in RERANK_SYNONYMS.items():
+        if k in match_terms:
+            match_terms.update(vs)
+    return match_terms
+
+
+class GuidelineTermIndex:
+    # One pass over the corpus at load time builds sparse postings: word -> ids of the entries whose
+    # title+guideline contain it, and tag -> {entry id: occurrences}. A match term resolves once
+    # (then from the cache) to the set of entries it hits in the text and its tag counts per
+    # entry, by scanning the word and tag vocabularies rather than the corpus; scoring a request is
+    # then a set or dict lookup per candidate and term.
+    # Same substring semantics as the original scorer ("pain" hits "painful"): a single-word term
+    # is matched exactly through the vocabulary; the entries a multi-word term's words all hit are
+    # only candidates, confirmed against the text when one of them is scored.
+    def __init__(self, entries: List[Dict[str, Any]], cache_size: int = 8192) -> None:
+        self.entries = entries
+        self.n = len(entries)
+        self.pos = {id(e): i for i, e in enumerate(entries)}
+        self.texts = [(e.get("title", "") + " " + e.get("guideline", "")).lower() for e in entries]
+        words: Dict[str, List[int]] = {}
+        tags: Dict[str, Dict[int, int]] = {}
+        for i, (e, text) in enumerate(zip(entries, self.texts)):
+            for w in set(_WORD.findall(text)):
+                words.setdefault(w, []).append(i)
+            for t in e.get("tags", []):
+                counts = tags.setdefault((t or "").lower(), {})
+                counts[i] = counts.get(i, 0) + 1
+        # Compact int arrays: the word postings are the bulk of the index for large corpora.
+        self.word_postings = {w: array("i", ids) for w, ids in words.items()}
+        self.tag_postings = tags
+        self._terms = TTLCache(maxsize=cache_size)
+        self._words = TTLCache(maxsize=cache_size)
+
+    def _word_docs(self, word: str) -> Set[int]:
+        hit = self._words.get(word)
+        if hit is None:
+            hit = set()
+            for w, ids in self.word_postings.items():
+                if word in w:
+                    hit.update(ids)
+            self._words.set(word, hit)
+        return hit
+
+    def postings(self, term: str) -> Tuple[Optional[Set[int]], bool, Dict[int, int]]:
+        # (entries the term may hit in the text or None for "check the text", whether that set is
+        # exact, tag occurrences per entry).
+        hit = self._terms.get(term)
+        if hit is None:
+            words = _WORD.findall(term)
+            docs: Optional[Set[int]] = None
+            for w in words:
+                found = self._word_docs(w)
+                docs = set(found) if docs is None else docs & found
+            exact = len(words) == 1 and words[0] == term
+            tag_hits: Dict[int, int] = {}
+            for t, counts in self.tag_postings.items():
+                if term in t:
+                    for i, c in counts.items():
+                        tag_hits[i] = tag_hits.get(i, 0) + c
+            hit = (docs, exact, tag_hits)
+            self._terms.set(term, hit)
+        return hit
+
+    def positions(self, contexts: List[Dict[str, Any]]) -> List[int]:
+        return [self.pos[id(c)] for c in contexts]
+
+    def scores(self, terms: Iterable[str], positions: List[int]) -> Tuple[List[int], List[int]]:
+        # Independent of corpus size; a text check only for multi-word terms on candidates that
+        # already carry all of the term's words.
+        base = [0] * len(positions)
+        tag = [0] * len(positions)
+        texts = self.texts
+        for term in terms:
+            docs, exact, tag_hits = self.postings(term)
+            for j, p in enumerate(positions):
+                if (docs is None or p in docs) and (exact or term in texts[p]):
+                    base[j] += 1
+                if tag_hits:
+                    tag[j] += tag_hits.get(p, 0)
+        return base, tag
+
+    def rerank(self, cleaned: List[str], contexts: List[Dict[str, Any]], keep: int = 3) -> Tuple[List[Dict[str, Any]], bool]:
+        if not contexts:
+            return [], True
+        if any(id(c) not in self.pos for c in contexts):
+            return rerank_naive(cleaned, contexts, keep)
+        base, tag = self.scores(expand_terms(cleaned), self.positions(contexts))
+        score = [NO_MATCH if b == 0 and t == 0 else b + 2 * t for b, t in zip(base, tag)]
+        # Stable sort keeps retrieval order between equal scores, as sorted() did.
+        order = sorted(range(len(contexts)), key=lambda i: -score[i])[:keep]
+        fallback_mode = max(base[i] for i in order) <= 0
+        return [contexts[i] for i in order], fallback_mode
+
+
+def rerank_naive(cleaned: List[str], contexts: List[Dict[str, Any]], keep: int = 3) -> Tuple[List[Dict[str, Any]], bool]:
+    match_terms = expand_terms(cleaned)
+    def _score(c):
+        text = (c.get("title","") + " " + c.get("guideline","")).lower()
+        base = sum(1 for s in match_terms if s in text)
+        tags = c.get("tags", [])
+        tag_score = sum(2 for s in match_terms for t in tags if s in (t or "").lower())
+        if base == 0 and tag_score == 0:
+            return NO_MATCH
+        return base + tag_score
+    contexts = sorted(contexts, key=_score, reverse=True)[:keep]
+    max_score = NO_MATCH if not contexts else max(
+        [sum(1 for s in match_terms if s in (c.get("title","") + " " + c.get("guideline","")).lower()) for c in contexts]
+    )
+    return contexts, max_score <= 0
@@ -0,0 +1,262 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from metrics import HEDGES, CIRCUIT_REJECTED, DEADLINE_EXCEEDED
+
+# Latency budget and upstream protection for the OpenAI calls:
+#   Deadline        one end-to-end budget per request, split across the remaining stages
+#   CircuitBreaker  fails fast to the local fallbacks while an upstream keeps failing
+#   Upstream        breaker + timeout + optional hedged duplicate after the observed p95
+
+# Stage order and each stage's share of REQUEST_DEADLINE_S. Time an earlier stage leaves unused
+# is redistributed over the stages still to run.
+STAGE_ORDER = ("extract", "retrieve", "decide")
+
+
+def _shares(raw: str) -> Dict[str, float]:
+    out = {"extract": 0.3, "retrieve": 0.15, "decide": 0.55}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            out[name.strip()] = float(value)
+    return out
+
+
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "15"))
+STAGE_SHARES = _shares(os.getenv("STAGE_BUDGET_SHARES", ""))
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str) -> None:
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+
+class Deadline:
+    def __init__(self, total: float = None, stages: Iterable[str] = STAGE_ORDER) -> None:
+        self.total = REQUEST_DEADLINE_S if total is None else total
+        self.end = time.monotonic() + self.total
+        self.stages = [s for s in STAGE_ORDER if s in set(stages)]
+
+    def remaining(self) -> float:
+        return max(0.0, self.end - time.monotonic())
+
+    def budget(self, stage: str) -> float:
+        later = self.stages[self.stages.index(stage):] if stage in self.stages else [stage]
+        share = STAGE_SHARES.get(stage, 0.0)
+        total = sum(STAGE_SHARES.get(s, 0.0) for s in later) or 1.0
+        return self.remaining() * share / total
+
+
+def stage_timeout(stage: str) -> float:
+    # For callers without a per-request deadline (batches): the stage's share of the full budget.
+    return REQUEST_DEADLINE_S * STAGE_SHARES.get(stage, 0.0) / (sum(STAGE_SHARES.get(s, 0.0) for s in STAGE_ORDER) or 1.0)
+
+
+class CircuitBreaker:
+    # closed: calls pass. It opens when, within the last `window` seconds, at least `failures` calls
+    # failed and they make up at least `ratio` of the calls, so an occasional slow tail does not
+    # trip it. open: calls are rejected for `reset` seconds. half_open: one probe call decides.
+    def __init__(self, name: str, failures: int = 5, window: float = 30.0, reset: float = 15.0, ratio: float = 0.5) -> None:
+        self.name = name
+        self.failures = failures
+        self.window = window
+        self.reset = reset
+        self.ratio = ratio
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.opens = 0
+        self._events: deque = deque()  # (monotonic time, ok)
+        self._failed = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                self.state = "closed"
+                self._probing = False
+                self._clear()
+            self._record(time.monotonic(), True)
+
+    def release(self) -> None:
+        # A call that ended with no verdict (cancelled): free the half-open probe slot without
+        # recording an outcome, so the next call probes instead of the breaker staying wedged.
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def failure(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == "half_open":
+                self._open(now)
+                return
+            if self.state == "open":
+                return
+            self._record(now, False)
+            if self._failed >= self.failures and self._failed >= self.ratio * len(self._events):
+                self._open(now)
+
+    def _record(self, now: float, ok: bool) -> None:
+        self._events.append((now, ok))
+        if not ok:
+            self._failed += 1
+        while self._events and now - self._events[0][0] > self.window:
+            if not self._events.popleft()[1]:
+                self._failed -= 1
+
+    def _clear(self) -> None:
+        self._events.clear()
+        self._failed = 0
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self.opened_at = now
+        self.opens += 1
+        self._probing = False
+        self._clear()
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self.state, "opens": self.opens, "recent_failures": self._failed}
+
+
+class Upstream:
+    def __init__(self, name: str, hedge: bool = False, hedge_quantile: float = 0.95, hedge_min_samples: int = 20, hedge_max_ratio: float = 0.1) -> None:
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            failures=int(os.getenv("CIRCUIT_FAILURES", "5")),
+            window=float(os.getenv("CIRCUIT_WINDOW_S", "30")),
+            reset=float(os.getenv("CIRCUIT_RESET_S", "15")),
+            ratio=float(os.getenv("CIRCUIT_FAILURE_RATIO", "0.5")),
+        )
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        # Hedges never exceed this fraction of calls, so a slow upstream is not hit with double load.
+        self.hedge_max_ratio = hedge_max_ratio
+        self.calls = 0
+        self.hedged = 0
+        self._latencies: deque = deque(maxlen=256)
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+            return None
+        if self.hedged >= self.hedge_max_ratio * self.calls:
+            return None
+        lat = sorted(self._latencies)
+        return lat[min(len(lat) - 1, int(self.hedge_quantile * len(lat)))]
+
+    async def call(self, make: Callable[[], Awaitable[Any]], timeout: Optional[float] = None, stage: str = "") -> Any:
+        # `make` starts a fresh request each time it is called; a hedge calls it a second time.
+        if timeout is not None and timeout <= 0:
+            # The request's budget is already spent; not the upstream's fault, so no breaker failure.
+            DEADLINE_EXCEEDED.inc(stage=stage or self.name)
+            raise asyncio.TimeoutError()
+        if not self.breaker.allow():
+            CIRCUIT_REJECTED.inc(upstream=self.name)
+            raise CircuitOpen(self.name)
+        self.calls += 1
+        t0 = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._race(make, self.hedge_delay()), timeout)
+        except asyncio.TimeoutError:
+            DEADLINE_EXCEEDED.inc(stage=stage or self.name)
+            self.breaker.failure()
+            raise
+        except asyncio.CancelledError:
+            # Speculative retrievals are cancelled routinely; that says nothing about the upstream.
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.failure()
+            raise
+        self._latencies.append(time.perf_counter() - t0)
+        self.breaker.success()
+        return result
+
+    async def _race(self, make: Callable[[], Awaitable[Any]], hedge_after: Optional[float]) -> Any:
+        if hedge_after is None:
+            return await make()
+        first = asyncio.ensure_future(make())
+        pending = {first}
+        hedged = False
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                hedged = True
+                self.hedged += 1
+                pending.add(asyncio.ensure_future(make()))
+            error = None
+            while done or pending:
+                for task in done:
+                    if task.exception() is None:
+                        if hedged:
+                            HEDGES.inc(upstream=self.name, winner="primary" if task is first else "hedge")
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def call_sync(self, fn: Callable[[Optional[float]], Any], timeout: Optional[float] = None, stage: str = "") -> Any:
+        # Blocking clients cannot be raced or cancelled; `fn` receives the timeout to pass to the SDK.
+        if timeout is not None and timeout <= 0:
+            DEADLINE_EXCEEDED.inc(stage=stage or self.name)
+            raise TimeoutError()
+        if not self.breaker.allow():
+            CIRCUIT_REJECTED.inc(upstream=self.name)
+            raise CircuitOpen(self.name)
+        self.calls += 1
+        t0 = time.perf_counter()
+        try:
+            result = fn(timeout)
+        except Exception:
+            self.breaker.failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self._latencies.append(time.perf_counter() - t0)
+        self.breaker.success()
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        lat = sorted(self._latencies)
+        p95 = lat[min(len(lat) - 1, int(0.95 * len(lat)))] if lat else None
+        return {**self.breaker.status(), "calls": self.calls, "hedged": self.hedged, "p95_s": round(p95, 3) if p95 is not None else None}
+
+
+_HEDGED = {n.strip() for n in os.getenv("HEDGE_UPSTREAMS", "").split(",") if n.strip()}
+_HEDGE_KW = dict(
+    hedge_quantile=float(os.getenv("HEDGE_QUANTILE", "0.95")),
+    hedge_max_ratio=float(os.getenv("HEDGE_MAX_RATIO", "0.1")),
+)
+
+CHAT = Upstream("chat", hedge="chat" in _HEDGED, **_HEDGE_KW)
+EMBEDDINGS = Upstream("embeddings", hedge="embeddings" in _HEDGED, **_HEDGE_KW)
+UPSTREAMS: Dict[str, Upstream] = {u.name: u for u in (CHAT, EMBEDDINGS)}
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    return {name: u.status() for name, u in UPSTREAMS.items()}
@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+# Set when this module is first imported, which main.py does before its heavy imports.
+PROCESS_T0 = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentUnavailable(Exception):
+    def __init__(self, name: str, state: str, error: Optional[str] = None) -> None:
+        super().__init__(f"{name} is {state}" + (f": {error}" if error else ""))
+        self.name = name
+        self.state = state
+
+
+class Component:
+    # A heavy resource loaded off the event loop. Eager components start loading when the app
+    # starts; lazy ones on first use. Either way concurrent callers share the one load. Components
+    # that are not required are reported but never hold back readiness.
+    def __init__(self, name: str, loader: Callable[[], Any], enabled: bool = True, lazy: bool = False, required: bool = True) -> None:
+        self.name = name
+        self.loader = loader
+        self.enabled = enabled
+        self.lazy = lazy
+        self.required = required
+        self.state = "pending" if enabled else "disabled"
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.load_s: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> Optional[asyncio.Task]:
+        if not self.enabled:
+            return None
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._load())
+        return self._task
+
+    async def _load(self) -> None:
+        self.state = "loading"
+        t0 = time.perf_counter()
+        try:
+            self.value = await asyncio.to_thread(self.loader)
+            self.state = "ready"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+        self.load_s = round(time.perf_counter() - t0, 3)
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        task = self.start()
+        if task is None:
+            raise ComponentUnavailable(self.name, self.state)
+        if not task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                raise ComponentUnavailable(self.name, self.state)
+        if self.state != "ready":
+            raise ComponentUnavailable(self.name, self.state, self.error)
+        return self.value
+
+    def status(self) -> Dict[str, Any]:
+        out = {"state": self.state, "lazy": self.lazy, "required": self.required}
+        if self.load_s is not None:
+            out["load_s"] = self.load_s
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+class Startup:
+    def __init__(self) -> None:
+        self.components: Dict[str, Component] = {}
+        self.first_request_s: Optional[float] = None
+        self.app_start_s: Optional[float] = None
+        # SKIP_COMPONENTS disables subsystems outright; LAZY_COMPONENTS defers them to first use.
+        self.skip = _names(os.getenv("SKIP_COMPONENTS", ""))
+        self.lazy = _names(os.getenv("LAZY_COMPONENTS", "whisper"))
+
+    def add(self, name: str, loader: Callable[[], Any], enabled: bool = True, required: bool = True) -> Component:
+        comp = Component(name, loader, enabled=enabled and name not in self.skip, lazy=name in self.lazy, required=required)
+        self.components[name] = comp
+        return comp
+
+    def __getitem__(self, name: str) -> Component:
+        return self.components[name]
+
+    def start(self) -> List[asyncio.Task]:
+        # Called from the lifespan: eager components load concurrently while the server accepts
+        # connections, so liveness is answered immediately.
+        self.app_start_s = round(time.perf_counter() - PROCESS_T0, 3)
+        return [t for c in self.components.values() if not c.lazy for t in [c.start()] if t is not None]
+
+    def mark_request(self) -> None:
+        if self.first_request_s is None:
+            self.first_request_s = round(time.perf_counter() - PROCESS_T0, 3)
+            logger.info("import_to_app_start_s=%s import_to_first_request_s=%s", self.app_start_s, self.first_request_s)
+
+    def ready(self) -> bool:
+        # Lazy components load on demand, so they do not hold back readiness until they fail.
+        return all(c.ready() or (c.lazy and c.state in ("pending", "loading")) for c in self.components.values() if c.enabled and c.required)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "components": {name: c.status() for name, c in self.components.items()},
+            "import_to_app_start_s": self.app_start_s,
+            "import_to_first_request_s": self.first_request_s,
+        }
+
+
+def _names(raw: str) -> set:
+    return {n.strip().lower() for n in raw.split(",") if n.strip()}
@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    # Offline engine over the bundled guidelines: no API key, so no LLM client and a lexical index.
+    with pytest.MonkeyPatch.context() as mp:
+        mp.delenv("OPENAI_API_KEY", raising=False)
+        mp.delenv("OPENAI_API_BASE", raising=False)
+        from triage import TriageEngine
+        return TriageEngine(os.path.join(BACKEND, "guidelines.json"))
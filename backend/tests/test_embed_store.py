@@ -0,0 +1,27 @@
+import os
+import json
+import numpy as np
+import ann
+from embed_store import EmbeddingStore
+
+
+def _index(n):
+    return ann.build_index(np.eye(n, 4, dtype=np.float32), dict(ann.index_config(), kind="flat", codec="f32"))
+
+
+def test_saving_a_new_corpus_index_removes_the_superseded_one(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model", None)
+    other = EmbeddingStore(str(tmp_path), "model-b", None)
+    keys = [store.key(t) for t in ("a", "b", "c")]
+    store.put(keys, np.eye(3, 4, dtype=np.float32))
+    other.save_index(keys, _index(3))
+    store.save_index(keys[:2], _index(2))
+    first = store.index_path(keys[:2])
+    store.save_index(keys, _index(3))
+    current = store.index_path(keys)
+    assert not os.path.exists(first)
+    assert os.path.exists(current) and os.path.exists(other.index_path(keys))
+    with open(store.meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["index"] == os.path.basename(current) and len(meta["rows"]) == 3
+    assert store.load_index(keys).ntotal == 3
@@ -0,0 +1,36 @@
+import numpy as np
+import ann
+from lexical import reciprocal_rank_fusion
+from rag import RAGIndex
+
+ENTRIES = [{"id": i, "title": w, "guideline": f"{w} guideline", "tags": []} for i, w in enumerate(["alpha", "bravo", "charlie", "delta"])]
+
+
+def _dense_index(monkeypatch, hybrid):
+    monkeypatch.setenv("RAG_HYBRID", hybrid)
+    index = RAGIndex(ENTRIES)
+    index.index = ann.build_index(np.eye(4, dtype=np.float32), dict(ann.index_config(), kind="flat", codec="f32"))
+    index.dense = True
+    return index
+
+
+def _query():
+    q = np.array([[4, 3, 2, 1]], dtype=np.float32)
+    return q / np.linalg.norm(q)
+
+
+def test_rrf_ordering_is_pinned():
+    assert reciprocal_rank_fusion([[3, 1, 2], [2, 3]], k=60) == [3, 2, 1]
+
+
+def test_hybrid_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("RAG_HYBRID", raising=False)
+    assert not RAGIndex(ENTRIES).hybrid
+
+
+def test_dense_ordering(monkeypatch):
+    assert _dense_index(monkeypatch, "0")._search(["delta"], _query(), 4) == [[0, 1, 2, 3]]
+
+
+def test_hybrid_ordering_promotes_the_lexical_match(monkeypatch):
+    assert _dense_index(monkeypatch, "1")._search(["delta"], _query(), 4) == [[3, 0, 1, 2]]
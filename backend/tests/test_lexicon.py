@@ -0,0 +1,33 @@
+import pytest
+from lexicon import SymptomLexicon
+
+
+def test_negated_phrases_do_not_count_as_coverage():
+    found = SymptomLexicon().extract("patient denies chest pain")
+    assert found.negated == ["chest pain"]
+    assert found.confidence == 0.0
+
+
+@pytest.mark.parametrize("text", [
+    "headache, not eating and unconscious",
+    "patient denies chest pain",
+    "fever and cough, no convulsions",
+])
+def test_red_flag_text_skips_the_fast_path(engine, monkeypatch, text):
+    monkeypatch.setattr(engine, "fastpath_confidence", 0.75)
+    assert engine._fast_path(text) is None
+
+
+def test_plain_case_takes_the_fast_path(engine, monkeypatch):
+    monkeypatch.setattr(engine, "fastpath_confidence", 0.75)
+    assert engine._fast_path("fever and cough for 3 days") == ["fever", "cough"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("fever, painful urination, blurred vision", ["fever", "painful urination", "blurred vision"]),
+    ("fever and ear pain", ["fever", "ear pain"]),
+    ("no cough, fever", ["fever"]),
+    ("bukhar with khansi", ["fever", "cough"]),
+])
+def test_fallback_keeps_parts_the_lexicon_does_not_know(engine, text, expected):
+    assert engine.extract_symptoms_fallback(text) == expected
@@ -0,0 +1,28 @@
+import pytest
+from redflag import scan_red_flags
+
+
+def _flags(text):
+    return [m.label for m in scan_red_flags(text)]
+
+
+@pytest.mark.parametrize("text, flag", [
+    ("no pulse and unconscious", "unconscious"),
+    ("no response and convulsions", "convulsions"),
+    ("no relief from chest pain", "chest pain"),
+    ("no fever or seizure", "convulsions"),
+    ("no fever, chest pain since morning", "chest pain"),
+    ("patient not responding", "unconscious"),
+])
+def test_negation_does_not_reach_past_the_next_phrase(text, flag):
+    assert flag in _flags(text)
+
+
+@pytest.mark.parametrize("text", [
+    "no chest pain",
+    "denies any chest pain",
+    "no signs of confusion",
+    "fever but no convulsions",
+])
+def test_cue_directly_before_the_phrase_negates_it(text):
+    assert _flags(text) == []
@@ -0,0 +1,14 @@
+import asyncio
+
+
+def test_analyze_case_without_a_running_loop(engine):
+    result = engine.analyze_case("fever and cough")
+    assert result["risk_level"] in ("Low", "Medium", "High")
+
+
+def test_analyze_case_from_inside_a_running_loop(engine):
+    async def caller():
+        return engine.analyze_case("fever and cough")
+
+    result = asyncio.run(caller())
+    assert result["risk_level"] in ("Low", "Medium", "High")
@@ -0,0 +1,22 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+from ratelimit import TokenBucketLimiter
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "_limiter", TokenBucketLimiter(rate=0.001, capacity=10))
+    return TestClient(main.app)
+
+
+def test_batch_larger_than_the_bucket_is_rejected(client):
+    r = client.post("/analyze_cases", json={"texts": ["fever"] * 11})
+    assert r.status_code == 413
+
+
+def test_batch_is_charged_per_case(client):
+    assert main._limiter.allow("testclient", cost=4)
+    r = client.post("/analyze_cases", json={"texts": ["fever"] * 7})
+    assert r.status_code == 429
+    assert main._limiter.allow("testclient", cost=6)
@@ -0,0 +1,21 @@
+import random
+from rerank import GuidelineTermIndex, rerank_naive
+
+
+def test_indexed_rerank_matches_the_naive_scorer(engine):
+    entries = engine.index.entries
+    idx = GuidelineTermIndex(entries)
+    rng = random.Random(7)
+    # Infix, multi-word and cross-word terms exercise the substring semantics.
+    vocab = sorted({t for e in entries for t in e.get("tags", [])} | {"pain", "ache", "ever", "chest pain", "shortness of breath", "not a symptom", "fever and", " cough", "c"})
+    for _ in range(200):
+        contexts = rng.sample(entries, min(rng.randint(1, 20), len(entries)))
+        cleaned = rng.sample(vocab, rng.randint(1, 6))
+        assert idx.rerank(cleaned, contexts) == rerank_naive(cleaned, contexts)
+
+
+def test_each_tag_containing_the_term_counts():
+    entries = [{"title": "a", "guideline": "x", "tags": ["fever", "high fever"]}, {"title": "b", "guideline": "fever", "tags": []}]
+    idx = GuidelineTermIndex(entries)
+    base, tag = idx.scores(["fever"], idx.positions(entries))
+    assert base == [0, 1] and tag == [2, 0]
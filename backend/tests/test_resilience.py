@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from resilience import CircuitBreaker, Upstream
+
+
+def _half_open(up):
+    up.breaker = CircuitBreaker("test", failures=1, window=30, reset=0, ratio=0)
+    up.breaker.failure()
+    assert up.breaker.state == "open"
+
+
+def test_cancelled_probe_releases_the_half_open_slot():
+    up = Upstream("test")
+    _half_open(up)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        probe = asyncio.ensure_future(up.call(slow))
+        await started.wait()
+        assert up.breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def ok():
+            return "ok"
+
+        return await up.call(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert up.breaker.state == "closed"
+
+
+def test_interrupted_sync_probe_releases_the_half_open_slot():
+    up = Upstream("test")
+    _half_open(up)
+
+    def interrupted(timeout):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        up.call_sync(interrupted)
+    assert up.call_sync(lambda t: "ok") == "ok"
+    assert up.breaker.state == "closed"
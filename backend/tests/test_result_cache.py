@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from cache import TTLCache
+
+
+@pytest.fixture
+def fused(engine, monkeypatch):
+    calls = []
+
+    async def decide(mode, text, symptoms, contexts, fallback_mode, timeout=None):
+        calls.append(text)
+        high = "pregnant" in text
+        return {"possible_risk_pattern": "", "risk_level": "High" if high else "Low", "recommended_actions": [], "referral_needed": high, "symptoms": symptoms}, True
+
+    monkeypatch.setattr(engine, "pipeline_mode", "fused")
+    monkeypatch.setattr(engine, "result_cache", TTLCache(maxsize=64, ttl=60))
+    monkeypatch.setattr(engine, "_decide_async", decide)
+    return calls
+
+
+def test_fused_results_are_keyed_on_the_raw_text(engine):
+    a = engine._result_key(["fever", "cough"], mode="fused", text="fever and cough")
+    b = engine._result_key(["fever", "cough"], mode="fused", text="fever and cough, 7 months pregnant")
+    assert a != b
+    assert a == engine._result_key(["cough", "fever"], mode="fused", text="Fever and  cough")
+
+
+def test_fused_case_does_not_reuse_a_result_for_other_text(engine, fused):
+    first = asyncio.run(engine.analyze_case_async("fever and cough"))
+    second = asyncio.run(engine.analyze_case_async("fever and cough, 7 months pregnant"))
+    assert first["risk_level"] == "Low"
+    assert second["risk_level"] == "High" and second["referral_needed"]
+    assert len(fused) == 2
+
+
+def test_fused_batch_does_not_share_results_across_texts(engine, fused):
+    results = asyncio.run(engine.analyze_cases_async(["fever and cough", "fever and cough, 7 months pregnant", "fever and cough"]))
+    assert [r["risk_level"] for r in results] == ["Low", "High", "Low"]
+    assert len(fused) == 2
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from pydantic import ValidationError
+import ann
+from main import AnalyzeRequest, MAX_EF_SEARCH, MAX_NPROBE
+
+
+@pytest.mark.parametrize("params", [
+    {"nprobe": 0},
+    {"nprobe": MAX_NPROBE + 1},
+    {"ef_search": 0},
+    {"ef_search": MAX_EF_SEARCH + 1},
+])
+def test_out_of_range_overrides_are_rejected(params):
+    with pytest.raises(ValidationError):
+        AnalyzeRequest(text="fever", **params)
+
+
+def test_nprobe_is_clamped_to_nlist():
+    x = np.random.default_rng(0).standard_normal((39 * 16, 8)).astype(np.float32)
+    index = ann.build_index(x, dict(ann.index_config(), kind="ivf", codec="f32", nlist=16))
+    assert ann.search_params(index, nprobe=MAX_NPROBE).nprobe == 16
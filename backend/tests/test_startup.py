@@ -0,0 +1,31 @@
+import asyncio
+from startup import Startup
+
+
+def _missing():
+    raise RuntimeError("ffmpeg not found on PATH")
+
+
+def test_optional_component_failure_does_not_gate_readiness():
+    startup = Startup()
+    startup.add("engine", lambda: object())
+    startup.add("ffmpeg", _missing, required=False)
+
+    async def load():
+        await asyncio.gather(*startup.start())
+
+    asyncio.run(load())
+    status = startup.status()
+    assert status["ready"]
+    assert status["components"]["ffmpeg"]["state"] == "failed"
+
+
+def test_required_component_failure_gates_readiness():
+    startup = Startup()
+    startup.add("engine", _missing)
+
+    async def load():
+        await asyncio.gather(*startup.start())
+
+    asyncio.run(load())
+    assert not startup.ready()
@@ -0,0 +1,46 @@
+import asyncio
+import numpy as np
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from fastapi.testclient import TestClient
+import main
+from transcription import QueueFull, StreamSession, TranscriptionService
+
+
+def test_stream_windows_respect_the_queue_bound():
+    svc = TranscriptionService("tiny", workers=1, max_queue=2)
+    svc.running, svc.queued = 1, 2
+    with pytest.raises(QueueFull):
+        asyncio.run(svc.transcribe_pcm(np.zeros(16000, dtype=np.float32), "en"))
+    assert svc.pool is None
+
+
+def test_streams_beyond_the_session_limit_are_closed_with_1013(monkeypatch):
+    monkeypatch.setattr(main, "_STREAM_SLOTS", asyncio.Semaphore(0))
+    with TestClient(main.app).websocket_connect("/transcribe/stream") as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 1013
+
+
+class _FailingService:
+    async def transcribe_pcm(self, pcm, lang_code):
+        raise RuntimeError("worker crashed")
+
+
+def test_failed_partial_decode_is_reported_to_the_client():
+    sent = []
+
+    async def send(msg):
+        sent.append(msg)
+
+    async def scenario():
+        session = StreamSession(_FailingService(), "en", send)
+        session._chunks.append(np.zeros(16000, dtype=np.float32))
+        session._decoding = asyncio.ensure_future(session._partial())
+        await session._decoding
+        with pytest.raises(RuntimeError):
+            await session.feed(b"\x00\x00")
+
+    asyncio.run(scenario())
+    assert sent == [{"type": "error", "error": "Transcription failed: worker crashed"}]
@@ -0,0 +1,370 @@
+import os
+import time
+import uuid
+import asyncio
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait as wait_futures
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import numpy as np
+from audio import load_audio_bytes, SAMPLE_RATE
+from metrics import observe_stage
+
+# Set once per worker process by _init_worker; never touched in the API process.
+_MODEL = None
+
+
+def _init_worker(model_name: str, threads: int) -> None:
+    global _MODEL
+    import torch
+    import whisper
+    if threads > 0:
+        torch.set_num_threads(threads)
+    _MODEL = whisper.load_model(model_name)
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+def _transcribe_job(audio_bytes: bytes, lang_code: str, temp_dir: str) -> Dict[str, Any]:
+    # Stage timings travel back with the result; metrics live in the API process, not the worker.
+    t0 = time.perf_counter()
+    audio_arr = load_audio_bytes(audio_bytes, temp_dir)
+    t1 = time.perf_counter()
+    result = _MODEL.transcribe(audio_arr, language=lang_code, fp16=False)
+    timings = {"ffmpeg": t1 - t0, "whisper": time.perf_counter() - t1}
+    return {"text": result.get("text", "").strip(), "detected": result.get("language", "unknown"), "timings": timings}
+
+
+def _transcribe_pcm_job(pcm: np.ndarray, lang_code: str) -> Dict[str, Any]:
+    # Windows overlap, so earlier text is not fed back in as a prompt.
+    t0 = time.perf_counter()
+    result = _MODEL.transcribe(pcm, language=lang_code, fp16=False, condition_on_previous_text=False)
+    timings = {"whisper": time.perf_counter() - t0}
+    segments = [
+        {"start": float(seg["start"]), "end": float(seg["end"]), "text": seg["text"].strip()}
+        for seg in result.get("segments", [])
+        if seg.get("text", "").strip()
+    ]
+    return {"text": result.get("text", "").strip(), "segments": segments, "timings": timings}
+
+
+def _observe_timings(result: Dict[str, Any], source: str) -> None:
+    for name, seconds in result.pop("timings", {}).items():
+        observe_stage(name, seconds, source=source)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id: str) -> None:
+        self.id = job_id
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = {"job_id": self.id, "status": self.status, "created": self.created}
+        if self.started is not None:
+            out["queued_s"] = round(self.started - self.created, 3)
+        if self.finished is not None and self.started is not None:
+            out["run_s"] = round(self.finished - self.started, 3)
+        if self.result is not None:
+            out["result"] = self.result
+        if self.error is not None:
+            out["error"] = self.error
+        return out
+
+
+class TranscriptionService:
+    def __init__(self, model_name: str, workers: int = 1, max_queue: int = 16, temp_dir: str = None, job_ttl: float = 600.0) -> None:
+        self.model_name = model_name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.temp_dir = temp_dir or tempfile.gettempdir()
+        self.job_ttl = job_ttl
+        self.jobs: Dict[str, Job] = {}
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self._warmups: List[Any] = []
+        self._start_lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.time()
+
+    def start(self) -> None:
+        # Also called from the startup loader thread, hence the lock.
+        with self._start_lock:
+            if self.pool is not None:
+                return
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, threads),
+            )
+            # Spawn every worker now so each loads its model before the first real job arrives.
+            self._warmups = [self.pool.submit(_warmup) for _ in range(self.workers)]
+            self.started_at = time.time()
+
+    def wait_ready(self, timeout: float = None) -> None:
+        # Blocks until every worker has loaded its model; re-raises a worker's load error.
+        self.start()
+        done, pending = wait_futures(self._warmups, timeout=timeout)
+        if pending:
+            raise TimeoutError("whisper workers are still loading")
+        for f in done:
+            f.result()
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _gc(self) -> None:
+        cutoff = time.time() - self.job_ttl
+        for jid in [j.id for j in self.jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self.jobs[jid]
+
+    def _ensure_started(self) -> None:
+        self.start()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+    def _check_capacity(self) -> None:
+        # Uploads and stream windows share one bound: `workers` running plus `max_queue` waiting.
+        if self.queued + self.running >= self.workers + self.max_queue:
+            raise QueueFull(f"transcription queue is full ({self.queued} waiting)")
+
+    def submit(self, audio_bytes: bytes, lang_code: str) -> Job:
+        self._check_capacity()
+        self._ensure_started()
+        self._gc()
+        job = Job(uuid.uuid4().hex)
+        self.jobs[job.id] = job
+        self.queued += 1
+        job.future = asyncio.ensure_future(self._run(job, audio_bytes, lang_code))
+        return job
+
+    async def _run(self, job: Job, audio_bytes: bytes, lang_code: str) -> None:
+        try:
+            async with self._slots:
+                self.queued -= 1
+                self.running += 1
+                job.status = "running"
+                job.started = time.time()
+                try:
+                    loop = asyncio.get_running_loop()
+                    job.result = await loop.run_in_executor(self.pool, _transcribe_job, audio_bytes, lang_code, self.temp_dir)
+                    _observe_timings(job.result, "upload")
+                    job.status = "done"
+                    self.completed += 1
+                except Exception as e:
+                    job.error = str(e)
+                    job.status = "error"
+                    self.failed += 1
+                finally:
+                    job.finished = time.time()
+                    self.running -= 1
+                    self.busy_seconds += job.finished - job.started
+        except asyncio.CancelledError:
+            if job.started is None:
+                self.queued -= 1
+            job.status = "cancelled"
+            job.finished = time.time()
+            raise
+
+    async def transcribe_pcm(self, pcm: np.ndarray, lang_code: str) -> Dict[str, Any]:
+        # Waits for a worker like an upload job does, and raises QueueFull instead of queueing
+        # past max_queue.
+        self._check_capacity()
+        self._ensure_started()
+        self.queued += 1
+        started = None
+        try:
+            async with self._slots:
+                self.queued -= 1
+                self.running += 1
+                started = time.time()
+                try:
+                    loop = asyncio.get_running_loop()
+                    out = await loop.run_in_executor(self.pool, _transcribe_pcm_job, pcm, lang_code)
+                    _observe_timings(out, "stream")
+                    return out
+                finally:
+                    self.running -= 1
+                    self.busy_seconds += time.time() - started
+        except asyncio.CancelledError:
+            if started is None:
+                self.queued -= 1
+            raise
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: Optional[float]) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(job.future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        uptime = max(1e-9, time.time() - self.started_at)
+        return {
+            "workers": self.workers,
+            "started": self.pool is not None,
+            "queue_depth": self.queued,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "utilization": round(self.running / self.workers, 3),
+            "busy_fraction": round(min(1.0, self.busy_seconds / (uptime * self.workers)), 4),
+        }
+
+
+class StreamSession:
+    # One WebSocket recording. Chunks go into a long-lived ffmpeg process that decodes them to
+    # PCM as they arrive. Whisper re-reads only the uncommitted tail, so the cost of each step
+    # depends on the window size and not on the clip length. Once the tail is longer than
+    # commit_after, every segment except the last becomes final and the window moves forward.
+    def __init__(self, service: TranscriptionService, lang_code: str, send: Callable[[Dict[str, Any]], Awaitable[None]],
+                 step: float = 1.0, commit_after: float = 12.0, max_window: float = 25.0) -> None:
+        self.service = service
+        self.lang_code = lang_code
+        self.send = send
+        self.step = int(step * SAMPLE_RATE)
+        self.commit_after = int(commit_after * SAMPLE_RATE)
+        self.max_window = int(max_window * SAMPLE_RATE)
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._decoding: Optional[asyncio.Task] = None
+        self._chunks: List[np.ndarray] = []
+        self._pending = 0
+        self._carry = b""
+        self.pcm = np.zeros(0, dtype=np.float32)
+        self.offset = 0
+        self.finals: List[str] = []
+        # Set when a background partial decode fails; feed() and finish() re-raise it.
+        self.error: Optional[Exception] = None
+
+    async def start(self) -> None:
+        self.proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+            "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self) -> None:
+        while True:
+            data = await self.proc.stdout.read(SAMPLE_RATE * 2)
+            if not data:
+                break
+            data = self._carry + data
+            usable = len(data) - len(data) % 2
+            self._carry = data[usable:]
+            self._chunks.append(np.frombuffer(data[:usable], np.int16).astype(np.float32) / 32768.0)
+            self._pending += usable // 2
+            if self._pending >= self.step and (self._decoding is None or self._decoding.done()):
+                self._decoding = asyncio.ensure_future(self._partial())
+
+    def _take_audio(self) -> None:
+        if self._chunks:
+            self.pcm = np.concatenate([self.pcm] + self._chunks)
+            self._chunks = []
+            self._pending = 0
+
+    async def _partial(self) -> None:
+        # Runs unawaited beside the receive loop, so a failure is reported from here.
+        try:
+            await self._decode(final=False)
+        except Exception as e:
+            self.error = e
+            try:
+                await self.send({"type": "error", "error": f"Transcription failed: {e}"})
+            except Exception:
+                pass
+
+    async def feed(self, chunk: bytes) -> None:
+        if self.error is not None:
+            raise self.error
+        self.proc.stdin.write(chunk)
+        await self.proc.stdin.drain()
+
+    async def _decode(self, final: bool) -> None:
+        self._take_audio()
+        if len(self.pcm) == 0:
+            return
+        upto = len(self.pcm)
+        try:
+            res = await self.service.transcribe_pcm(self.pcm[:upto], self.lang_code)
+        except QueueFull:
+            if final:
+                raise
+            # Skip this partial; the audio stays in the window for the next step.
+            return
+        segs = res["segments"]
+        base = self.offset / SAMPLE_RATE
+        if final or (upto >= self.max_window and len(segs) <= 1):
+            await self._commit(segs, base, upto)
+        elif upto >= self.commit_after and len(segs) > 1:
+            cut = min(upto, int(segs[-1]["start"] * SAMPLE_RATE))
+            await self._commit(segs[:-1], base, cut)
+            await self.send({"type": "partial", "text": segs[-1]["text"], "start": round(self.offset / SAMPLE_RATE, 2)})
+        else:
+            await self.send({"type": "partial", "text": res["text"], "start": round(base, 2)})
+
+    async def _commit(self, segs: List[Dict[str, Any]], base: float, cut: int) -> None:
+        text = " ".join(s["text"] for s in segs).strip()
+        if text:
+            self.finals.append(text)
+            await self.send({"type": "final", "text": text, "start": round(base, 2), "end": round(base + cut / SAMPLE_RATE, 2)})
+        self.pcm = self.pcm[cut:]
+        self.offset += cut
+
+    async def finish(self) -> str:
+        if self.proc.stdin and not self.proc.stdin.is_closing():
+            self.proc.stdin.close()
+        await self._reader
+        if self._decoding is not None:
+            await self._decoding
+        if self.error is not None:
+            raise self.error
+        await self._decode(final=True)
+        text = " ".join(self.finals).strip()
+        await self.send({"type": "done", "text": text})
+        return text
+
+    async def close(self) -> None:
+        for task in (self._reader, self._decoding):
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Retrieve it, so a reader that died with the session is not logged as lost.
+                task.exception()
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+            await self.proc.wait()
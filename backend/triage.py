@@ -1,12 +1,21 @@
 import os
 import json
 import re
-from typing import List, Dict, Any, Literal
+import asyncio
+import threading
+from typing import List, Dict, Any, Literal, Optional, Tuple, AsyncIterator
 from pydantic import BaseModel
-from openai import OpenAI, AsyncOpenAI
-from prompts import symptom_extraction_messages, risk_classification_messages
-from rag import RAGIndex, load_guidelines, embed_documents, retrieve_context
-from redflag import urgent_alert
+from openai import OpenAI, AsyncOpenAI, BadRequestError
+from prompts import symptom_extraction_messages, risk_classification_messages, fused_triage_messages
+from rag import RAGIndex, load_guidelines, load_index, embed_documents, aretrieve_contexts
+from redflag import urgent_alert, build_red_flag_matcher, scan_red_flags
+from knowledge_graph import KnowledgeGraph
+from lexicon import SymptomLexicon
+from guideline_store import diff_entries, file_mtime, validate_entries
+from pipeline import TriagePipeline, AsyncCalls, SyncCalls, run_sync
+from cache import TTLCache, SingleFlight
+from metrics import stage, FALLBACKS
+from resilience import CHAT, stage_timeout
 
 SAFE_WORD_BLACKLIST = {"tablet", "capsule", "syrup", "antibiotic", "ibuprofen", "paracetamol", "medicine", "drug"}
 
@@ -31,10 +40,72 @@ def parse_json(text: str) -> Dict[str, Any]:
                 return {}
         return {}
 
+class RiskClassification(BaseModel):
+    possible_risk_pattern: str
+    risk_level: Literal["Low", "Medium", "High"]
+    recommended_actions: List[str]
+    referral_needed: bool
+
+def validate_classification(data: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        parsed = RiskClassification(**{
+            "possible_risk_pattern": str(data.get("possible_risk_pattern", "")),
+            "risk_level": str(data.get("risk_level", "")) if data.get("risk_level", "") in ["Low", "Medium", "High"] else "Medium",
+            "recommended_actions": [str(x).strip() for x in data.get("recommended_actions", []) if str(x).strip()],
+            "referral_needed": bool(data.get("referral_needed", False))
+        })
+        actions = sanitize_actions(parsed.recommended_actions)
+        return {"possible_risk_pattern": parsed.possible_risk_pattern, "risk_level": parsed.risk_level, "recommended_actions": actions, "referral_needed": parsed.referral_needed}
+    except Exception:
+        actions = data.get("recommended_actions", [])
+        if isinstance(actions, list):
+            actions = sanitize_actions([str(x).strip() for x in actions if str(x).strip()])
+        else:
+            actions = []
+        rl = str(data.get("risk_level", "")).strip()
+        if rl not in ["Low", "Medium", "High"]:
+            rl = "Medium"
+        rn = bool(data.get("referral_needed", False))
+        pr = str(data.get("possible_risk_pattern", "")).strip()
+        return {"possible_risk_pattern": pr, "risk_level": rl, "recommended_actions": actions, "referral_needed": rn}
+
+def parse_symptoms(data: Dict[str, Any]) -> List[str]:
+    arr = data.get("symptoms", [])
+    if isinstance(arr, list):
+        return [str(x).strip() for x in arr if str(x).strip()]
+    return []
+
+def _budget(timeout: Optional[float], stage_name: str) -> float:
+    # Callers without a request deadline (batches, direct calls) get the stage's default share.
+    return stage_timeout(stage_name) if timeout is None else timeout
+
 class TriageEngine:
-    def __init__(self, guidelines_path: str) -> None:
-        self.index = RAGIndex(load_guidelines(guidelines_path))
-        embed_documents(self.index)
+    def __init__(self, guidelines_path: str, graph_path: str = None) -> None:
+        self.guidelines_path = guidelines_path
+        self.guidelines_mtime = file_mtime(guidelines_path)
+        # A guidelines JSON file, or an index directory built by ingest.py for large corpora.
+        self.index = load_index(guidelines_path)
+        self._reload_lock = threading.Lock()
+        # (classification, contexts) per canonical symptom set, or per normalized text in fused
+        # mode; the SOAP note is rebuilt per request.
+        self.result_cache = TTLCache(
+            maxsize=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")),
+        )
+        self._flights = SingleFlight()
+        # "two_call": extract symptoms, retrieve on them, then classify (two chat completions).
+        # "fused": retrieve on locally extracted symptoms, then one completion returns both.
+        self.pipeline_mode = os.getenv("PIPELINE_MODE", "two_call").lower()
+        if self.pipeline_mode not in ("two_call", "fused"):
+            self.pipeline_mode = "two_call"
+        self.graph = KnowledgeGraph(graph_path or os.path.join(os.path.dirname(__file__), "knowledge_graph.json"))
+        self.red_flags = build_red_flag_matcher(self.index.entries)
+        self.lexicon = SymptomLexicon(self.index.entries, self.graph.index.keys())
+        # Cases the lexicon covers at least this well are extracted and classified without the LLM.
+        # 0 disables the fast path.
+        self.fastpath_confidence = float(os.getenv("LOCAL_FASTPATH_CONFIDENCE", "0"))
+        self._pipeline = TriagePipeline(self, AsyncCalls(self))
+        self._sync_pipeline = TriagePipeline(self, SyncCalls(self), coalesce=False)
         self.client = None
         self.async_client = None
         try:
@@ -52,48 +123,41 @@ class TriageEngine:
             self.client = None
             self.async_client = None
 
-    def extract_symptoms_llm(self, text: str) -> List[str]:
+    def _sync_client(self, timeout: float = None) -> OpenAI:
+        return self.client if timeout is None else self.client.with_options(timeout=timeout)
+
+    def extract_symptoms_llm(self, text: str, timeout: float = None) -> List[str]:
         msgs = symptom_extraction_messages(text)
-        res = self.client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
+        res = self._sync_client(timeout).chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
         content = res.choices[0].message.content
-        data = parse_json(content)
-        arr = data.get("symptoms", [])
-        if isinstance(arr, list):
-            return [str(x).strip() for x in arr if str(x).strip()]
-        return []
+        return parse_symptoms(parse_json(content))
 
     def extract_symptoms_fallback(self, text: str) -> List[str]:
+        # Splits on commas and "and"/"with" as before; a part the lexicon recognizes is replaced by
+        # its canonical symptoms (and dropped if they are all negated), any other part is kept as is.
         lowers = text.lower()
-        parts = re.split(r"[;,]|\band\b|\with\b|\n", lowers)
+        matches = self.lexicon.matcher.scan(lowers)
         arr = []
-        for p in parts:
-            p = p.strip()
-            if not p:
-                continue
-            arr.append(p)
-        return arr[:10]
-
-    def classify_risk_llm(self, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool = False) -> Dict[str, Any]:
-        class RiskClassification(BaseModel):
-            possible_risk_pattern: str
-            risk_level: Literal["Low", "Medium", "High"]
-            recommended_actions: List[str]
-            referral_needed: bool
-        related_risks = []
-        try:
-            import json as _json
-            import os as _os
-            kg_path = _os.path.join(_os.path.dirname(__file__), "knowledge_graph.json")
-            with open(kg_path, "r", encoding="utf-8") as f:
-                graph = _json.load(f)
-            sset = {s.lower().strip() for s in symptoms}
-            for s in sset:
-                related_risks.extend(graph.get(s, []))
-        except Exception:
-            related_risks = []
-        msgs = risk_classification_messages(symptoms, contexts, fallback_mode=fallback_mode, related_risks=list(dict.fromkeys(related_risks)))
+        start = 0
+        for m in list(re.finditer(r"[;,\n]|\band\b|\bwith\b", lowers)) + [None]:
+            end = m.start() if m is not None else len(lowers)
+            inside = [x for x in matches if start <= x.start < end]
+            if inside:
+                arr.extend(x.label for x in inside if not x.negated)
+            else:
+                p = lowers[start:end].strip()
+                if p:
+                    arr.append(p)
+            if m is not None:
+                start = m.end()
+        return list(dict.fromkeys(arr))[:10]
+
+    def classify_risk_llm(self, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool = False, timeout: float = None) -> Dict[str, Any]:
+        related_risks = self.graph.related_risks(symptoms)
+        msgs = risk_classification_messages(symptoms, contexts, fallback_mode=fallback_mode, related_risks=related_risks)
+        client = self._sync_client(timeout)
         try:
-            res = self.client.chat.completions.create(
+            res = client.chat.completions.create(
                 model=os.getenv("CHAT_MODEL", "gpt-4o-mini"),
                 messages=msgs,
                 temperature=0,
@@ -101,31 +165,27 @@ class TriageEngine:
             )
             content = res.choices[0].message.content
             data = parse_json(content)
-        except Exception:
-            res = self.client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
+        except BadRequestError:
+            # Models without JSON mode reject response_format; timeouts and 5xx are not retried here.
+            res = client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
             content = res.choices[0].message.content
             data = parse_json(content)
+        return validate_classification(data)
+
+    def triage_llm(self, text: str, contexts: List[Dict[str, Any]], hint_symptoms: List[str], fallback_mode: bool = False, timeout: float = None) -> Dict[str, Any]:
+        msgs = fused_triage_messages(text, contexts, fallback_mode=fallback_mode, related_risks=self.graph.related_risks(hint_symptoms))
+        client = self._sync_client(timeout)
         try:
-            parsed = RiskClassification(**{
-                "possible_risk_pattern": str(data.get("possible_risk_pattern", "")),
-                "risk_level": str(data.get("risk_level", "")) if data.get("risk_level", "") in ["Low", "Medium", "High"] else "Medium",
-                "recommended_actions": [str(x).strip() for x in data.get("recommended_actions", []) if str(x).strip()],
-                "referral_needed": bool(data.get("referral_needed", False))
-            })
-            actions = sanitize_actions(parsed.recommended_actions)
-            return {"possible_risk_pattern": parsed.possible_risk_pattern, "risk_level": parsed.risk_level, "recommended_actions": actions, "referral_needed": parsed.referral_needed}
-        except Exception:
-            actions = data.get("recommended_actions", [])
-            if isinstance(actions, list):
-                actions = sanitize_actions([str(x).strip() for x in actions if str(x).strip()])
-            else:
-                actions = []
-            rl = str(data.get("risk_level", "")).strip()
-            if rl not in ["Low", "Medium", "High"]:
-                rl = "Medium"
-            rn = bool(data.get("referral_needed", False))
-            pr = str(data.get("possible_risk_pattern", "")).strip()
-            return {"possible_risk_pattern": pr, "risk_level": rl, "recommended_actions": actions, "referral_needed": rn}
+            res = client.chat.completions.create(
+                model=os.getenv("CHAT_MODEL", "gpt-4o-mini"),
+                messages=msgs,
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
+        except BadRequestError:
+            res = client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
+        data = parse_json(res.choices[0].message.content)
+        return dict(validate_classification(data), symptoms=parse_symptoms(data))
 
     def classify_risk_fallback(self, symptoms: List[str], contexts: List[Dict[str, Any]]) -> Dict[str, Any]:
         if not contexts:
@@ -152,49 +212,83 @@ class TriageEngine:
                 out.append(a)
         return out
 
-    def analyze_case(self, text: str) -> Dict[str, Any]:
-        if self.client:
-            try:
-                symptoms = self.extract_symptoms_llm(text)
-            except Exception:
-                symptoms = self.extract_symptoms_fallback(text)
-        else:
-            symptoms = self.extract_symptoms_fallback(text)
+    def _build_query(self, text: str, symptoms: List[str]) -> Tuple[List[str], str]:
         cleaned = self._clean_symptoms(symptoms)
         query = " ".join(cleaned) if cleaned else re.sub(r"[^a-zA-Z0-9\\s]", " ", text.lower())
-        print({"query": query, "cleaned_symptoms": cleaned})
-        contexts = retrieve_context(self.index, query, top_k=5)
-        syn = {
-            "shortness of breath": ["breathlessness", "difficulty breathing"],
-            "severe chest pain": ["chest pain"]
-        }
-        match_terms = set(cleaned)
-        for k, vs in syn.items():
-            if k in match_terms:
-                for v in vs:
-                    match_terms.add(v)
-        def _score(c):
-            text = (c.get("title","") + " " + c.get("guideline","")).lower()
-            base = sum(1 for s in match_terms if s in text)
-            tags = c.get("tags", [])
-            tag_score = sum(2 for s in match_terms for t in tags if s in (t or "").lower())
-            if base == 0 and tag_score == 0:
-                return -100
-            return base + tag_score
-        contexts = sorted(contexts, key=_score, reverse=True)[:3]
-        print({"retrieved": [c.get("title","") for c in contexts]})
-        max_score = -100 if not contexts else max(
-            [sum(1 for s in match_terms if s in (c.get("title","") + " " + c.get("guideline","")).lower()) for c in contexts]
-        )
-        fallback_mode = max_score <= 0
-        if self.client:
-            try:
-                result = self.classify_risk_llm(symptoms, contexts, fallback_mode=fallback_mode)
-            except Exception:
-                result = self.classify_risk_fallback(symptoms, contexts)
+        return cleaned, query
+
+    def _fast_path(self, text: str) -> Optional[List[str]]:
+        # Symptoms for a case the lexicon fully accounts for, or None to go through the LLM. Any
+        # red-flag phrase, negated or not, sends the case to the LLM.
+        if self.fastpath_confidence <= 0:
+            return None
+        if self.red_flags.scan(text, negation=False):
+            return None
+        found = self.lexicon.extract(text)
+        if found.symptoms and found.confidence >= self.fastpath_confidence:
+            return found.symptoms
+        return None
+
+    def _result_key(self, cleaned: List[str], search: Dict[str, Any] = None, mode: str = None, index: RAGIndex = None, text: str = "") -> Optional[Tuple]:
+        # Order- and duplicate-insensitive, so "fever, cough" and "cough and fever" share an entry.
+        # Cases with no usable symptoms are retrieved on raw text and are not cached.
+        mode = mode or self.pipeline_mode
+        if mode == "fused":
+            # The fused completion classifies the raw text, which can carry what the lexicon missed
+            # ("7 months pregnant"), so its results are keyed on the normalized text instead.
+            words = " ".join(re.findall(r"[a-z0-9']+", text.lower()))
+            subject = ("text", words) if words else None
         else:
-            result = self.classify_risk_fallback(symptoms, contexts)
-        alert = urgent_alert(result.get("risk_level", ""), symptoms)
+            subject = tuple(sorted(set(cleaned))) if cleaned else None
+        if subject is None:
+            return None
+        return (mode, (index or self.index).version, subject, tuple(sorted((search or {}).items())))
+
+    async def _lookup_result(self, key: Optional[Tuple]) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        if key is None:
+            return None
+        hit = self.result_cache.get(key)
+        if hit is None:
+            hit = await self._flights.wait(key)
+        return hit
+
+    def reload_guidelines(self, path: str = None) -> Dict[str, Any]:
+        # Builds the new index beside the serving one, re-embedding only new or edited guidelines,
+        # then swaps it in. Requests hold the index they started with, so they finish on the old one.
+        with self._reload_lock:
+            path = path or self.guidelines_path
+            mtime = file_mtime(path)
+            current = self.index
+            if os.path.isdir(path):
+                # Already embedded by ingest.py; opening it only maps the new files.
+                index = RAGIndex.open(path, previous=current)
+            else:
+                index = RAGIndex(validate_entries(load_guidelines(path)))
+            report = {"previous_version": current.version, **diff_entries(current.entries, index.entries)}
+            if index.version == current.version:
+                self.guidelines_path, self.guidelines_mtime = path, mtime
+                return {**report, "outcome": "unchanged", "version": current.version, "embedded": 0}
+            if not index.built:
+                embed_documents(index, previous=current)
+            red_flags = build_red_flag_matcher(index.entries)
+            lexicon = SymptomLexicon(index.entries, self.graph.index.keys())
+            self.index = index
+            self.red_flags = red_flags
+            self.lexicon = lexicon
+            self.guidelines_path, self.guidelines_mtime = path, mtime
+            # Keys carry the corpus version already; clearing just frees the stale entries.
+            self.result_cache.clear()
+            return {**report, "outcome": "applied", "version": index.version, "embedded": index.embedded, "dense": index.dense}
+
+    def _rerank(self, cleaned: List[str], contexts: List[Dict[str, Any]], index: RAGIndex = None) -> Tuple[List[Dict[str, Any]], bool]:
+        with stage("rerank"):
+            return (index or self.index).term_index().rerank(cleaned, contexts, keep=3)
+
+    def red_flag_spans(self, text: str) -> List[Dict[str, Any]]:
+        return [{"flag": m.label, "term": m.term, "start": m.start, "end": m.end} for m in scan_red_flags(text, self.red_flags)]
+
+    def _assemble(self, text: str, symptoms: List[str], result: Dict[str, Any], contexts: List[Dict[str, Any]], red_flags: List[Dict[str, Any]] = None, graph_insights: List[str] = None) -> Dict[str, Any]:
+        alert = urgent_alert(result.get("risk_level", ""), symptoms) or bool(red_flags)
         subjective = f"Patient reports: {text}"
         objective = f"Extracted symptoms: {', '.join(symptoms) or 'none'}. Vital signs: none recorded."
         assessment = f"Risk level: {result.get('risk_level','')}. Possible pattern: {result.get('possible_risk_pattern','')}. Urgent: {alert}"
@@ -208,20 +302,10 @@ class TriageEngine:
             "urgent_alert": alert,
             "retrieved_contexts": [{"title": c.get("title",""), "risk": c.get("risk",""), "referral": c.get("referral",False)} for c in contexts]
         }
-        try:
-            import json as _json
-            import os as _os
-            kg_path = _os.path.join(_os.path.dirname(__file__), "knowledge_graph.json")
-            with open(kg_path, "r", encoding="utf-8") as f:
-                graph = _json.load(f)
-            sset = {s.lower().strip() for s in symptoms}
-            related = set()
-            for s in sset:
-                for r in graph.get(s, []):
-                    related.add(r)
-            final["graph_insights"] = list(related)
-        except Exception:
-            final["graph_insights"] = []
+        if graph_insights is None:
+            with stage("graph"):
+                graph_insights = self.graph.related_risks(symptoms)
+        final["graph_insights"] = graph_insights
         final["soap_note"] = {
             "subjective": subjective,
             "objective": objective,
@@ -230,35 +314,52 @@ class TriageEngine:
         }
         return final
 
+    def _extract_symptoms(self, text: str, timeout: float = None) -> List[str]:
+        with stage("extract_symptoms", path="llm") as labels:
+            if self.client:
+                try:
+                    return CHAT.call_sync(lambda t: self.extract_symptoms_llm(text, timeout=t), _budget(timeout, "extract"), stage="extract")
+                except Exception:
+                    FALLBACKS.inc(stage="extract_symptoms")
+            labels["path"] = "fallback"
+            return self.extract_symptoms_fallback(text)
+
+    def _decide(self, mode: str, text: str, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool, timeout: float = None) -> Tuple[Dict[str, Any], bool]:
+        # Sync counterpart of _decide_async; the flag is False when a configured LLM failed.
+        if mode == "local":
+            with stage("classify", path="local"):
+                return self.classify_risk_fallback(symptoms, contexts), True
+        fused = mode == "fused"
+        name = "triage" if fused else "classify"
+        with stage(name, path="llm") as labels:
+            ok = True
+            if self.client:
+                try:
+                    if fused:
+                        call = lambda t: self.triage_llm(text, contexts, symptoms, fallback_mode=fallback_mode, timeout=t)
+                    else:
+                        call = lambda t: self.classify_risk_llm(symptoms, contexts, fallback_mode=fallback_mode, timeout=t)
+                    return CHAT.call_sync(call, _budget(timeout, "decide"), stage="decide"), True
+                except Exception:
+                    FALLBACKS.inc(stage=name)
+                    ok = False
+            labels["path"] = "fallback"
+            result = self.classify_risk_fallback(symptoms, contexts)
+            return (dict(result, symptoms=symptoms) if fused else result), ok
+
+    def analyze_case(self, text: str, search: Dict[str, Any] = None) -> Dict[str, Any]:
+        # Same stage graph as analyze_case_async, driven on the sync loop thread with the sync client.
+        return run_sync(self._sync_pipeline.run(text, search))
+
     async def extract_symptoms_llm_async(self, text: str) -> List[str]:
         msgs = symptom_extraction_messages(text)
         res = await self.async_client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0, response_format={"type": "json_object"})
         content = res.choices[0].message.content
-        data = parse_json(content)
-        arr = data.get("symptoms", [])
-        if isinstance(arr, list):
-            return [str(x).strip() for x in arr if str(x).strip()]
-        return []
+        return parse_symptoms(parse_json(content))
 
     async def classify_risk_llm_async(self, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool = False) -> Dict[str, Any]:
-        class RiskClassification(BaseModel):
-            possible_risk_pattern: str
-            risk_level: Literal["Low", "Medium", "High"]
-            recommended_actions: List[str]
-            referral_needed: bool
-        related_risks = []
-        try:
-            import json as _json
-            import os as _os
-            kg_path = _os.path.join(_os.path.dirname(__file__), "knowledge_graph.json")
-            with open(kg_path, "r", encoding="utf-8") as f:
-                graph = _json.load(f)
-            sset = {s.lower().strip() for s in symptoms}
-            for s in sset:
-                related_risks.extend(graph.get(s, []))
-        except Exception:
-            related_risks = []
-        msgs = risk_classification_messages(symptoms, contexts, fallback_mode=fallback_mode, related_risks=list(dict.fromkeys(related_risks)))
+        related_risks = self.graph.related_risks(symptoms)
+        msgs = risk_classification_messages(symptoms, contexts, fallback_mode=fallback_mode, related_risks=related_risks)
         try:
             res = await self.async_client.chat.completions.create(
                 model=os.getenv("CHAT_MODEL", "gpt-4o-mini"),
@@ -268,106 +369,137 @@ class TriageEngine:
             )
             content = res.choices[0].message.content
             data = parse_json(content)
-        except Exception:
+        except BadRequestError:
+            # Models without JSON mode reject response_format; timeouts and 5xx are not retried here.
             res = await self.async_client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
             content = res.choices[0].message.content
             data = parse_json(content)
+        return validate_classification(data)
+
+    async def triage_llm_async(self, text: str, contexts: List[Dict[str, Any]], hint_symptoms: List[str], fallback_mode: bool = False) -> Dict[str, Any]:
+        msgs = fused_triage_messages(text, contexts, fallback_mode=fallback_mode, related_risks=self.graph.related_risks(hint_symptoms))
         try:
-            parsed = RiskClassification(**{
-                "possible_risk_pattern": str(data.get("possible_risk_pattern", "")),
-                "risk_level": str(data.get("risk_level", "")) if data.get("risk_level", "") in ["Low", "Medium", "High"] else "Medium",
-                "recommended_actions": [str(x).strip() for x in data.get("recommended_actions", []) if str(x).strip()],
-                "referral_needed": bool(data.get("referral_needed", False))
-            })
-            actions = sanitize_actions(parsed.recommended_actions)
-            return {"possible_risk_pattern": parsed.possible_risk_pattern, "risk_level": parsed.risk_level, "recommended_actions": actions, "referral_needed": parsed.referral_needed}
-        except Exception:
-            actions = data.get("recommended_actions", [])
-            if isinstance(actions, list):
-                actions = sanitize_actions([str(x).strip() for x in actions if str(x).strip()])
-            else:
-                actions = []
-            rl = str(data.get("risk_level", "")).strip()
-            if rl not in ["Low", "Medium", "High"]:
-                rl = "Medium"
-            rn = bool(data.get("referral_needed", False))
-            pr = str(data.get("possible_risk_pattern", "")).strip()
-            return {"possible_risk_pattern": pr, "risk_level": rl, "recommended_actions": actions, "referral_needed": rn}
-
-    async def analyze_case_async(self, text: str) -> Dict[str, Any]:
-        if self.async_client:
-            try:
-                symptoms = await self.extract_symptoms_llm_async(text)
-            except Exception:
-                symptoms = self.extract_symptoms_fallback(text)
-        else:
-            symptoms = self.extract_symptoms_fallback(text)
-        cleaned = self._clean_symptoms(symptoms)
-        query = " ".join(cleaned) if cleaned else re.sub(r"[^a-zA-Z0-9\\s]", " ", text.lower())
-        print({"query": query, "cleaned_symptoms": cleaned})
-        contexts = retrieve_context(self.index, query, top_k=5)
-        syn = {
-            "shortness of breath": ["breathlessness", "difficulty breathing"],
-            "severe chest pain": ["chest pain"]
-        }
-        match_terms = set(cleaned)
-        for k, vs in syn.items():
-            if k in match_terms:
-                for v in vs:
-                    match_terms.add(v)
-        def _score(c):
-            text = (c.get("title","") + " " + c.get("guideline","")).lower()
-            base = sum(1 for s in match_terms if s in text)
-            tags = c.get("tags", [])
-            tag_score = sum(2 for s in match_terms for t in tags if s in (t or "").lower())
-            if base == 0 and tag_score == 0:
-                return -100
-            return base + tag_score
-        contexts = sorted(contexts, key=_score, reverse=True)[:3]
-        print({"retrieved": [c.get("title","") for c in contexts]})
-        max_score = -100 if not contexts else max(
-            [sum(1 for s in match_terms if s in (c.get("title","") + " " + c.get("guideline","")).lower()) for c in contexts]
-        )
-        fallback_mode = max_score <= 0
-        if self.async_client:
-            try:
-                result = await self.classify_risk_llm_async(symptoms, contexts, fallback_mode=fallback_mode)
-            except Exception:
-                result = self.classify_risk_fallback(symptoms, contexts)
-        else:
-            result = self.classify_risk_fallback(symptoms, contexts)
-        alert = urgent_alert(result.get("risk_level", ""), symptoms)
-        subjective = f"Patient reports: {text}"
-        objective = f"Extracted symptoms: {', '.join(symptoms) or 'none'}. Vital signs: none recorded."
-        assessment = f"Risk level: {result.get('risk_level','')}. Possible pattern: {result.get('possible_risk_pattern','')}. Urgent: {alert}"
-        plan = f"Recommended actions: {', '.join(result.get('recommended_actions', [])) or 'none'}. Referral needed: {'yes' if result.get('referral_needed', False) else 'no'}. Follow-up advice: monitor and seek professional help."
-        final = {
-            "symptoms": symptoms,
-            "possible_risk_pattern": result.get("possible_risk_pattern", ""),
-            "risk_level": result.get("risk_level", ""),
-            "recommended_actions": result.get("recommended_actions", []),
-            "referral_needed": result.get("referral_needed", False),
-            "urgent_alert": alert,
-            "retrieved_contexts": [{"title": c.get("title",""), "risk": c.get("risk",""), "referral": c.get("referral",False)} for c in contexts]
-        }
+            res = await self.async_client.chat.completions.create(
+                model=os.getenv("CHAT_MODEL", "gpt-4o-mini"),
+                messages=msgs,
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
+        except BadRequestError:
+            res = await self.async_client.chat.completions.create(model=os.getenv("CHAT_MODEL", "gpt-4o-mini"), messages=msgs, temperature=0)
+        data = parse_json(res.choices[0].message.content)
+        return dict(validate_classification(data), symptoms=parse_symptoms(data))
+
+    async def _extract_symptoms_async(self, text: str, timeout: float = None) -> List[str]:
+        # Timeouts and an open circuit land in the same local fallback as an upstream error.
+        with stage("extract_symptoms", path="llm") as labels:
+            if self.async_client:
+                try:
+                    return await CHAT.call(lambda: self.extract_symptoms_llm_async(text), _budget(timeout, "extract"), stage="extract")
+                except Exception:
+                    FALLBACKS.inc(stage="extract_symptoms")
+            labels["path"] = "fallback"
+            return self.extract_symptoms_fallback(text)
+
+    async def _classify_async(self, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool, timeout: float = None) -> Tuple[Dict[str, Any], bool]:
+        # The flag is False when a configured LLM failed; such degraded results are not cached.
+        with stage("classify", path="llm") as labels:
+            ok = True
+            if self.async_client:
+                try:
+                    call = lambda: self.classify_risk_llm_async(symptoms, contexts, fallback_mode=fallback_mode)
+                    return await CHAT.call(call, _budget(timeout, "decide"), stage="decide"), True
+                except Exception:
+                    FALLBACKS.inc(stage="classify")
+                    ok = False
+            labels["path"] = "fallback"
+            return self.classify_risk_fallback(symptoms, contexts), ok
+
+    async def _triage_async(self, text: str, hint_symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool, timeout: float = None) -> Tuple[Dict[str, Any], bool]:
+        # Fused mode's single completion; the result carries "symptoms" alongside the classification.
+        with stage("triage", path="llm") as labels:
+            ok = True
+            if self.async_client:
+                try:
+                    call = lambda: self.triage_llm_async(text, contexts, hint_symptoms, fallback_mode=fallback_mode)
+                    return await CHAT.call(call, _budget(timeout, "decide"), stage="decide"), True
+                except Exception:
+                    FALLBACKS.inc(stage="triage")
+                    ok = False
+            labels["path"] = "fallback"
+            return dict(self.classify_risk_fallback(hint_symptoms, contexts), symptoms=hint_symptoms), ok
+
+    async def _decide_async(self, mode: str, text: str, symptoms: List[str], contexts: List[Dict[str, Any]], fallback_mode: bool, timeout: float = None) -> Tuple[Dict[str, Any], bool]:
+        if mode == "fused":
+            return await self._triage_async(text, symptoms, contexts, fallback_mode, timeout)
+        if mode == "local":
+            with stage("classify", path="local"):
+                return self.classify_risk_fallback(symptoms, contexts), True
+        return await self._classify_async(symptoms, contexts, fallback_mode, timeout)
+
+    async def analyze_case_events(self, text: str, search: Dict[str, Any] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        # Yields (stage, payload) as each stage completes; the last event is ("result", <AnalyzeResponse dict>)
+        # and the one before it ("timings", ...) reports per-stage time and the latency the overlap saved.
+        # Red flags in the raw text are announced before the LLM answers. In fused mode the symptoms
+        # events follow the contexts event, since the LLM returns them.
+        async for event in self._pipeline.events(text, search):
+            yield event
+
+    async def analyze_case_async(self, text: str, search: Dict[str, Any] = None, timings: Dict[str, Any] = None) -> Dict[str, Any]:
+        return await self._pipeline.run(text, search, timings)
+
+    async def iter_cases_async(self, texts: List[str], concurrency: int = None) -> AsyncIterator[Dict[str, Any]]:
+        if not texts:
+            return
+        if concurrency is None:
+            concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def _extract(t: str, mode: str, local: Optional[List[str]]) -> List[str]:
+            if local is not None:
+                return local
+            if mode == "fused":
+                return self.extract_symptoms_fallback(t)
+            async with sem:
+                return await self._extract_symptoms_async(t)
+
+        # The whole batch runs against the index in place when it started, across any reload.
+        index = self.index
+        local_list = [self._fast_path(t) for t in texts]
+        modes = ["local" if local is not None else self.pipeline_mode for local in local_list]
+        symptoms_list = await asyncio.gather(*(_extract(t, m, l) for t, m, l in zip(texts, modes, local_list)))
+        built = [self._build_query(t, s) for t, s in zip(texts, symptoms_list)]
+        keys = [self._result_key(cleaned, mode=m, index=index, text=t) for t, (cleaned, _), m in zip(texts, built, modes)]
+        cached = [self.result_cache.get(k) if k is not None else None for k in keys]
+        # Cases sharing a key within the batch are retrieved and classified once, by the first of them.
+        owner: Dict[Tuple, int] = {}
+        for i, k in enumerate(keys):
+            if k is not None and cached[i] is None:
+                owner.setdefault(k, i)
+        misses = [i for i in range(len(texts)) if cached[i] is None and (keys[i] is None or owner[keys[i]] == i)]
+        # One embeddings call and one FAISS search for all cache misses in the batch.
+        contexts_list = await aretrieve_contexts(index, [built[i][1] for i in misses], top_k=5, embed_timeout=stage_timeout("retrieve")) if misses else []
+        reranked = {i: self._rerank(built[i][0], ctx, index) for i, ctx in zip(misses, contexts_list)}
+
+        async def _result(i: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+            if cached[i] is not None:
+                return cached[i]
+            contexts, fallback_mode = reranked[i]
+            async with sem:
+                result, ok = await self._decide_async(modes[i], texts[i], symptoms_list[i], contexts, fallback_mode)
+            if ok and keys[i] is not None:
+                self.result_cache.set(keys[i], (result, contexts))
+            return result, contexts
+
+        runs = {i: asyncio.ensure_future(_result(i)) for i in range(len(texts)) if cached[i] is not None or i in reranked}
+        tasks = [runs[i] if i in runs else runs[owner[keys[i]]] for i in range(len(texts))]
         try:
-            import json as _json
-            import os as _os
-            kg_path = _os.path.join(_os.path.dirname(__file__), "knowledge_graph.json")
-            with open(kg_path, "r", encoding="utf-8") as f:
-                graph = _json.load(f)
-            sset = {s.lower().strip() for s in symptoms}
-            related = set()
-            for s in sset:
-                for r in graph.get(s, []):
-                    related.add(r)
-            final["graph_insights"] = list(related)
-        except Exception:
-            final["graph_insights"] = []
-        final["soap_note"] = {
-            "subjective": subjective,
-            "objective": objective,
-            "assessment": assessment,
-            "plan": plan
-        }
-        return final
+            for i, t in enumerate(tasks):
+                result, contexts = await t
+                yield self._assemble(texts[i], result.get("symptoms", symptoms_list[i]), result, contexts, self.red_flag_spans(texts[i]))
+        finally:
+            for t in runs.values():
+                t.cancel()
+
+    async def analyze_cases_async(self, texts: List[str], concurrency: int = None) -> List[Dict[str, Any]]:
+        return [r async for r in self.iter_cases_async(texts, concurrency=concurrency)]
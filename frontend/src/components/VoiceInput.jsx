@@ -1,6 +1,8 @@
 import { useEffect, useRef, useState } from 'react'
 
 const BACKEND_URL = 'http://127.0.0.1:8000'
+const STREAM_URL = `${BACKEND_URL.replace(/^http/, 'ws')}/transcribe/stream`
+const STREAM_TIMESLICE_MS = 500
 
 export default function VoiceInput({ onSubmit, loading, language = 'hi', addAgentLog }) {
   const [text, setText] = useState('')
@@ -22,54 +24,128 @@ export default function VoiceInput({ onSubmit, loading, language = 'hi', addAgen
     onSubmit(text.trim())
   }
 
+  const uploadRecording = async () => {
+    const blob = new Blob(chunksRef.current, { type: 'audio/webm' })
+    const form = new FormData()
+    form.append('language', language)
+    form.append('audio', blob, 'audio.webm')
+    addAgentLog?.('Agent A: Uploading audio for transcription…')
+
+    try {
+      const res = await fetch(`${BACKEND_URL}/transcribe`, {
+        method: 'POST',
+        body: form,
+      })
+
+      if (!res.ok) {
+        throw new Error(`Server error: ${res.statusText}`)
+      }
+
+      const data = await res.json()
+
+      if (data.error) {
+        addAgentLog?.(`Agent A: Transcription error (${data.error}).`)
+        return
+      }
+
+      const transcribed = data.text?.trim() || ''
+      addAgentLog?.(transcribed ? 'Agent A: Transcription completed.' : 'Agent A: No speech detected.')
+
+      if (!transcribed) {
+        return
+      }
+
+      setText(transcribed)
+    } catch (err) {
+      addAgentLog?.(`Agent A: Transcription failed (${err.message}).`)
+    }
+  }
+
+  // Streams chunks to /transcribe/stream while recording so partial text shows up within about a second.
+  // If the socket cannot be used, the whole clip is uploaded to /transcribe when recording stops.
+  const openStream = () => {
+    const finals = []
+    const state = { ok: false, failed: false, done: null }
+    let ws
+    try {
+      ws = new WebSocket(`${STREAM_URL}?language=${encodeURIComponent(language)}`)
+      ws.binaryType = 'arraybuffer'
+    } catch {
+      state.failed = true
+      return { ws: null, state }
+    }
+    state.done = new Promise((resolve) => {
+      ws.onopen = () => {
+        state.ok = true
+      }
+      ws.onmessage = (e) => {
+        let msg
+        try {
+          msg = JSON.parse(e.data)
+        } catch {
+          return
+        }
+        if (msg.type === 'partial') {
+          setText([...finals, msg.text].join(' ').trim())
+        } else if (msg.type === 'final') {
+          finals.push(msg.text)
+          setText(finals.join(' ').trim())
+        } else if (msg.type === 'done') {
+          setText(msg.text?.trim() || finals.join(' ').trim())
+          resolve(true)
+        } else if (msg.type === 'error') {
+          addAgentLog?.(`Agent A: Streaming transcription error (${msg.error}).`)
+          state.failed = true
+          resolve(false)
+        }
+      }
+      ws.onerror = () => {
+        state.failed = true
+        resolve(false)
+      }
+      ws.onclose = () => resolve(state.ok && !state.failed)
+    })
+    return { ws, state }
+  }
+
   const startRecording = async () => {
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ audio: true })
       const mr = new MediaRecorder(stream)
+      const live = openStream()
+      let sending = Promise.resolve()
       chunksRef.current = []
       addAgentLog?.(`Agent A: Recording started (${language}).`)
       mr.ondataavailable = (e) => {
-        if (e.data && e.data.size > 0) chunksRef.current.push(e.data)
+        if (e.data && e.data.size > 0) {
+          chunksRef.current.push(e.data)
+          if (live.ws && live.ws.readyState === WebSocket.OPEN && !live.state.failed) {
+            const data = e.data
+            sending = sending.then(() => data.arrayBuffer()).then((buf) => live.ws.send(buf))
+          } else {
+            // A chunk the server never saw (e.g. the container header) leaves the stream undecodable.
+            live.state.failed = true
+          }
+        }
       }
       mr.onstop = async () => {
-        const blob = new Blob(chunksRef.current, { type: 'audio/webm' })
-        const form = new FormData()
-        form.append('language', language)
-        form.append('audio', blob, 'audio.webm')
-        addAgentLog?.('Agent A: Uploading audio for transcription…')
-
         try {
-          const res = await fetch(`${BACKEND_URL}/transcribe`, {
-            method: 'POST',
-            body: form,
-          })
-
-          if (!res.ok) {
-            throw new Error(`Server error: ${res.statusText}`)
-          }
-
-          const data = await res.json()
-
-          if (data.error) {
-            addAgentLog?.(`Agent A: Transcription error (${data.error}).`)
-            return
+          if (live.ws && live.state.ok && !live.state.failed && live.ws.readyState === WebSocket.OPEN) {
+            await sending
+            live.ws.send('end')
+            addAgentLog?.('Agent A: Finalizing live transcription…')
+            if (await live.state.done) {
+              addAgentLog?.('Agent A: Transcription completed.')
+              return
+            }
           }
-
-          const transcribed = data.text?.trim() || ''
-          addAgentLog?.(transcribed ? 'Agent A: Transcription completed.' : 'Agent A: No speech detected.')
-
-          if (!transcribed) {
-            return
-          }
-
-          setText(transcribed)
-        } catch (err) {
-          addAgentLog?.(`Agent A: Transcription failed (${err.message}).`)
+          live.ws?.close()
+          await uploadRecording()
         } finally {
           stream.getTracks().forEach(track => track.stop())
         }
       }
-      mr.start()
+      mr.start(STREAM_TIMESLICE_MS)
       mediaRecorderRef.current = mr
       setRecording(true)
     } catch (e) {